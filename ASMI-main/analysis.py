@@ -7,10 +7,21 @@ import sys
 import time
 import numpy as np
 import matplotlib.pyplot as pyplot
-from scipy.optimize import curve_fit
 import os
+import contact_detector
+import hertz_fit
+import force_correction
+import analysis_cache
 
-files = os.listdir(r"C:\Users\jjtsu\OneDrive\Desktop\Indenter\ASMI-main") #change to correct directory for your device!!!
+VERSION = 3  # changed whenever the analysis of a well changes, so analyses made before are not read back
+
+directory = os.environ.get("ASMI_DIR", r"C:\Users\jjtsu\OneDrive\Desktop\Indenter\ASMI-main") #change to correct directory for your device!!!
+contact_method = None #contact detector to use, see contact_detector, None uses the one each well was indented with
+well_plate = "standard"  # table of correction factors for the well plate, see force_correction
+interpolate_correction = False  # interpolate the correction factors between heights and poisson's ratios
+use_cache = True  # read back analyses of wells made before with the same settings, see analysis_cache
+cols = ["A", "B", "C", "D", "E", "F", "G", "H"]
+rows = ["1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "12"]
 
 
 def load_csv(): #load data from csv file
@@ -22,12 +33,16 @@ def load_csv(): #load data from csv file
             " type ls in the command window, then rerun this program. Note, please do not type in the .csv, just enter "
             "the name of the file. ")
         filename = filename + ".csv"
-        if filename in files:
+        if filename in os.listdir(directory):
             print("File was found")
             bad_name = False
         else:
             print("File was not found, please try again")
    print(filename)
+   return read_csv(filename)
+
+
+def read_csv(filename): #rows of a data file, without the empty ones
    with open(filename, 'r') as file:
        reader = csv.reader(file)
        data = list(reader)
@@ -38,36 +53,48 @@ def load_csv(): #load data from csv file
    return cleaned_data
 
 
-def collect_run_data(data, well): #collect data for specific run from csv file
+def well_contact_method(well_rows): #contact detector to find contact in a well with, the one it was indented with
+    #unless contact_method is set. The measure programs save it at the end of the baseline row of each well
+    if contact_method is not None:
+        return contact_method
+    if well_rows[0][-1] in contact_detector.DETECTORS:
+        return well_rows[0][-1]
+    if len(well_rows) > 1 and len(well_rows[1]) > 4: #saved the count of each row but not the detector, which was
+        # the default one for nearly every run made by those versions
+        return contact_detector.DETECTOR
+    return "threshold" #saved before there was a choice of detector
+
+
+def well_run_array(data, well): #collect data for specific run from csv file, [] if there is no data for the well
+    well_rows = []
     well_data = []
-    no_contact = []
     run_array = []
     forces = []
     for i in range(0, len(data)):
         if data[i][0] == well: #collect data from specified well
-            values = [data[i][1], data[i][2]]
+            well_rows.append(data[i])
+            count = data[i][-1] if len(data[i]) > 4 else 1 #number of measurements averaged into the row
+            values = [data[i][1], data[i][2], count]
             well_data.append(values)
     #print(well_data)
     #print("\n")
     if len(well_data) == 0:
         print("Well was not tested")
-        sys.exit()
+        return []
+    contact_index, confidence = contact_detector.find_contact(well_contact_method(well_rows), float(well_data[0][0]),
+                                                              float(well_data[0][1]),
+                                                              [-1*float(row[1]) for row in well_data[1:]],
+                                                              [float(row[2]) for row in well_data[1:]]) #determine which measurements correspond to contact
     for l in range(1, len(well_data)):
-        if float(well_data[l][1]) <= -1*float(well_data[0][0]) + 2*float(well_data[0][1]): #determine which measurements correspond to contact
-            no_contact.append(l)
-        run_array.append([well_data[l][0], well_data[l][1]])
+        noise = float(well_data[0][1]) / np.sqrt(float(well_data[l][2])) #noise of the averaged measurement
+        run_array.append([well_data[l][0], well_data[l][1], noise])
     #print(run_array)
     #print("\n")
-    #print(no_contact)
-    #print("\n")
-    if len(run_array) - int(no_contact[len(no_contact) - 1]) <= 10: #check if no or not enough data was collected for well
+    if contact_index is None or round(float(run_array[contact_index][0]) - float(run_array[-1][0]), 2) < contact_detector.MIN_CONTACT_DEPTH: #check if no or not enough data was collected for well
         print("Either well was not tested or no data was collected, either because sample was too short or too soft")
-        run_array = []
-        sys.exit()
-    if len(no_contact) > 0: #find index of first continuous contact measurement
-        start_val = int(no_contact[len(no_contact)-1]+1)
-    else:
-        start_val = 0
+        return []
+    print(f"Contact found with {round(confidence * 100, 1)}% confidence")
+    start_val = contact_index + 1 #index of first continuous contact measurement, the first row is the baseline
     #print(start_val)
     #print(len(well_data))
     #print(run_array[start_val][0])
@@ -77,8 +104,11 @@ def collect_run_data(data, well): #collect data for specific run from csv file
         forces.append(run_array[k][1])
     if forces == [] or max(forces)-min(forces) < 0.04: #check that force measurements were large enough to make proper measurement
         print("Either well was not tested or no data was collected, either because sample was too short or too soft")
-        run_array = []
-        sys.exit()
+        return []
+    return run_array
+
+
+def ask_p_ratio():
     get_ratio = True
     while get_ratio: #obtain Poisson's ratios for specified sample
         p_ratio = input("What is the approximate Poisson's Ratio of the sample? Value should be between 0.3-0.5. ")
@@ -88,17 +118,19 @@ def collect_run_data(data, well): #collect data for specific run from csv file
             get_ratio = False
         else:
             print("Improper Poisson's Ratio, please try again.")
-    return run_array, p_ratio
+    return p_ratio
+
 
 def approximate_height(run_array): #find height of sample to determine correction equation used
     depths = []
     for i in range(0, len(run_array)):
         depths.append(run_array[i][0])
+    distances = []
     for j in range(0, len(depths)):
-        depths[j] = abs(depths[j])
-    zero = min(depths)
-    num = depths.index(zero)
-    z_pos = (num * 0.02) + 3
+        distances.append(abs(depths[j]))
+    zero = min(distances)
+    num = distances.index(zero)
+    z_pos = (depths[num] - depths[0]) + 3 #from how far below the first measurement contact was, not how many rows
     approx_height = 15 - z_pos
     #print(approx_height)
     return approx_height
@@ -121,143 +153,12 @@ def find_d_and_f_in_range(run_array): #select data within desired depth range to
             #print(i)
     return depths, forces
 
+def correction_factors(p_ratio, approx_height): #b and c of the correction for the poisson's ratio and height of a sample
+    return force_correction.factors(p_ratio, approx_height, well_plate, interpolate_correction)
+
+
 def correct_force(depths, forces, p_ratio, approx_height): #add correction factor based on simulation data since samples are not ideal shapes
-    new_array = []
-    for i in range(0, len(depths)):
-        if p_ratio < 0.325:
-            if approx_height >= 9.5:
-                b = 0.13
-                c = 1.24
-            elif approx_height >= 8.5 and approx_height < 9.5:
-                b = 0.131
-                c = 1.24
-            elif approx_height >= 7.5 and approx_height < 8.5:
-                b = 0.133
-                c = 1.25
-            elif approx_height >= 6.5 and approx_height < 7.5:
-                b = 0.132
-                c = 1.24
-            elif approx_height >= 5.5 and approx_height < 6.5:
-                b = 0.132
-                c = 1.24
-            elif approx_height >= 4.5 and approx_height < 5.5:
-                b = 0.139
-                c = 1.27
-            elif approx_height >= 3.5 and approx_height < 4.5:
-                b = 0.149
-                c = 1.3
-            else:
-                b = 0.162
-                c = 1.38
-        elif p_ratio >= 0.325 and p_ratio < 0.375:
-            if approx_height >= 9.5:
-                b = 0.132
-                c = 1.25
-            elif approx_height >= 8.5 and approx_height < 9.5:
-                b = 0.132
-                c = 1.25
-            elif approx_height >= 7.5 and approx_height < 8.5:
-                b = 0.134
-                c = 1.25
-            elif approx_height >= 6.5 and approx_height < 7.5:
-                b = 0.136
-                c = 1.26
-            elif approx_height >= 5.5 and approx_height < 6.5:
-                b = 0.126
-                c = 1.25
-            elif approx_height >= 4.5 and approx_height < 5.5:
-                b = 0.133
-                c = 1.27
-            elif approx_height >= 3.5 and approx_height < 4.5:
-                b = 0.144
-                c = 1.32
-            else:
-                b = 0.169
-                c = 1.42
-        elif p_ratio >= 0.375 and p_ratio < 0.425:
-            if approx_height >= 9.5:
-                b = 0.181
-                c = 1.33
-            elif approx_height >= 8.5 and approx_height < 9.5:
-                b = 0.182
-                c = 1.34
-            elif approx_height >= 7.5 and approx_height < 8.5:
-                b = 0.183
-                c = 1.34
-            elif approx_height >= 6.5 and approx_height < 7.5:
-                b = 0.183
-                c = 1.34
-            elif approx_height >= 5.5 and approx_height < 6.5:
-                b = 0.194
-                c = 1.38
-            elif approx_height >= 4.5 and approx_height < 5.5:
-                b = 0.198
-                c = 1.4
-            elif approx_height >= 3.5 and approx_height < 4.5:
-                b = 0.203
-                c = 1.44
-            else:
-                b = 0.176
-                c = 1.46
-        elif p_ratio >= 0.425 and p_ratio < 0.475:
-            if approx_height >= 9.5:
-                b = 0.156
-                c = 1.35
-            elif approx_height >= 8.5 and approx_height < 9.5:
-                b = 0.152
-                c = 1.34
-            elif approx_height >= 7.5 and approx_height < 8.5:
-                b = 0.156
-                c = 1.35
-            elif approx_height >= 6.5 and approx_height < 7.5:
-                b = 0.161
-                c = 1.37
-            elif approx_height >= 5.5 and approx_height < 6.5:
-                b = 0.153
-                c = 1.37
-            elif approx_height >= 4.5 and approx_height < 5.5:
-                b = 0.166
-                c = 1.42
-            elif approx_height >= 3.5 and approx_height < 4.5:
-                b = 0.179
-                c = 1.47
-            else:
-                b = 0.205
-                c = 1.59
-        else:
-            if approx_height >= 9.5:
-                b = 0.203
-                c = 1.58
-            elif approx_height >= 8.5 and approx_height < 9.5:
-                b = 0.207
-                c = 1.6
-            elif approx_height >= 7.5 and approx_height < 8.5:
-                b = 0.212
-                c = 1.62
-            elif approx_height >= 6.5 and approx_height < 7.5:
-                b = 0.217
-                c = 1.65
-            elif approx_height >= 5.5 and approx_height < 6.5:
-                b = 0.21
-                c = 1.64
-            elif approx_height >= 4.5 and approx_height < 5.5:
-                b = 0.22
-                c = 1.68
-            elif approx_height >= 3.5 and approx_height < 4.5:
-                b = 0.17
-                c = 1.58
-            else:
-                b = 0.182
-                c = 1.64
-        val = (forces[i])/(c*pow(depths[i], b))
-        new_array.append(val)
-    return new_array
-
-
-def adjust_depth(run_array, d0): #using curve fit, adjust depth so that at zero force, depth is 0
-    for i in range(0, len(run_array)):
-        run_array[i][0] = run_array[i][0]-d0
-    return run_array
+    return force_correction.correct(depths, forces, p_ratio, approx_height, well_plate, interpolate_correction)
 
 
 def find_E(A, p_ratio): #determine elastic modulus from curve fit
@@ -278,142 +179,138 @@ def adjust_E(E): #an empirical correction factor for softer samples which causes
     return E
 
 
+def analysis_key(well_rows, p_ratio): #key of the analysis of a well in analysis_cache, from the rows of the well
+    detection = [well_contact_method(well_rows), contact_detector.MIN_STDEV, contact_detector.THRESHOLD_SIGMA,
+                 contact_detector.CUSUM_DRIFT, contact_detector.CUSUM_LIMIT, contact_detector.SLOPE_WINDOW,
+                 contact_detector.SLOPE_SIGMA, contact_detector.MIN_CONTACT_DEPTH]  # where contact is found
+    return analysis_cache.key(well_rows, p_ratio, VERSION, detection, hertz_fit.WINDOW, hertz_fit.VERSION,
+                              force_correction.VERSION, well_plate, interpolate_correction)
 
-data = load_csv()
-#print(data)
-cols = ["A", "B", "C", "D", "E", "F", "G", "H"]
-rows = ["1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "12"]
-invalid = True
-while invalid: #obtain well to be analyzed
-   well = input("Enter a well: ")
-   if well[0] not in cols or well.lstrip("ABCDEFGH") not in rows: #error check if invalid well is entered
-       print("Error, please try again")
-   else:
-       invalid = False
-run_array, p_ratio = collect_run_data(data, well)
-well_data = run_array
-#print(run_array)
-depths, forces = split(run_array)
-height = approximate_height(run_array)
-#pyplot.scatter(depths, forces)
-#pyplot.show()
-#print(depths)
-#print(forces)
-well_depths = depths
-well_forces = forces
-depth_in_range, force_in_range = find_d_and_f_in_range(run_array)
-#print(depth_in_range)
-#print(force_in_range)
-adjusted_forces = correct_force(depth_in_range, force_in_range, p_ratio, height)
-#print(adjusted_forces)
-depth_in_range = np.asarray(depth_in_range)
-adjusted_forces = np.asarray(adjusted_forces)
-
-
-def Hertz_func(depth, A, d0):
-  F = A * pow(depth - d0, 1.5)
-  return F
-
-
-
-try: #fit data to Hertzian contact mechanics
-    parameters, covariance = curve_fit(Hertz_func, depth_in_range, adjusted_forces, p0=[2, 0.03])
-except:
-    print("Data could not be analyzed")
-    sys.exit()
-else:
-
-    #print(depth_in_range)
-    #print(force_in_range)
-
-
-    fit_A = float(parameters[0])
-    fit_d0 = float(parameters[1])
-    #print(fit_A)
-    #print(fit_d0)
-    #pyplot.scatter(depth_in_range, adjusted_forces)
-    #y_var = []
-    #for i in range(0, len(depth_in_range)):
-        #y_var.append(fit_A * pow(depth_in_range[i], 1.5))
-    #pyplot.plot(depth_in_range, y_var)
-    #pyplot.xlabel("Depth (mm)")
-    #pyplot.ylabel("Force (N)")
-    #pyplot.title("Force vs. Indentation Depth")
-    #pyplot.show()
-
-    count = 0 #adjust if approximate initial depth was incorrect
-    continue_to_adjust = True
-    if abs(fit_d0) < 0.01:
-        continue_to_adjust = False
-    min_d0 = 100
-    while continue_to_adjust:
-        count = count + 1
-        old_d0 = fit_d0
-        run_array = adjust_depth(run_array, fit_d0)
-        height = approximate_height(run_array)
-        depth_in_range, force_in_range = find_d_and_f_in_range(run_array)
-        #print(depth_in_range)
-        adjusted_forces = correct_force(depth_in_range, force_in_range, p_ratio, height)
-        #print(adjusted_forces)
-        depth_in_range = np.asarray(depth_in_range)
-        adjusted_forces = np.asarray(adjusted_forces)
-        try:
-            parameters, covariance = curve_fit(Hertz_func, depth_in_range, adjusted_forces, p0=[2, 0.03])
-        except:
-            print("Data could not be analyzed")
-            sys.exit()
+
+def fit_entry(well, fit, run_array, p_ratio): #what is saved to analysis_cache for a well, fit is the HertzFit of its
+    #run_array or None if it could not be fit. Has the row saved to the results and the measurements the fit used
+    if fit is None:
+        return {"row": [well, "no data", "no data"]}
+    depths, forces = split(run_array)
+    E = int(round(adjust_E(find_E(fit.A, p_ratio))))
+    std_dev = int(round(find_E(np.sqrt(fit.covariance[0][0]), p_ratio)))
+    return {"row": [well, E, std_dev, max(forces), max(depths)], "parameters": fit.parameters().tolist(),
+            "covariance": np.asarray(fit.covariance).tolist(), "E": E, "uncertainty": std_dev,
+            "depths": fit.depths.tolist(), "forces": fit.forces.tolist()}
+
+
+def well_result(data, well, p_ratio): #fit a single well, or read it back from analysis_cache if it was analyzed before
+    #with the same settings, either on its own or with the rest of the plate. Returns the entry saved to the cache
+    well_rows = []
+    for row in data:
+        if row[0] == well:
+            well_rows.append(row)
+    if len(well_rows) == 0:
+        print("Well was not tested")
+        return fit_entry(well, None, [], p_ratio)
+    key = analysis_key(well_rows, p_ratio)
+    entry = analysis_cache.cache.get(key) if use_cache else None
+    if entry is not None:
+        print("Read back from an earlier analysis of the well")
+        return entry
+    run_array = well_run_array(well_rows, well)
+    fit = None
+    if run_array != []:
+        fit = hertz_fit.fit_hertz(run_array, p_ratio, correction_factors, approximate_height) #fit data to Hertzian
+        #contact mechanics, moving the depths to where contact started
+    if fit is not None:
+        print(f"Contact was {round(fit.offset, 3)} mm below where it was detected, fit in {fit.solves} solves and "
+              f"{fit.evaluations} evaluations")
+    entry = fit_entry(well, fit, run_array, p_ratio)
+    if use_cache:
+        analysis_cache.cache.put(key, entry)
+    return entry
+
+
+def plate_results(data, p_ratio): #fit every well in the file at once, see hertz_fit.fit_plate. Returns rows of
+    #[well, E, uncertainty, max force, max depth] the same as the results files, with no data for wells without a fit
+    well_rows = {}
+    for row in data:
+        if row[0] in well_rows:
+            well_rows[row[0]].append(row)
+        elif row[0][0] in cols and row[0].lstrip("ABCDEFGH") in rows:
+            well_rows[row[0]] = [row]
+    wells = list(well_rows)
+    results = [None] * len(wells)
+    keys = []
+    missed = []  # wells that were not analyzed before
+    for i in range(0, len(wells)):
+        keys.append(analysis_key(well_rows[wells[i]], p_ratio))
+        entry = analysis_cache.cache.get(keys[i]) if use_cache else None
+        if entry is None:
+            missed.append(i)
+        else:
+            results[i] = entry["row"]
+    run_arrays = []
+    for i in missed:
+        print(f"Well {wells[i]}:")
+        run_arrays.append(well_run_array(well_rows[wells[i]], wells[i]))
+    plate = hertz_fit.fit_plate(run_arrays, p_ratio, correction_factors, approximate_height, find_E)
+    for j in range(0, len(missed)):
+        i = missed[j]
+        entry = fit_entry(wells[i], plate.fits[j], run_arrays[j], p_ratio)
+        results[i] = entry["row"]
+        if use_cache:
+            analysis_cache.cache.put(keys[i], entry)
+    return results
+
+
+def analyze_plate(data): #fit every well in the file at once and print the results
+    p_ratio = ask_p_ratio()
+    start = time.time()
+    results = plate_results(data, p_ratio)
+    analyzed = len([row for row in results if row[1] != "no data"])
+    print(f"{analyzed} of {len(results)} wells were analyzed in {round(time.time() - start, 3)} s, "
+          f"{analysis_cache.cache.hits} read back from earlier analyses")
+    if use_cache:
+        analysis_cache.cache.evict()
+    for row in results:
+        if row[1] == "no data":
+            print(f"Well {row[0]}: Data could not be analyzed")
         else:
-            fit_A = float(parameters[0])
-            fit_d0 = float(parameters[1])
-            #print(fit_A)
-            #print(fit_d0)
-            if abs(fit_d0) < min_d0:
-                min_d0 = abs(fit_d0)
-            #print(f"min {min_d0}")
-            #pyplot.scatter(depth_in_range, adjusted_forces)
-            #y_var = []
-            #for i in range(0, len(depth_in_range)):
-                #y_var.append(fit_A * pow(depth_in_range[i], 1.5))
-            #pyplot.plot(depth_in_range, y_var)
-            #pyplot.xlabel("Depth (mm)")
-            #pyplot.ylabel("Force (N)")
-            #pyplot.title("Force vs. Indentation Depth")
-            #pyplot.show()
-            if abs(round(old_d0, 5)) == abs(round(fit_d0, 5)): #if fit continues to converge to improper value
-                fit_d0 = -0.75 * fit_d0
-            elif abs(fit_d0) < 0.01:
-                continue_to_adjust = False
-                break
-            elif count > 100 and count < 200:
-                if abs(round(fit_d0, 2)) == round(min_d0, 2):
-                    break
-            elif count >= 200 and count < 300:
-                if abs(round(fit_d0, 1)) == round(min_d0, 1):
-                    break
-            elif count == 300:
-                print("Fit quality may be poor")
-                break
-
-    E = find_E(fit_A, p_ratio) #determine elastic modulus from measurements
-    #print(E)
-    E = adjust_E(E)
-    E = round(E)
-    ##print(E)
-    if round(max(depth_in_range), 2) < 0.4:
-        print("Sample was not indented far enough")
-        print(
-            f"The range the measurement was made with was {round(min(depth_in_range), 2)} mm to {round(max(depth_in_range), 2)} mm")
-    err = np.sqrt(np.diag(covariance))
-    #print(covariance[0][0])
-    std_dev = round(find_E(err[0], p_ratio))
-    ##print(std_dev)
-    print(f"Well {well}: E = {E} N/m^2, Uncertainty = {std_dev} N/m^2")
-    pyplot.scatter(depth_in_range, adjusted_forces)
-    y_var = []
-    for i in range(0, len(depth_in_range)):
-       y_var.append(fit_A * pow(depth_in_range[i], 1.5))
-    pyplot.plot(depth_in_range, y_var) #plot data and curve fit
-    pyplot.xlabel("Depth (mm)")
-    pyplot.ylabel("Force (N)")
-    pyplot.title(f"Force vs. Indentation Depth of Well {well}")
-    pyplot.show()
+            print(f"Well {row[0]}: E = {row[1]} N/m^2, Uncertainty = {row[2]} N/m^2")
+
+
+if __name__ == "__main__":
+    data = load_csv()
+    #print(data)
+    invalid = True
+    while invalid: #obtain well to be analyzed
+       well = input("Enter a well, or all to analyze every well in the file: ")
+       if well == "all":
+           analyze_plate(data)
+           sys.exit()
+       if well[0] not in cols or well.lstrip("ABCDEFGH") not in rows: #error check if invalid well is entered
+           print("Error, please try again")
+       else:
+           invalid = False
+    p_ratio = ask_p_ratio()
+    entry = well_result(data, well, p_ratio)
+    if entry["row"][1] == "no data":
+        print("Data could not be analyzed")
+        sys.exit()
+    else:
+        fit_A = entry["parameters"][0]
+        depth_in_range = entry["depths"]
+        adjusted_forces = entry["forces"]
+        E = entry["E"] #elastic modulus from the fit, with adjust_E applied
+        if round(max(depth_in_range), 2) < 0.4:
+            print("Sample was not indented far enough")
+            print(
+                f"The range the measurement was made with was {round(min(depth_in_range), 2)} mm to {round(max(depth_in_range), 2)} mm")
+        std_dev = entry["uncertainty"]
+        print(f"Well {well}: E = {E} N/m^2, Uncertainty = {std_dev} N/m^2")
+        pyplot.scatter(depth_in_range, adjusted_forces)
+        y_var = []
+        for i in range(0, len(depth_in_range)):
+           y_var.append(fit_A * pow(depth_in_range[i], 1.5))
+        pyplot.plot(depth_in_range, y_var) #plot data and curve fit
+        pyplot.xlabel("Depth (mm)")
+        pyplot.ylabel("Force (N)")
+        pyplot.title(f"Force vs. Indentation Depth of Well {well}")
+        pyplot.show()
@@ -0,0 +1,86 @@
+"""
+This is a module which saves the analysis of every well to disk, so analyzing the same measurements again with the same
+settings, such as going over every run in Results again with batch_analysis, reads the results back instead of finding
+contact and fitting every well again.
+
+An analysis is saved under a hash of everything it depends on, the rows of the well in the data file, the poisson's
+ratio and the settings of the analysis, which include how contact is found, the depth range and version of the fit and
+the version of the correction tables. Changing any of them gives a different hash, so results worked out some other way are never used,
+and there is nothing to clear out after a change. Each analysis is a small json file in the cache directory, holding
+the fitted parameters, their covariance, the elastic modulus, the row saved to the results and the corrected depths and
+forces the fit used, so a single well read back can still be plotted.
+
+Reading an analysis marks it as used. When the cache is bigger than MAX_SIZE, or has more than MAX_ENTRIES analyses,
+the ones used least recently are deleted until it is not. Files are written whole and then renamed into place, so the
+processes of batch_analysis can share a cache.
+"""
+
+import hashlib
+import json
+import os
+
+DIRECTORY = os.environ.get("ASMI_CACHE", "analysis_cache")  # directory the analyses are saved in
+MAX_SIZE = 20 * 1024 * 1024  # bytes the cache can use before the least recently used analyses are deleted
+MAX_ENTRIES = 50000  # analyses the cache can hold before the least recently used ones are deleted
+
+
+def key(rows, *settings): #hash of the rows of a well and every setting its analysis depends on
+    text = json.dumps([rows, settings], separators=(",", ":"))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class AnalysisCache: #analyses saved to disk by their key
+    def __init__(self, directory=DIRECTORY, max_size=MAX_SIZE, max_entries=MAX_ENTRIES):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key): #the analysis saved under the key, None if there is none
+        try:
+            with open(self.path(key), 'r') as file:
+                entry = json.load(file)
+            os.utime(self.path(key)) #mark as used, so it is deleted last
+        except (OSError, ValueError): #not saved, deleted by another process or only partly written
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = self.path(key) + f".{os.getpid()}.tmp"
+        with open(temporary, 'w') as file:
+            json.dump(entry, file)
+        os.replace(temporary, self.path(key))
+
+    def evict(self): #delete the least recently used analyses until the cache is small enough, returns how many
+        entries = []
+        try:
+            with os.scandir(self.directory) as files:
+                for file in files:
+                    if file.name.endswith(".json"):
+                        info = file.stat()
+                        entries.append((info.st_mtime, info.st_size, file.path))
+        except FileNotFoundError:
+            return 0
+        entries.sort()
+        size = sum(entry[1] for entry in entries)
+        deleted = 0
+        for used, file_size, path in entries:
+            if size <= self.max_size and len(entries) - deleted <= self.max_entries:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError: #already deleted by another process
+                pass
+            size = size - file_size
+            deleted = deleted + 1
+        return deleted
+
+
+cache = AnalysisCache()  # shared by everything analyzing measurements
@@ -0,0 +1,134 @@
+"""
+This is a script which analyzes every run saved under a directory again without asking any questions, such as after a
+change to the analysis, so the elastic moduli of old runs can be compared with the ones that were saved.
+
+Every raw data file with a results file next to it, like Test1.csv and Test1_results.csv, is found by walking the
+directory, Results by default. The wells of each file are fit at once the same way entering all in analysis.py does,
+and the files are analyzed in parallel by a pool of processes, one per core unless --jobs is given. The results of
+every well of every file are saved to a single table, next to the elastic modulus and uncertainty saved when the
+measurements were made, and how long every file took to analyze is printed and saved to a second table.
+
+The Poisson's ratio is not saved with the measurements, so the same one is used for every file, 0.45 unless --p-ratio
+is given. Contact is found with the detector each well was indented with unless --contact-method is given, and the
+correction factors are the ones of analysis.py unless given as well.
+
+Wells analyzed before with the same measurements and settings are read back from analysis_cache instead of being fit
+again, so going over the same runs again takes about as long as reading the files. --no-cache analyzes every well.
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import analysis
+import analysis_cache
+
+DIRECTORY = "Results"  # directory searched for runs when none is given
+P_RATIO = 0.45  # poisson's ratio of the samples when none is given
+OUTPUT = "batch_results.csv"  # table the results of every well are saved to, the timing is saved next to it
+RESULTS_SUFFIX = "_results.csv"
+
+
+def find_runs(directory): #[raw data file, results file] of every run under the directory, in order of their paths
+    runs = []
+    for path, folders, filenames in os.walk(directory):
+        folders.sort()
+        for filename in sorted(filenames):
+            if not filename.endswith(RESULTS_SUFFIX):
+                continue
+            raw_filename = os.path.join(path, filename[:-len(RESULTS_SUFFIX)] + ".csv")
+            if os.path.exists(raw_filename):
+                runs.append([raw_filename, os.path.join(path, filename)])
+    return runs
+
+
+def configure(contact_method, well_plate, interpolate_correction, use_cache, cache_directory):
+    #settings of analysis.py in every worker process
+    analysis.contact_method = contact_method
+    analysis.well_plate = well_plate
+    analysis.interpolate_correction = interpolate_correction
+    analysis.use_cache = use_cache
+    analysis_cache.cache.directory = cache_directory
+
+
+def analyze_file(raw_filename, p_ratio):
+    #results of every well of a run, the time in seconds they took to work out and how many were analyzed before
+    start = time.perf_counter()
+    hits = analysis_cache.cache.hits
+    with contextlib.redirect_stdout(io.StringIO()): #analysis.py prints what it finds for every well
+        results = analysis.plate_results(analysis.read_csv(raw_filename), p_ratio)
+    return results, time.perf_counter() - start, analysis_cache.cache.hits - hits
+
+
+def saved_results(results_filename): #{well: [E, uncertainty]} saved when the measurements were made
+    saved = {}
+    for row in analysis.read_csv(results_filename):
+        saved[row[0]] = row[1:3]
+    return saved
+
+
+def batch(directory, p_ratio, jobs, output, settings):
+    runs = find_runs(directory)
+    print(f"Analyzing {len(runs)} runs under {directory} with {jobs} processes")
+    start = time.perf_counter()
+    finished = {}
+    with ProcessPoolExecutor(max_workers=jobs, initializer=configure, initargs=settings) as pool:
+        futures = {pool.submit(analyze_file, raw_filename, p_ratio): raw_filename for raw_filename, _ in runs}
+        for future in as_completed(futures):
+            raw_filename = futures[future]
+            try:
+                finished[raw_filename] = future.result()
+            except Exception as error: #a file that cannot be read or analyzed does not stop the others
+                print(f"{os.path.relpath(raw_filename, directory)} could not be analyzed: {error}")
+                continue
+            results, seconds, hits = finished[raw_filename]
+            analyzed = len([row for row in results if row[1] != "no data"])
+            print(f"{os.path.relpath(raw_filename, directory)}: {analyzed} of {len(results)} wells analyzed in "
+                  f"{round(seconds, 3)} s, {hits} read back from earlier analyses")
+    total = time.perf_counter() - start
+    table = []
+    timing_table = []
+    for raw_filename, results_filename in runs:
+        if raw_filename not in finished:
+            continue
+        results, seconds, hits = finished[raw_filename]
+        saved = saved_results(results_filename)
+        name = os.path.relpath(raw_filename, directory)
+        for row in results:
+            table.append([name] + (row + ["", ""])[0:5] + saved.get(row[0], ["", ""]))
+        timing_table.append([name, len(results), hits, round(seconds, 4)])
+    with open(output, 'w', newline='') as csvfile:
+        csvwriter = csv.writer(csvfile)
+        csvwriter.writerow(["file", "well", "E", "uncertainty", "max force", "max depth", "saved E",
+                            "saved uncertainty"])
+        csvwriter.writerows(table)
+    with open(output[:-4] + "_timing.csv", 'w', newline='') as csvfile:
+        csvwriter = csv.writer(csvfile)
+        csvwriter.writerow(["file", "wells", "read back", "seconds"])
+        csvwriter.writerows(timing_table)
+    analysis_time = sum(row[3] for row in timing_table)
+    print(f"{len(finished)} runs and {len(table)} wells analyzed in {round(total, 2)} s, {round(analysis_time, 2)} s "
+          f"spent analyzing, {sum(row[2] for row in timing_table)} wells read back from earlier analyses, results "
+          f"saved to {output}")
+    if settings[3]:
+        analysis_cache.AnalysisCache(settings[4]).evict()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyze every run under a directory again")
+    parser.add_argument("directory", nargs="?", default=DIRECTORY)
+    parser.add_argument("--p-ratio", type=float, default=P_RATIO, help="Poisson's ratio of the samples")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="number of processes analyzing runs")
+    parser.add_argument("--output", default=OUTPUT, help="table the results are saved to")
+    parser.add_argument("--contact-method", default=analysis.contact_method, help="see contact_detector, the one each well was indented with by default")
+    parser.add_argument("--plate", default=analysis.well_plate, help="correction factors to use, see force_correction")
+    parser.add_argument("--interpolate", action="store_true", help="interpolate the correction factors")
+    parser.add_argument("--no-cache", action="store_true", help="analyze every well again, see analysis_cache")
+    parser.add_argument("--cache", default=analysis_cache.DIRECTORY, help="directory earlier analyses are saved in")
+    arguments = parser.parse_args()
+    batch(arguments.directory, arguments.p_ratio, arguments.jobs, arguments.output,
+          (arguments.contact_method, arguments.plate, arguments.interpolate, not arguments.no_cache, arguments.cache))
@@ -0,0 +1,146 @@
+"""
+This is a script which times whole runs of measure.py on a simulated plate, so every change that makes testing a plate
+faster can be measured, and checked later on to make sure it stays fast.
+
+measure.py is run the way it is run on the cnc, from going home at the start to saving the results and going home at
+the end, answering its questions with the wells to test. ASMI_SIMULATE is set so it uses the simulated force sensor and
+starts its own simulated grbl, which moves ASMI_SIM_SPEED times faster than the real cnc. The force sensor and the
+analysis are not sped up, so runs are only comparable when they use the same speed.
+
+The time of every line measure.py prints is noted, and the lines it prints at each part of a well split the run into
+phases: going home and setting up the run, moving to each well, the fast approach, indenting, moving back up, the
+analysis and saving the results, and going home at the end. The elastic modulus found for every well is compared to
+the elastic modulus of the simulated sample, which the analysis gets back when nothing is wrong, and the script exits
+with an error if it is off by more than E_TOLERANCE on average. Wells without data are counted in the report but are
+not an error, since a long approach through free air can end in a false contact without the analysis being off.
+
+Runs 1, 12 and 96 wells, or the numbers of wells given after the script name, and adds a row for every run to
+benchmark_plate.csv in the directory it is run from.
+"""
+
+import csv
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import simulated_sensor
+
+PLATE_SIZES = [1, 12, 96]  # numbers of wells tested when none are given
+SIM_SPEED = 10  # times faster than the real cnc the simulated cnc moves, when ASMI_SIM_SPEED is not set
+REPORT = "benchmark_plate.csv"  # file a row is added to for every run
+E_TOLERANCE = 0.05  # largest relative error of the mean elastic modulus of a run that counts as accurate
+MEASURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "measure.py")
+PHASES = ["go home and set up", "move to well", "fast approach", "indent", "move up", "analysis", "save results",
+          "go home at the end"]
+MARKERS = [("Testing well", "move to well"), ("move_gcode 1 is done", "indent"), ("stream_gcode is done", "move up"),
+           ("move_gcode 2 is done", "analysis"), (": E = ", "save results"), ("Here are the results", "go home at the end")]
+# lines measure.py prints as it starts each phase, the results are printed just before they are saved
+
+
+def plate_wells(number): #the first number of wells on the plate, in the order measure.py tests the whole plate in
+    return [col + str(row) for col in "ABCDEFGH" for row in range(1, 13)][0:number]
+
+
+def answers(name, wells, p_ratio): #what to type in to measure.py to test the wells, entering them one at a time
+    lines = [name, "1"] + wells + ["", "Y", "Y", "Y", str(p_ratio)]
+    return "\n".join(lines) + "\n"
+
+
+def run_plate(wells, directory, environment): #run measure.py on the wells, returns the time each line was printed at
+    name = f"benchmark_{len(wells)}"
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-u", MEASURE], cwd=directory, env=environment, text=True,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    process.stdin.write(answers(name, wells, environment["ASMI_SIM_POISSON"]))
+    process.stdin.close()
+    lines = []
+    for line in process.stdout:
+        lines.append((time.perf_counter() - start, line.rstrip("\n")))
+    process.wait()
+    total = time.perf_counter() - start
+    if process.returncode != 0:
+        print("\n".join(line for t, line in lines[-20:]))
+        raise RuntimeError(f"measure.py stopped with exit code {process.returncode}")
+    return lines, total, os.path.join(directory, name + "_results.csv")
+
+
+def phase_times(lines, total): #time spent in each phase, from the lines printed as each one starts
+    times = {phase: 0.0 for phase in PHASES}
+    phase = PHASES[0]
+    last = 0.0
+    for t, line in lines:
+        for marker, following in MARKERS:
+            if marker in line and phase != PHASES[-1]: #the results are printed again at the end
+                times[phase] += t - last
+                phase = following
+                last = t
+        if line.startswith("Well took"): #the fast approach is timed inside the indenting by indentation
+            approach = float(line.split(": ")[1].split(" s fast approach")[0])
+            times["fast approach"] += approach
+            times["indent"] -= approach
+    times[phase] += total - last
+    return times
+
+
+def accuracy(results_filename, E): #relative errors of the elastic moduli found and the number of wells without one
+    errors = []
+    missing = 0
+    with open(results_filename, 'r') as csvfile:
+        for row in csv.reader(csvfile):
+            if row == []:
+                continue
+            try:
+                errors.append((float(row[1]) - E) / E)
+            except ValueError: #no data
+                missing = missing + 1
+    return errors, missing
+
+
+def benchmark(number, environment):
+    wells = plate_wells(number)
+    with tempfile.TemporaryDirectory() as directory: #a new plate, with the cnc at home
+        environment = dict(environment, ASMI_DIR=directory)
+        lines, total, results_filename = run_plate(wells, directory, environment)
+        times = phase_times(lines, total)
+        errors, missing = accuracy(results_filename, float(environment["ASMI_SIM_E"]))
+    print(f"{number} wells in {total:.1f} s, {number / total * 3600:.0f} wells per hour")
+    for phase in PHASES:
+        print(f"  {phase:<20} {times[phase]:>8.1f} s {times[phase] / number:>8.2f} s per well "
+              f"{100 * times[phase] / total:>5.1f} %")
+    if len(errors) > 0:
+        mean_error = sum(errors) / len(errors)
+        worst = max(errors, key=abs)
+        print(f"  E is off by {100 * mean_error:.1f} % on average and {100 * worst:.1f} % at worst, "
+              f"{missing} wells had no data")
+    else:
+        mean_error = worst = float("nan")
+        print(f"  No well could be analyzed, {missing} wells had no data")
+    return [time.strftime("%Y-%m-%d %H:%M:%S"), number, environment["ASMI_SIM_SPEED"], round(total, 2),
+            round(number / total * 3600, 1)] + [round(times[phase], 2) for phase in PHASES] + [mean_error, worst, missing]
+
+
+if __name__ == "__main__":
+    sizes = [int(size) for size in sys.argv[1:]] if len(sys.argv) > 1 else PLATE_SIZES
+    environment = dict(os.environ, ASMI_SIMULATE="1", MPLBACKEND="Agg") #no plot windows to close
+    environment.pop("ASMI_GRBL_PORT", None)  # measure.py starts a simulated grbl of its own
+    environment.setdefault("ASMI_SIM_SPEED", str(SIM_SPEED))
+    environment.setdefault("ASMI_SIM_E", str(simulated_sensor.E))
+    environment.setdefault("ASMI_SIM_POISSON", str(simulated_sensor.P_RATIO))
+    print(f"Simulated sample: E = {environment['ASMI_SIM_E']} N/m^2, Poisson's ratio {environment['ASMI_SIM_POISSON']},"
+          f" cnc {environment['ASMI_SIM_SPEED']} times faster than real time")
+    rows = [benchmark(size, environment) for size in sizes]
+    new_file = not os.path.exists(REPORT)
+    with open(REPORT, 'a') as csvfile:
+        csvwriter = csv.writer(csvfile)
+        if new_file:
+            csvwriter.writerow(["time", "wells", "sim speed", "total (s)", "wells per hour"] +
+                               [phase + " (s)" for phase in PHASES] + ["mean E error", "worst E error", "no data"])
+        csvwriter.writerows(rows)
+    failed = [row for row in rows if not abs(row[-3]) <= E_TOLERANCE] #nan, no well analyzed, is not accurate either
+    for row in failed:
+        print(f"{row[1]} wells: E was off by {100 * row[-3]:.1f} % on average, more than the "
+              f"{100 * E_TOLERANCE:.0f} % allowed")
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,99 @@
+"""
+This is a script which shows how much time saving the raw data of a run costs.
+
+The first part compares the time it takes to save every row, opening the data file, writing the row and closing it again
+the way the measure programs used to, against saving it with RawData, which keeps the data file open and writes rows in
+synced batches.
+
+The second part shows how long it takes to get the data of the well that was just tested ready for the analysis as the
+data file of a run grows. Reading the whole data file back in with load_csv and searching it for the well gets slower
+with every well that is tested, while using the rows RawData kept in memory takes the same time for every well.
+
+No cnc or force sensor is needed, the rows of every well are made up and saved to a temporary data file.
+"""
+
+import csv
+import os
+import tempfile
+import time
+
+import raw_data
+
+NUM_WELLS = 96
+STEPS = 400  # rows saved for every well, about how many a well indented 8 mm in 0.02 mm steps has
+
+
+def load_csv(filename): #load data from csv file, the same way the measure programs used to after every well
+    with open(filename, 'r') as file:
+        reader = csv.reader(file)
+        data = list(reader)
+    cleaned_data = []
+    for i in range(0, len(data)):
+        if data[i] != []:
+            cleaned_data.append(data[i])
+    return cleaned_data
+
+
+def well_rows(data, well): #the rows collect_run_data picks out of the data for a well
+    return [row for row in data if row[0] == well]
+
+
+def made_up_rows(well): #rows like the ones stream_gcode saves for a well
+    rows = [[well, 0.0012, 0.0004]]
+    for i in range(0, STEPS):
+        rows.append([well, round(-1 - 0.02 * i, 2), round(0.05 * max(0, i - STEPS / 2) ** 1.5, 4)])
+    return rows
+
+
+def write_row(filename, row): #save a row to the data file the way the measure programs used to
+    with open(filename, 'a') as csvfile:
+        csvwriter = csv.writer(csvfile)
+        csvwriter.writerow([str(value) for value in row])
+
+
+def compare_writing(directory, wells):
+    rows = [row for well in wells for row in made_up_rows(well)]
+    filename = os.path.join(directory, "open_every_row.csv")
+    start = time.perf_counter()
+    for row in rows:
+        write_row(filename, row)
+    before = (time.perf_counter() - start) / len(rows)
+    raw = raw_data.RawData(os.path.join(directory, "raw_data.csv"))
+    start = time.perf_counter()
+    for i in range(0, len(wells)):
+        raw.start_well()
+        for row in rows[i * (STEPS + 1):(i + 1) * (STEPS + 1)]:
+            raw.write(row)
+        raw.end_well()
+    raw.close()
+    after = (time.perf_counter() - start) / len(rows)
+    print(f"Saving {len(rows)} rows: {before * 1e6:.1f} us per row opening the file for every row, "
+          f"{after * 1e6:.1f} us per row with RawData")
+
+
+def compare_reading(directory, wells):
+    raw = raw_data.RawData(os.path.join(directory, "benchmark.csv"))
+    print("well  rows in file  load_csv (ms)  in memory (ms)")
+    for n in range(0, len(wells)):
+        raw.start_well()
+        for row in made_up_rows(wells[n]):
+            raw.write(row)
+        raw.end_well()
+        start = time.perf_counter()
+        from_file = well_rows(load_csv(raw.filename), wells[n])
+        file_time = time.perf_counter() - start
+        start = time.perf_counter()
+        from_memory = well_rows(raw.rows, wells[n])
+        memory_time = time.perf_counter() - start
+        if from_file != from_memory:
+            print(f"Rows of well {wells[n]} read back from the file do not match the rows kept in memory")
+        if n == 0 or (n + 1) % 12 == 0:
+            print(f"{wells[n]:<5} {(n + 1) * (STEPS + 1):>13} {file_time * 1000:>14.2f} {memory_time * 1000:>15.3f}")
+    raw.close()
+
+
+if __name__ == "__main__":
+    wells = [col + str(row) for col in "ABCDEFGH" for row in range(1, 13)][0:NUM_WELLS]
+    with tempfile.TemporaryDirectory() as directory:
+        compare_writing(directory, wells)
+        compare_reading(directory, wells)
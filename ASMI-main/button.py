@@ -63,20 +63,30 @@ THE SOFTWARE.
 """
 
 
-import serial
+import grbl
+import cnc_position
+import simulated_sensor
 import time
-from threading import Event
-from godirect import GoDirect
-import csv
+import os
 
 import logging
 logging.basicConfig()
 
 BAUD_RATE = 115200
-GRBL_port_path = "COM3" #Change this to the desired serial port!
-
-godirect = GoDirect(use_ble=True, use_usb=True)
-device = godirect.get_device(threshold=-100)
+GRBL_port_path = os.environ.get("ASMI_GRBL_PORT", "COM3") #Change this to the desired serial port!
+
+if os.environ.get("ASMI_SIMULATE"): #run without the force sensor, see simulated_sensor
+    if "ASMI_GRBL_PORT" in os.environ:
+        device = simulated_sensor.from_environment()
+    else: #run without the cnc as well, see grbl_simulator
+        import grbl_simulator
+        cnc = grbl_simulator.start_from_environment(cnc_position.tracker.get())
+        GRBL_port_path = cnc.port
+        device = simulated_sensor.from_environment(cnc.position)
+else:
+    from godirect import GoDirect
+    godirect = GoDirect(use_ble=True, use_usb=True)
+    device = godirect.get_device(threshold=-100)
 
 def remove_comment(string):
     if (string.find(';') == -1):
@@ -90,53 +100,19 @@ def remove_eol_chars(string):
     return string.strip()
 
 
-def send_wake_up(ser):
-    # Wake up
-    # Hit enter a few times to wake the cnc
-    ser.write(str.encode("\r\n\r\n"))
-    time.sleep(2)  # Wait for cnc to initialize
-    ser.flushInput()  # Flush startup text in serial input
-
-
 def wait_for_movement_completion(ser, cleaned_line): #wait for cnc to reach destination before sending new movement
-    Event().wait(1)
-
-    if cleaned_line != '$X' or '$$':
-
-        idle_counter = 0
-
-        while True:
-
-            # Event().wait(0.01)
-            ser.reset_input_buffer()
-            command = str.encode('?' + '\n')
-            ser.write(command)
-            grbl_out = ser.readline()
-            grbl_response = grbl_out.strip().decode('utf-8')
-
-            if grbl_response != 'ok':
-
-                if grbl_response.find('Idle') > 0:
-                    idle_counter += 1
-
-            if idle_counter > 10:
-                break
-    return
+    return grbl.wait_for_idle(ser, grbl.parse_target(cleaned_line)) #returns as soon as the cnc is idle at its target
 
 
 def stream_gcode(GRBL_port_path, gcode, home, x, y):
-    with serial.Serial(GRBL_port_path, BAUD_RATE) as ser:
-        send_wake_up(ser)
+    with grbl.connection(GRBL_port_path, BAUD_RATE) as ser:
         cleaned_line = remove_eol_chars(remove_comment(gcode))
         if home: #if device is being moved home, run this to reset coordinate system
             ##print(f'G92 X{x} Y{y} Z{z}\n')
             command = str.encode(f'G92 X{x} Y{y}\n')
             ser.write(command)  # Send g-code
 
-            wait_for_movement_completion(ser, cleaned_line)
-
-            grbl_out = ser.readline()  # Wait for response with carriage return
-            ##print(" : ", grbl_out.strip().decode('utf-8'))
+            wait_for_movement_completion(ser, command.decode())
             x = 0
             y = 0
             z = 0
@@ -147,16 +123,12 @@ def stream_gcode(GRBL_port_path, gcode, home, x, y):
             ser.write(command)  # Send g-code
 
             wait_for_movement_completion(ser, cleaned_line)
-
-            grbl_out = ser.readline()  # Wait for response with carriage return
-            ##print(" : ", grbl_out.strip().decode('utf-8'))
             z = 0
             position = [x, y, z]
 
         ##print('End of gcode')
-        with open("position.csv", 'w') as csvfile: #update position of cnc
-            csvwriter = csv.writer(csvfile)
-            csvwriter.writerow(position)
+        cnc_position.tracker.set(*position) #update position of cnc
+        cnc_position.tracker.save()
 
 
 if __name__ == "__main__":
@@ -187,4 +159,5 @@ if __name__ == "__main__":
         time.sleep(0.1)
         device.stop()
     device.close()
+    grbl.close_sessions()
 
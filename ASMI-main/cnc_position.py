@@ -0,0 +1,85 @@
+"""
+This is a module which keeps track of the position of the cnc, measured from its home position, so it can be sent back
+home by the next program that is run. The position is kept in memory while the cnc moves and is only saved to
+position.csv at safe points, such as after a movement between wells or after homing, and when the program exits. It is
+saved by writing a temporary file and renaming it over position.csv, so the file is never left half written.
+
+grbl also keeps track of its own machine position until it is reset, which G92 does not change. The machine position of
+the home position is saved along with the position, so when grbl was not reset since the position was saved, the
+position is taken from grbl instead of from a file that might be out of date. When grbl was reset, the saved position is
+used to find the machine position of home again.
+"""
+
+import atexit
+import csv
+import os
+
+import grbl
+
+FILENAME = "position.csv"
+TOLERANCE = 0.01  # difference in mm between the saved position and grbl's position that counts as out of date
+
+
+class PositionTracker: #position of the cnc from its home position, saved to filename as rows of [x, y, z] and home
+    def __init__(self, filename=FILENAME):
+        self.filename = filename
+        self.position = [0, 0, 0]
+        self.home = None  # machine position grbl has for the home position, if it is known
+        self.connects = None  # connection to grbl the home position was found for
+        if os.path.exists(filename):
+            self.load()
+        self.saved = (list(self.position), self.home)
+        atexit.register(self.save)  # save the last position if the program is stopped
+
+    def load(self):
+        with open(self.filename, 'r') as csvfile:
+            rows = [row for row in csv.reader(csvfile) if row != []]
+        if len(rows) > 0:
+            self.position = [float(value) for value in rows[0]]
+        if len(rows) > 1:
+            self.home = [float(value) for value in rows[1]]
+
+    def get(self):
+        return list(self.position)
+
+    def set(self, x, y, z): #update the position after a movement, without saving it
+        self.position = [float(x), float(y), float(z)]
+
+    def reset(self): #the cnc was moved back to its home position by hand
+        self.position = [0, 0, 0]
+        self.home = None
+        self.save()
+
+    def save(self): #write the position to the file if it changed, replacing the old file in one step
+        if self.saved == (self.position, self.home):
+            return
+        temp = self.filename + ".tmp"
+        with open(temp, 'w') as csvfile:
+            csvwriter = csv.writer(csvfile)
+            csvwriter.writerow(self.position)
+            if self.home is not None:
+                csvwriter.writerow(self.home)
+            csvfile.flush()
+            os.fsync(csvfile.fileno())
+        os.replace(temp, self.filename)
+        self.saved = (list(self.position), self.home)
+
+    def sync(self, port_path, baud_rate=grbl.BAUD_RATE): #check the position against grbl's and return it
+        with grbl.connection(port_path, baud_rate) as ser:
+            session = grbl.get_session(port_path, baud_rate)
+            machine = grbl.machine_position(grbl.query_status(ser))
+            if machine is None: #grbl has not said where it is yet, so the saved position is all there is
+                return self.get()
+            if self.home is not None and (session.connects == self.connects or not session.was_reset):
+                position = [round(machine[i] - self.home[i], 3) for i in range(0, 3)]
+                if max(abs(position[i] - self.position[i]) for i in range(0, 3)) > TOLERANCE:
+                    print(f"Saved position {self.position} was out of date, grbl is at {position}")
+                    self.position = position
+            else: #grbl lost its position when it was reset, so home is where the saved position says it is
+                self.home = [round(machine[i] - self.position[i], 3) for i in range(0, 3)]
+            self.connects = session.connects
+        self.save()
+        return self.get()
+
+
+tracker = PositionTracker()  # shared by every function that moves the cnc
@@ -0,0 +1,157 @@
+"""
+This is a module with the ways contact between the indenter and a sample can be detected from the force measurements
+made while indenting a well. The same detector stops the cnc while a well is indented and is used by collect_run_data to
+find where contact started in the saved data, so both agree on where the surface of the sample is.
+
+A detector is given one force measurement at a time, with the number of sensor measurements averaged into it, and only
+keeps a few running sums, so every measurement takes the same time no matter how long the well has been indented for.
+Forces are compared to the baseline in standard deviations of the noise, which is lower for averaged measurements.
+
+threshold counts any measurement more than 2 standard deviations below the baseline as contact, the way the measure
+programs always have. A single noise spike counts as contact until the next measurement is made.
+
+cusum adds up how far each measurement is below the baseline, less an allowance for noise, and only counts it as
+contact once the sum passes a limit, so a single spike is not enough. Contact started at the first measurement after
+the sum was last zero, and is only lost again once the sum falls back to zero.
+
+slope fits a line through the last few measurements and counts it as contact once the force falls faster than noise can
+explain and the line has fallen well below the baseline, since a line through a few noisy measurements is often steep.
+Contact started where the line crosses the baseline, but not before the last measurement that was above it.
+"""
+
+import math
+from abc import ABC, abstractmethod
+from collections import deque
+
+DETECTOR = "cusum"  # detector used when none is chosen
+MIN_STDEV = 1e-6  # smallest noise in N, so a baseline measured without any noise does not divide by zero
+THRESHOLD_SIGMA = 2  # standard deviations below the baseline that count as contact for threshold
+CUSUM_DRIFT = 0.5  # standard deviations below the baseline every measurement is allowed before it adds to the sum
+CUSUM_LIMIT = 10  # sum in standard deviations that counts as contact, noise alone very rarely adds up to it
+SLOPE_WINDOW = 10  # measurements the line is fit through
+SLOPE_SIGMA = 3  # standard errors the force has to be falling by, and standard deviations the line has to be below
+# the baseline at the last measurement, to count as contact
+MIN_CONTACT_DEPTH = 0.2  # mm a well has to be indented past the start of contact to be analyzed
+
+
+def normal_cdf(score): #probability that noise stays below score standard deviations
+    return 0.5 * math.erfc(-score / math.sqrt(2))
+
+
+class Detector(ABC): #counts the measurements and compares them to the baseline, the detectors below decide what is contact
+    name = None
+
+    def __init__(self, avg, stdev):
+        self.avg = avg
+        self.stdev = max(stdev, MIN_STDEV)
+        self.count = 0  # measurements given to the detector so far
+        self.contact = False
+        self.index = None  # measurement contact started at, None while there is no contact
+        self.confidence = 0.0  # how sure the detector is that the contact is not noise, from 0 to 1
+
+    def score(self, value, count=1): #standard deviations value is below the baseline
+        return (self.avg - value) * math.sqrt(count) / self.stdev
+
+    def update(self, value, count=1): #add the next measurement, returns whether the indenter is in contact
+        self.contact = self.check(value, count)
+        if not self.contact:
+            self.index = None
+        self.count += 1
+        return self.contact
+
+    @abstractmethod
+    def check(self, value, count): #whether the indenter is in contact, setting index and confidence
+        pass
+
+
+class ThresholdDetector(Detector): #any measurement far enough below the baseline is contact
+    name = "threshold"
+
+    def __init__(self, avg, stdev, sigma=THRESHOLD_SIGMA):
+        super().__init__(avg, stdev)
+        self.sigma = sigma
+
+    def check(self, value, count):
+        score = self.score(value, count)
+        self.confidence = normal_cdf(score)
+        if score > self.sigma:
+            if self.index is None:
+                self.index = self.count
+            return True
+        return False
+
+
+class CusumDetector(Detector): #contact once enough force has added up below the baseline
+    name = "cusum"
+
+    def __init__(self, avg, stdev, drift=CUSUM_DRIFT, limit=CUSUM_LIMIT):
+        super().__init__(avg, stdev)
+        self.drift = drift
+        self.limit = limit
+        self.sum = 0.0
+        self.start = 0  # first measurement since the sum was last zero
+
+    def check(self, value, count):
+        self.sum = max(0.0, self.sum + self.score(value, count) - self.drift)
+        self.confidence = 1 - math.exp(-2 * self.drift * self.sum)  # chance noise alone does not reach the sum
+        if self.sum == 0:
+            self.start = self.count + 1
+            return False
+        if self.sum > self.limit or self.contact: #contact lasts until the sum falls back to zero
+            self.index = self.start
+            return True
+        return False
+
+
+class SlopeDetector(Detector): #contact once a line through the last measurements falls faster than noise explains
+    name = "slope"
+
+    def __init__(self, avg, stdev, window=SLOPE_WINDOW, sigma=SLOPE_SIGMA):
+        super().__init__(avg, stdev)
+        self.sigma = sigma
+        self.points = deque(maxlen=window)
+        self.sums = [0.0, 0.0, 0.0, 0.0]  # sums of x, y, x * x and x * y over the window
+
+    def check(self, value, count):
+        score = self.score(value, count)
+        if len(self.points) == self.points.maxlen: #the oldest measurement leaves the window
+            x, y = self.points[0]
+            self.sums = [self.sums[0] - x, self.sums[1] - y, self.sums[2] - x * x, self.sums[3] - x * y]
+        x = self.count
+        self.points.append((x, score))
+        self.sums = [self.sums[0] + x, self.sums[1] + score, self.sums[2] + x * x, self.sums[3] + x * score]
+        n = len(self.points)
+        spread = self.sums[2] - self.sums[0] ** 2 / n  # sum of squared differences of x from its mean
+        if n < 3 or spread <= 0:
+            return False
+        slope = (self.sums[3] - self.sums[0] * self.sums[1] / n) / spread  # standard deviations per measurement
+        t = slope * math.sqrt(spread)  # the scores have a standard deviation of 1, so this is slope / standard error
+        self.confidence = normal_cdf(t)
+        if self.contact and score > THRESHOLD_SIGMA: #stays in contact while the force is still below the baseline
+            return True
+        end = self.sums[1] / n + slope * (x - self.sums[0] / n)  # standard deviations the line is below the baseline at x
+        if t > self.sigma and end > self.sigma and score > THRESHOLD_SIGMA:
+            crossing = self.sums[0] / n - (self.sums[1] / n) / slope  # where the line crosses the baseline
+            above = max([point[0] + 1 for point in self.points if point[1] <= 0], default=self.count - n + 1)
+            self.index = min(max(math.ceil(crossing), above), self.count) #the line is shallower than the force
+            # where the window starts before contact, so it crosses the baseline too early
+            return True
+        return False
+
+
+DETECTORS = {detector.name: detector for detector in (ThresholdDetector, CusumDetector, SlopeDetector)}
+
+
+def make_detector(method, avg, stdev): #detector for a well with the baseline avg and stdev
+    if method not in DETECTORS:
+        raise ValueError(f"unknown contact detector {method}, use one of {', '.join(DETECTORS)}")
+    return DETECTORS[method](avg, stdev)
+
+
+def find_contact(method, avg, stdev, values, counts=None): #measurement contact started at in a well and how sure the
+    #detector is of it, going through its saved measurements the way the detector did while the well was indented.
+    #The index is None if the indenter was not in contact at the end
+    detector = make_detector(method, avg, stdev)
+    for i in range(0, len(values)):
+        detector.update(values[i], 1 if counts is None else counts[i])
+    return detector.index, detector.confidence
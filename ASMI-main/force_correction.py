@@ -0,0 +1,66 @@
+"""
+This is a module with the correction factors, from simulation data, that make up for samples not being ideal shapes.
+A corrected force is force / (c * depth^b), where b and c depend on the poisson's ratio and the height of the sample.
+
+The b and c of every band of poisson's ratio and height are kept in tables with a row for every poisson's ratio band
+and a column for every height band, and the bands are found with np.searchsorted on the band edges, so a correction is
+a couple of lookups and one array expression over every depth instead of a walk down a ladder of ifs for every depth.
+
+The factors jump from one band to the next, so two samples a hair apart in height can be corrected differently. With
+interpolate set, b and c are interpolated between the middles of the bands instead, which gives the same b and c in the
+middle of a band but changes smoothly across the edges. The lowest and highest bands have no outer edge, their values
+are used as they are past the middle of the band.
+
+Each well plate has its own table. The custom plate of custom_measure uses the same b and c for every sample.
+"""
+
+import numpy as np
+
+VERSION = 1  # changed whenever a table changes, so results worked out with older tables can be told apart
+P_RATIO_EDGES = np.array([0.325, 0.375, 0.425, 0.475])  # lowest poisson's ratio of every band but the first
+HEIGHT_EDGES = np.array([3.5, 4.5, 5.5, 6.5, 7.5, 8.5, 9.5])  # lowest height in mm of every band but the first
+P_RATIO_MIDDLES = np.array([0.3, 0.35, 0.4, 0.45, 0.5])  # poisson's ratio in the middle of every band, to interpolate
+HEIGHT_MIDDLES = np.array([3, 4, 5, 6, 7, 8, 9, 10])  # height in mm in the middle of every band, to interpolate
+
+TABLES = {  # (b, c) of every plate, rows of poisson's ratio bands and columns of height bands, lowest first
+    "standard": (np.array([[0.162, 0.149, 0.139, 0.132, 0.132, 0.133, 0.131, 0.13],
+                           [0.169, 0.144, 0.133, 0.126, 0.136, 0.134, 0.132, 0.132],
+                           [0.176, 0.203, 0.198, 0.194, 0.183, 0.183, 0.182, 0.181],
+                           [0.205, 0.179, 0.166, 0.153, 0.161, 0.156, 0.152, 0.156],
+                           [0.182, 0.17, 0.22, 0.21, 0.217, 0.212, 0.207, 0.203]]),
+                 np.array([[1.38, 1.3, 1.27, 1.24, 1.24, 1.25, 1.24, 1.24],
+                           [1.42, 1.32, 1.27, 1.25, 1.26, 1.25, 1.25, 1.25],
+                           [1.46, 1.44, 1.4, 1.38, 1.34, 1.34, 1.34, 1.33],
+                           [1.59, 1.47, 1.42, 1.37, 1.37, 1.35, 1.34, 1.35],
+                           [1.64, 1.58, 1.68, 1.64, 1.65, 1.62, 1.6, 1.58]])),
+    "custom": (np.full((5, 8), 0.1113), np.full((5, 8), 1.5364)),
+}
+
+
+def bands(p_ratio, approx_height): #row and column of the table for a poisson's ratio and height
+    return (int(np.searchsorted(P_RATIO_EDGES, p_ratio, side='right')),
+            int(np.searchsorted(HEIGHT_EDGES, approx_height, side='right')))
+
+
+def interpolate_table(table, p_ratio, approx_height): #bilinear interpolation between the middles of the bands
+    row = np.interp(p_ratio, P_RATIO_MIDDLES, np.arange(0, len(P_RATIO_MIDDLES)))
+    col = np.interp(approx_height, HEIGHT_MIDDLES, np.arange(0, len(HEIGHT_MIDDLES)))
+    r = min(int(row), len(P_RATIO_MIDDLES) - 2)
+    k = min(int(col), len(HEIGHT_MIDDLES) - 2)
+    u = row - r
+    v = col - k
+    return float((1 - u) * (1 - v) * table[r, k] + (1 - u) * v * table[r, k + 1] + u * (1 - v) * table[r + 1, k] +
+                 u * v * table[r + 1, k + 1])
+
+
+def factors(p_ratio, approx_height, plate="standard", interpolate=False): #b and c of the correction of a sample
+    b_table, c_table = TABLES[plate]
+    if interpolate:
+        return interpolate_table(b_table, p_ratio, approx_height), interpolate_table(c_table, p_ratio, approx_height)
+    row, col = bands(p_ratio, approx_height)
+    return float(b_table[row, col]), float(c_table[row, col])
+
+
+def correct(depths, forces, p_ratio, approx_height, plate="standard", interpolate=False): #corrected forces
+    b, c = factors(p_ratio, approx_height, plate, interpolate)
+    return np.asarray(forces, dtype=float) / (c * np.asarray(depths, dtype=float) ** b)
@@ -0,0 +1,216 @@
+"""
+This is a module which streams the force sensor for a whole run instead of starting and stopping it for every
+measurement, which takes far longer than a measurement does. A background thread reads every measurement the sensor
+makes and saves it, with the time it was made at, to a ring buffer which holds the most recent measurements.
+
+Every measurement is saved twice in the ring buffer, capacity places apart, so the most recent measurements are always
+next to each other in memory and can be handed out as numpy views of the buffer without copying them. Views stay valid
+until another capacity measurements have been made.
+
+Each step of a measurement can use every measurement made since the last step, instead of a single one, and summarize
+them with step_statistics. Averaging n measurements lowers the noise by a factor of sqrt(n) without waiting any longer.
+
+The force measured with nothing touching the indenter, the baseline, can be estimated with Baseline while the indenter
+approaches a sample, from the measurements it makes in free air anyway, instead of pausing above every well to measure it.
+
+The service can also be passed to code written for a GoDirect device, such as the force watchdog and the survey, in
+place of the device. Each read then returns every measurement made since the last read instead of restarting the sensor.
+"""
+
+import time
+from threading import Condition, Event, Thread
+
+import math
+
+import numpy as np
+
+import timing
+
+SAMPLE_PERIOD = 10  # time in ms between force measurements
+CAPACITY = 65536  # number of measurements kept, about 11 minutes at a 10 ms sample period
+READ_TIMEOUT = 2  # longest time in seconds to wait for the sensor to make a measurement
+BASELINE_SAMPLES = 100  # measurements made after the cnc stopped above a well that the baseline starts from, the
+# contact detectors add up small differences from the baseline so the mean of only a few is too far off
+SETTLED_SAMPLES = 10  # measurements the baseline starts from when the free air steps of a well refine it
+
+
+class ForceSensorError(Exception): #raised when the force sensor stops making measurements
+    pass
+
+
+def step_statistics(values): #mean, median and standard deviation of the measurements made at a step, and how many
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0: #a step without measurements is not a measurement of 0
+        raise ForceSensorError("the force sensor made no measurements at a step")
+    return float(np.mean(values)), float(np.median(values)), float(np.std(values)), len(values)
+
+
+class Baseline: #running mean and standard deviation of the force measured while nothing touches the indenter
+    def __init__(self, window=None):
+        self.window = window  # measurements after which older ones count less, to follow slow drift, None to keep all
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared differences from the mean
+
+    def add(self, values): #add measurements to the baseline
+        if len(values) > 0:
+            mean, median, spread, count = step_statistics(values)
+            self.add_statistics(count, mean, spread)
+
+    def add_statistics(self, count, mean, spread): #add count measurements with a mean and standard deviation, merging them
+        # with Welford's method for groups of measurements
+        if self.window is not None and self.count > self.window: #forget part of the older measurements
+            self.m2 = self.m2 * self.window / self.count
+            self.count = self.window
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + spread ** 2 * count + delta ** 2 * self.count * count / total
+        self.count = total
+
+    def stdev(self): #sample standard deviation, like statistics.stdev
+        if self.count < 2:
+            return 0.0
+        return math.sqrt(self.m2 / (self.count - 1))
+
+
+class SensorChannel: #stands in for a GoDirect sensor, holding the measurements handed out by the last read
+    def __init__(self):
+        self.values = []
+
+    def clear(self):
+        self.values = []
+
+
+class SensorService: #streams the force sensor in the background and keeps its recent measurements
+    def __init__(self, device, sample_period=SAMPLE_PERIOD, capacity=CAPACITY):
+        self.device = device
+        self.sample_period = sample_period
+        self.capacity = capacity
+        self.times = np.zeros(2 * capacity)
+        self.values = np.zeros(2 * capacity)
+        self.count = 0  # number of measurements made since the service was started
+        self.new_data = Condition()
+        self.stopped = Event()
+        self.thread = None
+        self.error = None
+        self.channel = SensorChannel()
+        self.cursor = 0  # measurements handed out to code reading the service like a GoDirect device
+
+    def connect(self): #start the sensor and the thread reading it
+        with timing.timer.part("sensor start"):
+            self.device.start(period=self.sample_period)
+        self.stopped.clear()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def close(self): #stop the thread reading the sensor and the sensor itself
+        with timing.timer.part("sensor stop"):
+            self.stopped.set()
+            if self.thread is not None:
+                self.thread.join()
+                self.thread = None
+            self.device.stop()
+
+    def run(self):
+        sensors = self.device.get_enabled_sensors()
+        try:
+            while not self.stopped.is_set():
+                if not self.device.read():
+                    continue
+                read_time = time.monotonic()
+                for sensor in sensors:
+                    batch = list(sensor.values)
+                    sensor.clear()
+                    for i in range(0, len(batch)): #the newest value in a batch was measured when it was read
+                        self.add(read_time - (len(batch) - 1 - i) * self.sample_period / 1000, batch[i])
+                with self.new_data:
+                    self.new_data.notify_all()
+        except Exception as e:  # wake up anything waiting on a measurement so it can report the error
+            self.error = e
+            with self.new_data:
+                self.new_data.notify_all()
+
+    def add(self, measured, value): #save a measurement to both of its places in the ring buffer
+        i = self.count % self.capacity
+        self.times[i] = measured
+        self.times[i + self.capacity] = measured
+        self.values[i] = value
+        self.values[i + self.capacity] = value
+        self.count += 1
+
+    def since(self, index): #views of every measurement kept since the index-th one and the index to continue from
+        count = self.count
+        index = max(index, count - self.capacity)  # older measurements have been overwritten
+        start = index % self.capacity
+        return self.times[start:start + count - index], self.values[start:start + count - index], count
+
+    def wait(self, index, timeout=READ_TIMEOUT): #wait for measurements after the index-th one and return them like since
+        with timing.timer.part("sensor read"), self.new_data:
+            self.new_data.wait_for(lambda: self.count > index or self.error is not None, timeout)
+        if self.error is not None:
+            raise ForceSensorError(f"force sensor stopped: {self.error}")
+        return self.since(index)
+
+    def latest(self): #most recent measurement, or None if there is none yet
+        if self.count == 0:
+            return None
+        return self.values[(self.count - 1) % self.capacity]
+
+    def recent(self, number, timeout=READ_TIMEOUT): #copy of the last number of measurements, only waiting if there are fewer
+        if self.count < number:
+            self.next_values(number - self.count, timeout)
+        return self.since(max(0, self.count - number))[1].copy()
+
+    def next_values(self, number, timeout=READ_TIMEOUT): #the next number of measurements made after this is called,
+        #raises ForceSensorError if the sensor does not make them all within timeout seconds
+        index = self.count
+        deadline = time.monotonic() + timeout
+        while self.count < index + number and time.monotonic() < deadline:
+            self.wait(self.count, deadline - time.monotonic())
+        if self.count < index + number:
+            raise ForceSensorError(f"force sensor made {self.count - index} of {number} measurements in {timeout} "
+                                   f"seconds")
+        return self.since(index)[1][0:number].copy()
+
+    def settled(self, start, number, timeout=READ_TIMEOUT): #copy of every measurement made since start, a time from
+        #time.monotonic() such as when the cnc stopped moving, waiting until there are at least number of them. Raises
+        #ForceSensorError if the sensor does not make them within timeout seconds of when they could have been made
+        deadline = time.monotonic() + timeout + number * self.sample_period / 1000
+        while True:
+            times, values, count = self.since(0)
+            values = values[np.searchsorted(times, start, side='left'):]
+            if len(values) >= number:
+                return values.copy()
+            if time.monotonic() >= deadline:
+                raise ForceSensorError(f"force sensor made {len(values)} of {number} measurements after the cnc stopped")
+            self.wait(count, max(0, deadline - time.monotonic()))
+
+    def window(self, start, end): #views of the measurements made between two times from time.monotonic()
+        times, values, count = self.since(0)
+        first = np.searchsorted(times, start, side='left')
+        last = np.searchsorted(times, end, side='right')
+        return times[first:last], values[first:last]
+
+    def average(self, seconds): #average of the measurements made in the last number of seconds
+        now = time.monotonic()
+        values = self.window(now - seconds, now)[1]
+        if len(values) == 0:
+            return None
+        return float(np.mean(values))
+
+    # the service can be used in place of a GoDirect device, the sensor keeps streaming when it is stopped
+    def start(self, period=None): #only hand out measurements made from now on
+        self.cursor = self.count
+        self.channel.clear()
+
+    def stop(self):
+        pass
+
+    def get_enabled_sensors(self):
+        return [self.channel]
+
+    def read(self): #hand out every measurement made since the last read
+        values, self.cursor = self.wait(self.cursor)[1:3]
+        self.channel.values.extend(values.tolist())
+        return len(values) > 0
@@ -0,0 +1,481 @@
+"""
+This is a module which keeps a single serial connection to the GRBL controller open for an entire run, instead of
+opening the port, waking up the cnc and closing the port again for every movement.
+
+Opening the port resets the controller, which sets the current position to (0, 0, 0). The measurement scripts were
+written around this, so every movement is made relative to wherever the cnc was when the port was opened. To keep that
+behavior, a reused connection zeroes the coordinate system with G92 instead of resetting the controller, and so does a
+new connection the controller did not send its startup banner on, since it did not reset then.
+
+Parts of this code are adapted from the python_to_GRBL github repository found here:
+
+https://github.com/Sam-Freitas/python_to_GRBL/tree/main
+Copyright (c) 2016 Florent Gallaire <fgallaire@gmail.com>
+Copyright (c) 2014 Gabriele Cirulli
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+"""
+
+import serial
+import statistics
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import timing
+
+BAUD_RATE = 115200
+WAKE_UP_TIME = 2  # time in seconds the cnc needs to initialize after the port is opened
+RX_BUFFER_SIZE = 128  # size of grbl's serial receive buffer in bytes
+POLL_INTERVAL = 0.02  # minimum time in seconds between status requests while waiting for the cnc to stop
+MOTION_TIMEOUT = 300  # longest time in seconds a single movement is allowed to take
+RESPONSE_TIMEOUT = 2  # longest time in seconds grbl can go without answering before the connection is considered lost
+POSITION_TOLERANCE = 0.005  # distance in mm from the target position that counts as having arrived
+WCO_REPORTS = 30  # most status reports grbl sends between the ones with its work coordinate offset in them
+FEED_HOLD = b'!'  # real-time commands, acted on as soon as grbl receives them
+SOFT_RESET = b'\x18'
+JOG_CANCEL = b'\x85'
+
+sessions = {}  # one session for each serial port, shared by every function that moves the cnc
+work_offset = None  # last WCO grbl reported, used to turn MPos into work coordinates
+
+
+class GRBLError(Exception): #raised when grbl reports an error
+    pass
+
+
+class GRBLAlarmError(GRBLError): #raised when grbl goes into alarm, for example after hitting a limit switch
+    pass
+
+
+class GRBLConnectionError(GRBLError): #raised when grbl stops answering or the port is lost
+    pass
+
+
+class GRBLTimeoutError(GRBLError): #raised when a movement takes longer than it is allowed to
+    pass
+
+
+class WaitStats: #keeps track of how long every wait for a movement to finish took
+    def __init__(self):
+        self.calls = []  # (seconds waited, number of status requests) for each wait
+
+    def record(self, seconds, polls):
+        self.calls.append((seconds, polls))
+        timing.timer.add("motion wait", seconds)
+
+    def summary(self):
+        if not self.calls:
+            return {'count': 0}
+        waits = [call[0] for call in self.calls]
+        return {'count': len(waits), 'total': sum(waits), 'mean': statistics.mean(waits), 'min': min(waits),
+                'max': max(waits), 'polls': sum(call[1] for call in self.calls)}
+
+    def report(self):
+        summary = self.summary()
+        if summary['count'] == 0:
+            return
+        print(f"Waited for {summary['count']} movements for a total of {round(summary['total'], 1)} seconds, "
+              f"{round(summary['mean'] * 1000)} ms on average and {round(summary['max'] * 1000)} ms at most")
+
+
+wait_stats = WaitStats()
+
+
+def remove_comment(string):
+    if (string.find(';') == -1):
+        return string
+    else:
+        return string[:string.index(';')]
+
+
+def remove_eol_chars(string):
+    # removed \n or traling spaces
+    return string.strip()
+
+
+class TimedSerial(serial.Serial): #serial port which times every command written to grbl, status requests included
+    def write(self, data):
+        with timing.timer.part("command send"):
+            return super().write(data)
+
+
+def send_wake_up(ser):
+    # Wake up
+    # Hit enter a few times to wake the cnc
+    ser.write(str.encode("\r\n\r\n"))
+    time.sleep(WAKE_UP_TIME)  # Wait for cnc to initialize
+    startup = ser.read(ser.in_waiting)  # startup text, which has the grbl banner in it if the cnc was reset
+    ser.flushInput()  # Flush startup text in serial input
+    return startup
+
+
+class GRBLSession: #keeps the connection to the cnc open for a whole run and reopens it if it is lost
+    def __init__(self, port_path, baud_rate=BAUD_RATE):
+        self.port_path = port_path
+        self.baud_rate = baud_rate
+        self.ser = None
+        self.connects = 0  # number of times the port actually had to be opened
+        self.uses = 0  # number of movements that asked for a connection
+        self.was_reset = True  # whether grbl reset, losing its position, when the port was last opened
+
+    def is_connected(self): #check that the port is still open and the usb cable has not been unplugged
+        if self.ser is None or not self.ser.is_open:
+            return False
+        try:
+            self.ser.in_waiting
+        except (serial.SerialException, OSError):
+            return False
+        return True
+
+    def connect(self): #open the port and wait for the cnc to wake up
+        global work_offset
+        self.close()
+        work_offset = None  # grbl resets when the port is opened
+        self.ser = TimedSerial(self.port_path, self.baud_rate)
+        with timing.timer.part("serial wake-up"):
+            self.was_reset = b'Grbl' in send_wake_up(self.ser)
+        self.connects += 1
+
+    def close(self):
+        if self.ser is not None:
+            try:
+                self.ser.close()
+            except (serial.SerialException, OSError):
+                pass
+            self.ser = None
+
+    def zero(self): #set the current position to (0, 0, 0), which is what reopening the port used to do
+        set_work_position(self.ser, [0, 0, 0])
+
+    def open(self): #return an open connection, only reconnecting if the old one was lost
+        self.uses += 1
+        if not self.is_connected():
+            self.connect()
+            if self.was_reset: #grbl reset when the port was opened, which already put it at (0, 0, 0)
+                return self.ser
+        try: #the port was reused, or grbl did not reset when it was opened and still has its old work position
+            self.zero()
+        except GRBLConnectionError: #the next movement reconnects
+            self.close()
+            raise
+        return self.ser
+
+    def time_saved(self): #wall time not spent waking up the cnc compared to reopening the port for every movement
+        return (self.uses - self.connects) * WAKE_UP_TIME
+
+    def report(self, num_wells=0):
+        saved = self.time_saved()
+        print(f"Serial port {self.port_path} was opened {self.connects} times for {self.uses} movements, saving "
+              f"{round(saved)} seconds")
+        if num_wells > 0:
+            print(f"This is about {round(saved / num_wells, 1)} seconds saved per well")
+
+
+def get_session(port_path, baud_rate=BAUD_RATE):
+    if port_path not in sessions:
+        sessions[port_path] = GRBLSession(port_path, baud_rate)
+    return sessions[port_path]
+
+
+@contextmanager
+def connection(port_path, baud_rate=BAUD_RATE): #used in place of serial.Serial, but leaves the port open afterwards
+    session = get_session(port_path, baud_rate)
+    ser = session.open()
+    try:
+        yield ser
+    except (serial.SerialException, OSError):
+        session.close()  # connection was lost, the next movement will reconnect
+        raise
+
+
+def report_sessions(num_wells=0): #print how much time was saved by keeping the port open
+    for session in sessions.values():
+        session.report(num_wells)
+
+
+def close_sessions():
+    for session in sessions.values():
+        session.close()
+    sessions.clear()
+
+
+def parse_status(response): #turn a grbl 1.1 status report such as <Idle|MPos:0.000,0.000,-1.020|FS:0,0> into a dictionary
+    if not (response.startswith('<') and response.endswith('>')):
+        return None
+    fields = response[1:-1].split('|')
+    state, _, substate = fields[0].partition(':')
+    status = {'state': state, 'substate': int(substate) if substate else 0}
+    for field in fields[1:]:
+        name, _, value = field.partition(':')
+        if name in ('MPos', 'WPos', 'WCO'):
+            status[name] = [float(v) for v in value.split(',')]
+    return status
+
+
+def track_work_offset(status): #remember the work coordinate offset, since grbl only sends it every so often
+    global work_offset
+    if 'WCO' in status:
+        work_offset = status['WCO']
+
+
+def work_position(status): #position in the coordinate system gcode moves are written in, if it is known
+    if 'WPos' in status:
+        return status['WPos']
+    if work_offset is None:
+        return None
+    return [status['MPos'][i] - work_offset[i] for i in range(0, 3)]
+
+
+def machine_position(status): #position in machine coordinates, which G92 does not change, if it is known
+    if 'MPos' in status:
+        return status['MPos']
+    if work_offset is None:
+        return None
+    return [status['WPos'][i] + work_offset[i] for i in range(0, 3)]
+
+
+def parse_target(gcode): #find where a G00/G01 line will move the cnc to, assuming absolute positioning (G90)
+    words = remove_eol_chars(remove_comment(gcode)).upper().split()
+    if not words or words[0] not in ('G0', 'G00', 'G1', 'G01'):
+        return None
+    target = {}
+    for word in words[1:]:
+        if word[0] in 'XYZ':
+            target['XYZ'.index(word[0])] = float(word[1:])
+    return target
+
+
+def report_position(status): #position from a status report, grbl sends either MPos or WPos depending on its settings
+    if 'MPos' in status:
+        return status['MPos']
+    return status['WPos']
+
+
+@contextmanager
+def read_timeout(ser, timeout): #stop reads from blocking forever while waiting on grbl
+    old_timeout = ser.timeout
+    ser.timeout = timeout
+    try:
+        yield
+    finally:
+        ser.timeout = old_timeout
+
+
+def read_responses(ser, received): #read what grbl has sent so far, returning full lines and the unfinished last line
+    try:
+        received = received + ser.read(max(1, ser.in_waiting))
+    except (serial.SerialException, OSError) as e:
+        raise GRBLConnectionError(f"Lost connection to grbl: {e}") from e
+    *lines, received = received.split(b'\n')
+    responses = [line.strip().decode('utf-8', 'replace') for line in lines if line.strip()]
+    return responses, received
+
+
+def stream_program(ser, gcode, on_status=None, should_stop=None, status_interval=0.05):
+    #stream gcode using character counting, so grbl's receive buffer and planner are kept full and the cnc moves
+    #smoothly from one line to the next instead of stopping after every line
+    blocks = []
+    for line in gcode:
+        cleaned_line = remove_eol_chars(remove_comment(line))
+        if cleaned_line:  # checks if string is empty
+            blocks.append(str.encode(cleaned_line + '\n'))
+    pending = deque()  # lengths of lines sent to grbl that have not been acknowledged yet
+    errors = []
+    received = b''
+    sent = 0
+    acked = 0
+    idle = False
+    last_status = 0
+    with read_timeout(ser, status_interval):
+        while not (acked == len(blocks) and idle):
+            if should_stop is not None and should_stop():
+                break
+            while sent < len(blocks) and sum(pending) + len(blocks[sent]) <= RX_BUFFER_SIZE: #fill receive buffer
+                ser.write(blocks[sent])
+                pending.append(len(blocks[sent]))
+                sent += 1
+            if time.monotonic() - last_status >= status_interval: #ask for position, does not use the buffer
+                ser.write(b'?')
+                last_status = time.monotonic()
+            responses, received = read_responses(ser, received)
+            for response in responses:
+                if response == 'ok' or response.startswith('error'):
+                    if pending:
+                        pending.popleft()
+                        acked += 1
+                    if response != 'ok':
+                        errors.append((blocks[acked - 1].decode().strip(), response))
+                elif response.startswith('<'):
+                    status = parse_status(response)
+                    if status is None:
+                        continue
+                    track_work_offset(status)
+                    if on_status is not None:
+                        on_status(status)
+                    idle = acked == len(blocks) and status['state'] == 'Idle'
+                elif response.startswith('ALARM'):
+                    raise GRBLAlarmError(f"grbl reported {response} while streaming gcode")
+    return acked, errors
+
+
+def query_status(ser, timeout=RESPONSE_TIMEOUT): #ask grbl for a single status report
+    ser.reset_input_buffer()
+    ser.write(b'?')
+    received = b''
+    deadline = time.monotonic() + timeout
+    with read_timeout(ser, POLL_INTERVAL):
+        while time.monotonic() < deadline:
+            responses, received = read_responses(ser, received)
+            for response in responses:
+                status = parse_status(response)
+                if status is not None:
+                    track_work_offset(status)
+                    return status
+    raise GRBLConnectionError(f"grbl did not answer a status request within {timeout} seconds")
+
+
+def set_work_position(ser, position): #tell grbl with G92 that the cnc is at position in work coordinates
+    global work_offset
+    work_offset = None  # G92 changes the work coordinate offset, grbl sends the new one with its next status
+    command = "G92 " + " ".join(f"{'XYZ'[i]}{round(position[i], 3)}" for i in range(0, 3))
+    ser.reset_input_buffer()
+    ser.write(str.encode(command + "\n"))
+    received = b''
+    deadline = time.monotonic() + RESPONSE_TIMEOUT
+    with read_timeout(ser, POLL_INTERVAL):
+        while time.monotonic() < deadline: #wait for grbl to acknowledge the G92
+            responses, received = read_responses(ser, received)
+            for response in responses:
+                if response == 'ok':
+                    return
+                if response.startswith('error:'):
+                    raise GRBLError(f"grbl answered {response} to {command}")
+    raise GRBLConnectionError(f"grbl did not answer {command} within {RESPONSE_TIMEOUT} seconds")
+
+
+def at_target(status, target): #check if the cnc has reached the position a movement was sent to
+    if not target:
+        return True
+    position = work_position(status)
+    if position is None:  # offset not known yet, so only the idle state can be checked
+        return True
+    for axis, value in target.items():
+        if abs(position[axis] - value) > POSITION_TOLERANCE:
+            return False
+    return True
+
+
+def wait_for_idle(ser, target=None, ack=True, timeout=MOTION_TIMEOUT, poll_interval=POLL_INTERVAL):
+    #wait for the cnc to finish a movement, asking for its status at most once every poll_interval seconds and returning
+    #as soon as it is idle at the target position. If ack is True, the ok for the command is read first so a status
+    #report sent before grbl has even read the command is not mistaken for the end of the movement
+    start = time.monotonic()
+    deadline = start + timeout
+    last_answer = start
+    last_poll = 0
+    polls = 0
+    idle_reports = 0
+    needed = 1 if target else 2  # without a target, make sure the cnc did not just stop between two moves
+    received = b''
+    with read_timeout(ser, poll_interval):
+        while True:
+            now = time.monotonic()
+            if now > deadline:
+                raise GRBLTimeoutError(f"Movement did not finish within {timeout} seconds")
+            if now - last_answer > RESPONSE_TIMEOUT + poll_interval:
+                raise GRBLConnectionError(f"grbl has not answered for {RESPONSE_TIMEOUT} seconds")
+            if not ack and now - last_poll >= poll_interval:
+                try:
+                    ser.write(b'?')  # real-time command, answered right away even while moving
+                except (serial.SerialException, OSError) as e:
+                    raise GRBLConnectionError(f"Lost connection to grbl: {e}") from e
+                last_poll = now
+                polls += 1
+            responses, received = read_responses(ser, received)
+            for response in responses:
+                last_answer = time.monotonic()
+                if response == 'ok':
+                    ack = False
+                elif response.startswith('error'):
+                    raise GRBLError(f"grbl rejected the command with {response}")
+                elif response.startswith('ALARM'):
+                    raise GRBLAlarmError(f"grbl reported {response}, the cnc must be checked and unlocked with $X")
+                elif response.startswith('<'):
+                    status = parse_status(response)
+                    if status is None:
+                        continue
+                    track_work_offset(status)
+                    if status['state'] == 'Alarm':
+                        raise GRBLAlarmError("grbl is in alarm, the cnc must be checked and unlocked with $X")
+                    if status['state'] == 'Idle' and at_target(status, target):
+                        idle_reports += 1
+                    else:
+                        idle_reports = 0
+                    if idle_reports >= needed:
+                        wait_stats.record(time.monotonic() - start, polls)
+                        return status
+
+
+def feed_hold(ser): #start slowing the cnc down right away, safe to call from another thread while the cnc moves
+    ser.write(FEED_HOLD)
+
+
+def jog_line(gcode): #turn a G00/G01 line into a jog, which grbl can cancel without a reset
+    words = remove_eol_chars(remove_comment(gcode)).split()
+    return "$J=G90 " + " ".join(words[1:])
+
+
+def cancel_jog(ser): #stop a jog and wait for the cnc to come to rest, grbl keeps its position
+    ser.write(JOG_CANCEL)
+    status = query_status(ser)
+    while status['state'] != 'Idle':
+        if status['state'] == 'Alarm':
+            raise GRBLAlarmError("grbl went into alarm while stopping a jog")
+        time.sleep(POLL_INTERVAL)
+        status = query_status(ser)
+    return status
+
+
+def cancel_motion(ser): #stop the cnc and throw away any gcode still waiting in grbl's buffers. The reset this takes
+    #also clears G92 and the modal state, so the work position is set back to what it was afterwards. The modal state
+    #is not restored, every movement of the measure programs is an absolute G01 with its own feed rate
+    feed_hold(ser)  # decelerates to a stop without losing position
+    status = query_status(ser)
+    while status['state'] not in ('Idle', 'Hold') or status['substate'] != 0:  # Hold:0 means the cnc has stopped
+        time.sleep(POLL_INTERVAL)
+        status = query_status(ser)
+    position = work_position(status)
+    for report in range(0, WCO_REPORTS): #the work position is only known once grbl has sent its offset
+        if position is not None:
+            break
+        position = work_position(query_status(ser))
+    if position is None:
+        raise GRBLConnectionError(f"grbl did not send its work coordinate offset in {WCO_REPORTS} status reports")
+    ser.write(SOFT_RESET)  # clears the planner now that the cnc is stopped
+    received = b''
+    deadline = time.monotonic() + RESPONSE_TIMEOUT
+    with read_timeout(ser, POLL_INTERVAL):
+        while time.monotonic() < deadline:  # wait for grbl to restart
+            responses, received = read_responses(ser, received)
+            if any(response.startswith('Grbl') for response in responses):
+                break
+    ser.reset_input_buffer()
+    set_work_position(ser, position)
@@ -0,0 +1,445 @@
+"""
+This is a module with a simulated GRBL 1.1 controller served over a pseudo terminal, so the programs that move the cnc
+can be run and timed on a Linux computer without the cnc plugged in. The programs open the pseudo terminal like any
+other serial port, so nothing in grbl.py has to change to talk to it.
+
+The simulator answers every line of gcode with ok or error, keeps lines waiting in a 128 byte receive buffer while its
+15 block planner is full, and moves through the planned blocks with the feed rate and acceleration limits grbl has, so
+movements take about as long as they do on the cnc. Consecutive blocks in the same direction are joined without
+stopping. The real-time commands for status reports, feed hold, resume, soft reset and jog cancel are acted on as soon
+as they are received. Opening the port resets the simulator like it resets grbl, setting the machine position to 0,
+unless reset_on_open is False, like a cnc that does not reset when the port is opened or was already awake.
+
+G0, G1, G4, G90, G91, G92 and G92.1 are supported, along with jogging with $J=, the $$, $#, $G, $I and $X commands, and
+changing the max rate and acceleration settings $110 to $122. The cnc has no limit switches and homing is not enabled.
+
+The simulator also keeps track of where the indenter really is, which does not change when grbl is reset, so a
+simulated force sensor can follow it. The measure programs start a simulator of their own when ASMI_SIMULATE is set
+and ASMI_GRBL_PORT is not. Run this module on its own to serve a simulator until Ctrl + C is pressed, and set the
+ASMI_GRBL_PORT environment variable to the port it prints to use it from the other programs. Set ASMI_SIM_SPEED to make
+the simulated cnc move that many times faster than the real one.
+"""
+
+import math
+import os
+import pty
+import re
+import select
+import sys
+import time
+import tty
+from collections import deque
+from threading import Event, Lock, Thread
+
+BANNER = b"\r\nGrbl 1.1h ['$' for help]\r\n"
+RX_BUFFER_SIZE = 128  # size of grbl's serial receive buffer in bytes
+PLANNER_SIZE = 15  # blocks grbl's planner holds
+SETTINGS = {110: 500, 111: 500, 112: 500, 120: 10, 121: 10, 122: 10}  # max rates in mm/min and accelerations in
+# mm/s^2 of the x, y and z axes, grbl's defaults
+WCO_INTERVAL = 10  # status reports between the ones the work coordinate offset is sent with, unless it changed
+LOOP_INTERVAL = 0.001  # longest time in seconds between updates of the simulated motion
+
+
+class Block: #a straight movement, or a dwell, in the planner
+    def __init__(self, start, end, rate, acceleration, jog=False, dwell=0):
+        self.start = list(start)
+        self.end = list(end)
+        delta = [end[i] - start[i] for i in range(0, 3)]
+        self.length = math.sqrt(sum(d * d for d in delta))
+        self.unit = [d / self.length for d in delta] if self.length > 0 else [0, 0, 0]
+        self.rate = rate  # mm/s
+        self.acceleration = acceleration  # mm/s^2
+        self.jog = jog
+        self.dwell = dwell  # seconds to wait instead of moving
+        self.start_time = None
+        self.plan(0, 0)
+
+    def plan(self, v0, v1): #fit an accelerate, cruise and decelerate profile from entry speed v0 to exit speed v1
+        a = self.acceleration
+        v1 = min(v1, math.sqrt(v0 * v0 + 2 * a * self.length))
+        peak = min(self.rate, math.sqrt((2 * a * self.length + v0 * v0 + v1 * v1) / 2))
+        peak = max(peak, v0, v1)
+        self.v0, self.peak, self.v1 = v0, peak, v1
+        self.d_acc = (peak * peak - v0 * v0) / (2 * a)
+        self.d_dec = (peak * peak - v1 * v1) / (2 * a)
+        self.t_acc = (peak - v0) / a
+        self.t_dec = (peak - v1) / a
+        cruise = max(0, self.length - self.d_acc - self.d_dec)
+        self.t_cruise = cruise / peak if peak > 0 else 0
+        self.duration = self.t_acc + self.t_cruise + self.t_dec + self.dwell
+
+    def distance(self, t): #distance moved t seconds after the block started
+        a = self.acceleration
+        if t < self.t_acc:
+            return self.v0 * t + a * t * t / 2
+        t = t - self.t_acc
+        if t < self.t_cruise:
+            return self.d_acc + self.peak * t
+        t = min(t - self.t_cruise, self.t_dec)
+        return min(self.length, self.d_acc + self.peak * self.t_cruise + self.peak * t - a * t * t / 2)
+
+    def speed(self, t): #speed in mm/s t seconds after the block started
+        if t < self.t_acc:
+            return self.v0 + self.acceleration * t
+        t = t - self.t_acc
+        if t < self.t_cruise:
+            return self.peak
+        return max(0, self.peak - self.acceleration * (t - self.t_cruise))
+
+    def position(self, t):
+        distance = self.distance(t)
+        return [self.start[i] + self.unit[i] * distance for i in range(0, 3)]
+
+
+class GRBLSimulator: #a simulated grbl controller on the slave end of a pseudo terminal
+    def __init__(self, time_scale=1, position=None, reset_on_open=True):
+        self.time_scale = time_scale  # how many times faster than real time the cnc moves
+        self.reset_on_open = reset_on_open  # whether opening the port resets grbl and sends its banner
+        self.settings = dict(SETTINGS)
+        self.physical = [float(value) for value in position] if position is not None else [0.0, 0.0, 0.0]  # where the
+        # indenter really is, measured from the home position, which a reset does not change
+        self.origin = [0.0, 0.0, 0.0]  # physical position of machine position 0, set when grbl is reset
+        self.offset = [0.0, 0.0, 0.0]  # G92 offset of the work coordinates from the machine coordinates
+        self.lock = Lock()
+        self.stopped = Event()
+        self.master = None
+        self.port = None
+        self.thread = None
+        self.connected = False
+        self.lines = 0  # lines of gcode executed
+        self.overflows = 0  # bytes thrown away because the receive buffer was full
+        self.most_buffered = 0  # most bytes the receive buffer has held
+        self.reset(power=True)
+
+    def start(self): #open the pseudo terminal and start serving it
+        self.master, slave = pty.openpty()
+        self.port = os.ttyname(slave)
+        tty.setraw(slave)  # so nothing sent before the port is set up is echoed back
+        os.close(slave)  # the program using the simulator opens the port itself
+        self.t0 = time.monotonic()
+        self.stopped.clear()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.master is not None:
+            os.close(self.master)
+            self.master = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def clock(self): #simulated time in seconds
+        return (time.monotonic() - self.t0) * self.time_scale
+
+    def reset(self, power=False): #what grbl does when it is reset, power is True when the port was opened
+        self.rx = b''
+        self.queue = deque()
+        self.current = None
+        self.exit_speed = 0
+        self.free_time = 0  # time the last block finished at
+        self.hold = False
+        self.absolute = True
+        self.motion = 0  # modal motion mode, G0 or G1
+        self.feed = 0
+        self.reports = 0
+        self.last_offset = None
+        self.offset = [0.0, 0.0, 0.0]  # grbl forgets G92 on every reset, not only when the port is opened
+        if power:
+            self.origin = list(self.physical)
+            self.alarm = False
+        self.planned = list(self.physical)  # physical position at the end of the last block in the planner
+
+    def position(self): #where the indenter really is, for a simulated force sensor
+        with self.lock:
+            return list(self.physical)
+
+    def machine_position(self):
+        with self.lock:
+            return [self.physical[i] - self.origin[i] for i in range(0, 3)]
+
+    def run(self):
+        poller = select.poll()
+        poller.register(self.master, select.POLLIN)
+        while not self.stopped.is_set():
+            events = poller.poll(LOOP_INTERVAL * 1000)
+            hung_up = any(event & select.POLLHUP for fd, event in events)
+            received = b''
+            if hung_up:
+                self.connected = False
+                time.sleep(LOOP_INTERVAL)  # poll does not wait while nothing has the port open
+            else:
+                if not self.connected: #the port was opened, which resets grbl
+                    self.connected = True
+                    if self.reset_on_open:
+                        with self.lock:
+                            self.reset(power=True)
+                        self.send(BANNER)
+                if any(event & select.POLLIN for fd, event in events):
+                    try:
+                        received = os.read(self.master, 1024)
+                    except OSError:
+                        received = b''
+            with self.lock:
+                now = self.clock()
+                self.update(now)
+                for byte in received:
+                    self.receive(bytes([byte]), now)
+                self.process_lines(now)
+
+    def send(self, data):
+        if self.connected:
+            try:
+                os.write(self.master, data)
+            except OSError:
+                pass
+
+    def receive(self, byte, now): #act on real-time commands right away, everything else goes in the receive buffer
+        if byte == b'?':
+            self.send(self.status_report(now))
+        elif byte == b'!':
+            if not self.hold and self.current is not None:
+                self.hold = True
+                self.decelerate(now, keep_rest=True)
+        elif byte == b'~':
+            if self.hold:
+                self.hold = False
+                self.exit_speed = 0
+        elif byte == b'\x85':
+            if self.current is not None and self.current.jog:
+                self.decelerate(now, keep_rest=False)
+                self.queue = deque(block for block in self.queue if not block.jog)
+        elif byte == b'\x18':
+            moving = self.current is not None and self.current.dwell == 0
+            self.reset()
+            if moving: #stopping without slowing down loses steps, so grbl no longer knows where it is
+                self.alarm = True
+                self.send(b"ALARM:3\r\n")
+            self.send(BANNER)
+            if self.alarm:
+                self.send(b"[MSG:'$H'|'$X' to unlock]\r\n")
+        elif len(self.rx) >= RX_BUFFER_SIZE:
+            self.overflows += 1
+        else:
+            self.rx = self.rx + byte
+            self.most_buffered = max(self.most_buffered, len(self.rx))
+
+    def decelerate(self, now, keep_rest): #replace the block being executed with slowing down to a stop along it
+        block = self.current
+        t = now - block.start_time
+        position = block.position(t)
+        speed = block.speed(t) if block.dwell == 0 else 0
+        travelled = block.distance(t)
+        stop = min(speed * speed / (2 * block.acceleration), block.length - travelled)
+        end = [position[i] + block.unit[i] * stop for i in range(0, 3)]
+        stopping = Block(position, end, max(speed, 1e-9), block.acceleration, block.jog)
+        stopping.plan(speed, 0)
+        stopping.start_time = now
+        if keep_rest and block.length - travelled - stop > 1e-9:
+            self.queue.appendleft(Block(end, block.end, block.rate, block.acceleration, block.jog))
+        self.current = stopping
+
+    def update(self, now): #move through the planned blocks up to time now
+        while True:
+            if self.current is None:
+                if self.hold or not self.queue:
+                    self.exit_speed = 0
+                    break
+                block = self.queue.popleft()
+                start_time = self.free_time if self.exit_speed > 0 else max(now, self.free_time)
+                block.plan(self.exit_speed, self.junction_speed(block))
+                block.start_time = start_time
+                self.current = block
+            block = self.current
+            t = now - block.start_time
+            if t < block.duration:
+                self.physical = block.position(t)
+                break
+            self.physical = list(block.end)
+            self.exit_speed = block.v1
+            self.free_time = block.start_time + block.duration
+            self.current = None
+
+    def junction_speed(self, block): #fastest speed the cnc can go from a block into the next one, so that it can still
+        #stop at the end of the blocks in the planner
+        joined = []
+        previous = block
+        for following in self.queue:
+            if following.dwell or previous.dwell or following.jog != previous.jog:
+                break
+            if sum(previous.unit[i] * following.unit[i] for i in range(0, 3)) < 1 - 1e-6: #grbl slows down at corners
+                break
+            joined.append(following)
+            previous = following
+        speed = 0
+        for following in reversed(joined):
+            speed = min(following.rate, math.sqrt(speed * speed + 2 * following.acceleration * following.length))
+        return min(speed, block.rate)
+
+    def status_report(self, now):
+        if self.alarm:
+            state = 'Alarm'
+        elif self.hold:
+            state = 'Hold:1' if self.current is not None else 'Hold:0'
+        elif self.current is not None or self.queue:
+            state = 'Jog' if (self.current or self.queue[0]).jog else 'Run'
+        else:
+            state = 'Idle'
+        speed = 0
+        if self.current is not None and self.current.dwell == 0:
+            speed = self.current.speed(now - self.current.start_time)
+        mpos = [self.physical[i] - self.origin[i] for i in range(0, 3)]
+        report = f"<{state}|MPos:{mpos[0]:.3f},{mpos[1]:.3f},{mpos[2]:.3f}|FS:{round(speed * 60)},0"
+        self.reports -= 1
+        if self.reports <= 0 or self.offset != self.last_offset:
+            report = report + f"|WCO:{self.offset[0]:.3f},{self.offset[1]:.3f},{self.offset[2]:.3f}"
+            self.reports = WCO_INTERVAL
+            self.last_offset = list(self.offset)
+        return (report + ">\r\n").encode()
+
+    def process_lines(self, now): #execute the lines in the receive buffer while the planner has room for them
+        while b'\n' in self.rx:
+            if len(self.queue) >= PLANNER_SIZE:
+                break
+            line, _, self.rx = self.rx.partition(b'\n')
+            line = line.decode('ascii', 'replace')
+            if line.startswith('$') and not line.startswith('$J=') and (self.current or self.queue):
+                self.rx = line.encode() + b'\n' + self.rx  # system commands wait for the cnc to stop
+                break
+            self.lines += 1
+            self.send((self.execute(line, now) + "\r\n").encode())
+
+    def execute(self, line, now): #carry out a line of gcode or a system command and return grbl's answer
+        line = re.sub(r'\(.*?\)', '', line.split(';')[0]).replace(' ', '').replace('\r', '').upper()
+        if line == '':
+            return 'ok'
+        if line.startswith('$'):
+            return self.system_command(line)
+        if self.alarm:
+            return 'error:9'
+        return self.gcode(line, jog=False)
+
+    def gcode(self, line, jog):
+        words = re.findall(r'([A-Z])([-+]?\d*\.?\d*)', line)
+        if ''.join(letter + number for letter, number in words) != line:
+            return 'error:1'
+        values = {}
+        absolute = self.absolute
+        motion = self.motion
+        non_modal = None
+        for letter, number in words:
+            try:
+                value = float(number)
+            except ValueError:
+                return 'error:2'
+            if letter == 'G':
+                if value in (0, 1):
+                    motion = int(value)
+                elif value == 90:
+                    absolute = True
+                elif value == 91:
+                    absolute = False
+                elif value in (4, 92, 92.1):
+                    non_modal = value
+                elif value not in (17, 21, 54, 94):
+                    return 'error:20'
+            elif letter == 'M':
+                if value not in (0, 2, 3, 4, 5, 8, 9, 30):
+                    return 'error:20'
+            elif letter in 'XYZFP':
+                values[letter] = value
+            elif letter not in 'ST':
+                return 'error:20'
+        feed = values.get('F', self.feed if not jog else 0)
+        if not jog:
+            self.absolute, self.motion, self.feed = absolute, motion, feed
+        work = [self.planned[i] - self.origin[i] - self.offset[i] for i in range(0, 3)]
+        target = list(work)
+        for i in range(0, 3):
+            if 'XYZ'[i] in values:
+                target[i] = values['XYZ'[i]] if absolute else work[i] + values['XYZ'[i]]
+        if non_modal == 92:
+            self.offset = [self.planned[i] - self.origin[i] - target[i] for i in range(0, 3)]
+            return 'ok'
+        if non_modal == 92.1:
+            self.offset = [0.0, 0.0, 0.0]
+            return 'ok'
+        if non_modal == 4:
+            if 'P' not in values:
+                return 'error:28'
+            self.queue.append(Block(self.planned, self.planned, 1, 1, dwell=values['P']))
+            return 'ok'
+        if target == work:
+            return 'ok'
+        if (motion == 1 or jog) and feed <= 0:
+            return 'error:22'
+        end = [target[i] + self.origin[i] + self.offset[i] for i in range(0, 3)]
+        rate, acceleration = self.limits([end[i] - self.planned[i] for i in range(0, 3)])
+        if motion == 1 or jog:
+            rate = min(rate, feed / 60)
+        self.queue.append(Block(self.planned, end, rate, acceleration, jog))
+        self.planned = end
+        return 'ok'
+
+    def limits(self, delta): #max rate in mm/s and acceleration in mm/s^2 along a movement, from the axis settings
+        length = math.sqrt(sum(d * d for d in delta))
+        rate = math.inf
+        acceleration = math.inf
+        for i in range(0, 3):
+            if delta[i] != 0:
+                share = abs(delta[i]) / length
+                rate = min(rate, self.settings[110 + i] / 60 / share)
+                acceleration = min(acceleration, self.settings[120 + i] / share)
+        return rate, acceleration
+
+    def system_command(self, line):
+        if line.startswith('$J='):
+            if self.alarm or self.hold:
+                return 'error:8'
+            if 'F' not in line:
+                return 'error:22'
+            return self.gcode(line[3:], jog=True)
+        if line == '$X':
+            self.alarm = False
+            return "[MSG:Caution: Unlocked]\r\nok"
+        if line == '$$':
+            return "\r\n".join(f"${key}={value:.3f}" for key, value in self.settings.items()) + "\r\nok"
+        if line == '$#':
+            return f"[G92:{self.offset[0]:.3f},{self.offset[1]:.3f},{self.offset[2]:.3f}]\r\nok"
+        if line == '$G':
+            return f"[GC:G{self.motion} G54 G17 G21 G{90 if self.absolute else 91} G94 M5 M9 T0 F{self.feed:g} S0]\r\nok"
+        if line == '$I':
+            return "[VER:1.1h.20190825:]\r\n[OPT:V,15,128]\r\nok"
+        if line == '$':
+            return "[HLP:$$ $# $G $I $N $x=val $Nx=line $J=line $SLP $C $X $H ~ ! ? ctrl-x]\r\nok"
+        if line == '$H':
+            return 'error:5'
+        match = re.fullmatch(r'\$(\d+)=([-+]?\d*\.?\d+)', line)
+        if match:
+            if int(match.group(1)) in self.settings:
+                self.settings[int(match.group(1))] = float(match.group(2))
+            return 'ok'
+        return 'error:3'
+
+
+def start_from_environment(position=None): #simulator started in the background with the indenter at position, moving
+    #ASMI_SIM_SPEED times faster than real time
+    return GRBLSimulator(float(os.environ.get("ASMI_SIM_SPEED", 1)), position).start()
+
+
+if __name__ == "__main__":
+    simulator = GRBLSimulator(float(sys.argv[1]) if len(sys.argv) > 1 else 1).start()
+    print(f"Simulated grbl is on {simulator.port}, set ASMI_GRBL_PORT={simulator.port} to use it. Press Ctrl + C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
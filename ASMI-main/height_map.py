@@ -0,0 +1,66 @@
+"""
+This is a module which keeps a height map of the plate being tested: the height the indenter first made contact with the
+sample in every well tested so far. It is used to predict where contact will start in the wells that have not been
+tested yet, from the wells around them and from earlier trials of the same well, so the fast approach can skip the air
+above the sample and only start indenting just above the predicted surface.
+
+The height map is saved next to the data file after every well, so later trials of measure_over_time, or a program that
+is restarted part way through a plate, start from the heights found before.
+"""
+
+import csv
+import math
+import os
+
+COLS = ["A", "B", "C", "D", "E", "F", "G", "H"]
+NEIGHBOURS = 4  # number of closest tested wells used to predict the height of a well that has not been tested yet
+
+
+def well_position(well): #column and row of a well on the plate
+    return COLS.index(well[0]), int(well[1:])
+
+
+def contact_height(data, well, run_array, extra=()):
+    #height the indenter made contact at in a well, from its rows in the data file and the run_array collect_run_data
+    #made of them. Every depth in run_array is relative to the height contact started at, so any row gives it
+    rows = [row for row in data if row[0] == well and row[3:3 + len(extra)] == [str(value) for value in extra]]
+    if len(rows) < 2 or len(run_array) == 0:
+        return None
+    return round(float(rows[1][1]) + run_array[0][0], 2)  # the first row is the no contact measurement
+
+
+class HeightMap: #heights contact was made at in every tested well, saved to filename as rows of [well, height]
+    def __init__(self, filename):
+        self.filename = filename
+        self.heights = {}  # well -> height of every trial of the well, in the order they were tested
+        if os.path.exists(filename):
+            with open(filename, 'r') as csvfile:
+                for row in csv.reader(csvfile):
+                    if row != []:
+                        self.heights.setdefault(row[0], []).append(float(row[1]))
+
+    def record(self, well, height): #add the height contact was made at in a well and save the height map
+        if height is None:
+            return
+        self.heights.setdefault(well, []).append(height)
+        with open(self.filename, 'a') as csvfile:
+            csvwriter = csv.writer(csvfile)
+            csvwriter.writerow([well, height])
+
+    def predict(self, well): #height contact is expected at in a well, or None if no wells have been tested yet
+        if well in self.heights: #a well that was already tested is expected where it was last time
+            return self.heights[well][-1]
+        if not self.heights:
+            return None
+        col, row = well_position(well)
+        distances = []
+        for tested in self.heights:
+            tested_col, tested_row = well_position(tested)
+            distances.append((math.hypot(tested_col - col, tested_row - row), tested))
+        distances.sort()
+        total = 0
+        weights = 0
+        for distance, tested in distances[0:NEIGHBOURS]: #closer wells count more
+            total = total + self.heights[tested][-1] / distance
+            weights = weights + 1 / distance
+        return round(total / weights, 2)
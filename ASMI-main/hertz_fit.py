@@ -0,0 +1,281 @@
+"""
+This is a module which fits the force and depth measurements of a well to Hertzian contact mechanics in a single solve,
+finding A of F = A * (depth - offset)^1.5 together with the offset of the depths, which is how far the contact the
+contact detector found is from the real start of contact.
+
+The measure programs used to fit A and an offset d0, shift the depths by d0, pick the measurements in the depth range
+again, work out the height of the sample and the correction of the forces again, and refit, up to 300 times, until d0
+was close to 0. Here the depth range and the correction are part of the model instead. For an offset, only the
+measurements between 0.24 and 0.5 mm deep after the shift are used, corrected the same way correct_force does, and A and
+the offset are found with a bounded least squares solve using the derivatives of the model, which are known exactly.
+The depth range and correction only change when the offset moves past a measurement, so the solve is only repeated when
+the solution moved the offset past one, which is usually once or not at all.
+
+The result is the fixed point the old loop was looking for, where fitting again would not move the depths, without the
+0.01 mm the old loop stopped short of it by. Sometimes there is no fixed point, and the offset goes back and forth
+between two depth ranges, each of which moves it into the other. The old loop stopped after its 300th fit then, here the
+solve that moved the offset the least is used instead.
+
+fit_plate fits every well of a plate at once. The measurements of the wells are padded to the same length, with the
+padding and the measurements outside of the depth range of each well masked out, and A and the offset of all the wells
+are solved together by a Levenberg-Marquardt written with NumPy over the whole plate, so there is no Python loop over
+the measurements or the solver steps of a well. It finds the same fit as fit_hertz to the tolerances of the solve.
+"""
+
+import numpy as np
+from scipy.optimize import least_squares
+
+VERSION = 1  # changed whenever the fit changes, so results worked out with an older fit can be told apart
+WINDOW = (0.24, 0.5)  # range of depths in mm the fit uses, the same as find_d_and_f_in_range
+MAX_STEP = 0.2  # furthest in mm the offset can move in a single solve, so no measurement used is shifted to a depth of 0
+MAX_SOLVES = 20  # solves before giving up on the depth range settling down
+MIN_POINTS = 3  # measurements needed in the depth range to fit two parameters
+MAX_ITERATIONS = 200  # Levenberg-Marquardt steps of fit_plate before a solve is stopped
+TOLERANCE = 1e-8  # relative change in the sum of squares or the parameters at which a solve of fit_plate is done
+
+
+class HertzFit: #A and the offset of the depths a well was fit with, and the measurements the fit used
+    def __init__(self, A, offset, covariance, depths, forces, noise, solves, evaluations):
+        self.A = A
+        self.offset = offset  # mm to take away from the depths so the fit starts at a depth of 0
+        self.covariance = covariance  # covariance of A and the offset
+        self.depths = depths  # depths in the depth range after the shift
+        self.forces = forces  # forces in the depth range with the correction applied
+        self.noise = noise
+        self.solves = solves  # least squares solves it took
+        self.evaluations = evaluations  # times the model was worked out over all solves
+
+    def parameters(self): #A and the offset, the same as the parameters curve_fit returns
+        return np.array([self.A, self.offset])
+
+
+class PlateFit: #A, offset, covariance and elastic modulus of every well of a plate, nan for wells that could not be fit
+    def __init__(self, fits, E):
+        self.fits = fits  # HertzFit of every well, None for the wells that could not be fit
+        self.A = np.array([np.nan if fit is None else fit.A for fit in fits])
+        self.offset = np.array([np.nan if fit is None else fit.offset for fit in fits])
+        self.covariance = np.array([np.full((2, 2), np.nan) if fit is None else fit.covariance for fit in fits])
+        self.E = E
+
+
+def model(params, depths, forces, noise, b, c): #residuals of the corrected forces from the Hertz curve, in noise
+    A, offset = params
+    shifted = depths - offset
+    return (forces / (c * shifted ** b) - A * shifted ** 1.5) / noise
+
+
+def jacobian(params, depths, forces, noise, b, c): #derivatives of the residuals with respect to A and the offset
+    A, offset = params
+    shifted = depths - offset
+    d_A = -shifted ** 1.5 / noise
+    d_offset = (b * forces / (c * shifted ** (b + 1)) + 1.5 * A * np.sqrt(shifted)) / noise
+    return np.column_stack((d_A, d_offset))
+
+
+def plate_model(A, offset, depths, forces, noise, used, b, c):
+    #residuals and shifted depths of every well, rows of padded measurements, 0 for the measurements not used
+    shifted = np.where(used, depths - offset[:, None], 1.0)
+    residuals = (forces / (c[:, None] * shifted ** b[:, None]) - A[:, None] * shifted ** 1.5) / noise
+    return np.where(used, residuals, 0.0), shifted
+
+
+def plate_normal(A, shifted, forces, noise, used, b, c):
+    #J^T J of every well, as the sums over the measurements of d_A^2, d_A * d_offset and d_offset^2, and the derivatives
+    d_A = np.where(used, -shifted ** 1.5 / noise, 0.0)
+    d_offset = np.where(used, (b[:, None] * forces / (c[:, None] * shifted ** (b[:, None] + 1)) +
+                               1.5 * A[:, None] * np.sqrt(shifted)) / noise, 0.0)
+    return (np.sum(d_A ** 2, axis=1), np.sum(d_A * d_offset, axis=1), np.sum(d_offset ** 2, axis=1)), d_A, d_offset
+
+
+def solve_plate(A, offset, depths, forces, noise, used, b, c):
+    #bounded Levenberg-Marquardt over every well at once, with A at least 0 and the offsets moving at most MAX_STEP.
+    #Returns A, the offsets and the number of times the model was worked out for every well
+    low = offset - MAX_STEP
+    high = offset + MAX_STEP
+    damping = np.full(len(A), 1e-3)
+    residuals, shifted = plate_model(A, offset, depths, forces, noise, used, b, c)
+    cost = np.sum(residuals ** 2, axis=1)
+    evaluations = np.ones(len(A), dtype=int)
+    solving = np.ones(len(A), dtype=bool)
+    for iteration in range(0, MAX_ITERATIONS):
+        if not solving.any():
+            break
+        (aa, ao, oo), d_A, d_offset = plate_normal(A, shifted, forces, noise, used, b, c)
+        g_A = np.sum(d_A * residuals, axis=1)
+        g_offset = np.sum(d_offset * residuals, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'): #solve (J^T J + damping * diag(J^T J)) step = -J^T r
+            damped_aa = aa * (1 + damping)
+            damped_oo = oo * (1 + damping)
+            det = damped_aa * damped_oo - ao ** 2
+            step_A = -(damped_oo * g_A - ao * g_offset) / det
+            step_offset = -(damped_aa * g_offset - ao * g_A) / det
+            pinned = ((offset <= low) & (step_offset < 0)) | ((offset >= high) & (step_offset > 0))
+            #an offset held at a bound only leaves A to solve for
+            new_A = np.clip(A + np.where(pinned, -g_A / damped_aa, step_A), 0, None)
+            new_offset = np.clip(offset + np.where(pinned, 0.0, step_offset), low, high)
+        new_A = np.where(np.isfinite(new_A), new_A, A)
+        new_offset = np.where(np.isfinite(new_offset), new_offset, offset)
+        new_residuals, new_shifted = plate_model(new_A, new_offset, depths, forces, noise, used, b, c)
+        new_cost = np.sum(new_residuals ** 2, axis=1)
+        evaluations = evaluations + solving
+        better = solving & (new_cost < cost)
+        settled = better & ((cost - new_cost <= TOLERANCE * cost) |
+                            ((np.abs(new_A - A) <= TOLERANCE * (np.abs(A) + TOLERANCE)) &
+                             (np.abs(new_offset - offset) <= TOLERANCE * (np.abs(offset) + TOLERANCE))))
+        A = np.where(better, new_A, A)
+        offset = np.where(better, new_offset, offset)
+        residuals = np.where(better[:, None], new_residuals, residuals)
+        shifted = np.where(better[:, None], new_shifted, shifted)
+        cost = np.where(better, new_cost, cost)
+        damping = np.where(better, damping / 10, damping * 10)
+        solving = solving & ~settled & (damping < 1e10) & (cost > 0)
+    return A, offset, evaluations
+
+
+def fit_hertz(run_array, p_ratio, correction, height, window=WINDOW):
+    #fit the depths, forces and noise in run_array from collect_run_data. correction(p_ratio, approx_height) gives the b
+    #and c correct_force uses and height(run_array) is approximate_height. Returns None if the fit could not be made
+    data = np.asarray(run_array, dtype=float)
+    depths = data[:, 0]
+    forces = data[:, 1]
+    noise = data[:, 2] if data.shape[1] > 2 else np.ones(len(data))
+    if np.min(noise) <= 0: #fit every measurement equally when the noise is not known
+        noise = np.ones(len(data))
+    offset = 0.0
+    A = None
+    evaluations = 0
+    solved = []  # (depth range and correction, arguments, offset at the start, result) of every solve
+    seen = {}  # solve every depth range and correction was first used for
+    for attempt in range(0, MAX_SOLVES):
+        shifted = depths - offset
+        in_range = (shifted >= window[0]) & (shifted <= window[1])
+        b, c = correction(p_ratio, height(shifted[:, None]))
+        key = (in_range.tobytes(), b, c)
+        if solved and key == solved[-1][0]:
+            break  # the depth range and correction did not change, so the last solve is the fit
+        if key in seen: #going around in a loop, use the solve that came closest to not moving the offset
+            solved.append(min(solved[seen[key]:], key=lambda solve: abs(solve[3].x[1] - solve[2])))
+            break
+        seen[key] = len(solved)
+        if np.count_nonzero(in_range) < MIN_POINTS:
+            return None
+        args = (depths[in_range], forces[in_range], noise[in_range], b, c)
+        if A is None: #start from the best A with no offset, which only needs a weighted average
+            x = depths[in_range] ** 1.5 / noise[in_range]
+            y = forces[in_range] / (c * depths[in_range] ** b) / noise[in_range]
+            A = max(float(np.dot(x, y) / np.dot(x, x)), 1e-9)
+        try:
+            result = least_squares(model, [A, offset], jac=jacobian, args=args, method='trf',
+                                   bounds=([0, offset - MAX_STEP], [np.inf, offset + MAX_STEP]))
+        except ValueError:
+            return None
+        evaluations = evaluations + result.nfev
+        solved.append((key, args, offset, result))
+        A, offset = float(result.x[0]), float(result.x[1])
+    else:
+        return None
+    key, args, start, result = solved[-1]
+    A, offset = float(result.x[0]), float(result.x[1])
+    b, c = args[3], args[4]
+    dof = max(len(args[0]) - 2, 1)
+    try: #scaled by how well the curve fits, the same as curve_fit does by default
+        covariance = np.linalg.inv(result.jac.T @ result.jac) * np.sum(result.fun ** 2) / dof
+    except np.linalg.LinAlgError:
+        covariance = np.full((2, 2), np.inf)
+    shifted = args[0] - offset
+    return HertzFit(A, offset, covariance, shifted, args[1] / (c * shifted ** b), args[2], len(seen), evaluations)
+
+
+def fit_plate(run_arrays, p_ratio, correction, height, modulus, window=WINDOW):
+    #fit every well of a plate at once, the same as fit_hertz does one at a time. run_arrays has the run_array of every
+    #well, p_ratio is the poisson's ratio of all of the wells or a list of the poisson's ratio of each, and
+    #modulus(A, p_ratio) is find_E. Returns a PlateFit with the wells in the same order as run_arrays
+    wells = len(run_arrays)
+    p_ratios = np.broadcast_to(np.asarray(p_ratio, dtype=float), (wells,))
+    size = max([len(run_array) for run_array in run_arrays] + [1])
+    depths = np.ones((wells, size))
+    forces = np.zeros((wells, size))
+    noise = np.ones((wells, size))
+    measured = np.zeros((wells, size), dtype=bool)
+    for w in range(0, wells): #pad every well to the length of the longest
+        data = np.asarray(run_arrays[w], dtype=float)
+        if len(data) == 0:
+            continue
+        n = len(data)
+        depths[w, :n] = data[:, 0]
+        forces[w, :n] = data[:, 1]
+        if data.shape[1] > 2 and np.min(data[:, 2]) > 0: #fit every measurement equally when the noise is not known
+            noise[w, :n] = data[:, 2]
+        measured[w, :n] = True
+    A = np.full(wells, np.nan)
+    offset = np.zeros(wells)
+    b = np.ones(wells)
+    c = np.ones(wells)
+    evaluations = np.zeros(wells, dtype=int)
+    finished = np.zeros(wells, dtype=bool)
+    failed = ~measured.any(axis=1)  # wells without measurements cannot be fit
+    solved = [[] for w in range(0, wells)]  # (depth range and correction, offset at the start, A, offset) of every solve
+    seen = [{} for w in range(0, wells)]
+    keys = [None] * wells
+    for attempt in range(0, MAX_SOLVES):
+        in_range = measured & (depths - offset[:, None] >= window[0]) & (depths - offset[:, None] <= window[1])
+        for w in np.flatnonzero(~finished & ~failed): #the same checks fit_hertz makes before every solve
+            b[w], c[w] = correction(p_ratios[w], height((depths[w, measured[w]] - offset[w])[:, None]))
+            keys[w] = (in_range[w].tobytes(), b[w], c[w])
+            if solved[w] and keys[w] == solved[w][-1][0]:
+                finished[w] = True
+            elif keys[w] in seen[w]:
+                solved[w].append(min(solved[w][seen[w][keys[w]]:], key=lambda solve: abs(solve[3] - solve[1])))
+                finished[w] = True
+            elif np.count_nonzero(in_range[w]) < MIN_POINTS:
+                failed[w] = True
+            else:
+                seen[w][keys[w]] = len(solved[w])
+        solving = ~finished & ~failed
+        if not solving.any():
+            break
+        first = solving & np.isnan(A)
+        if first.any(): #start from the best A with no offset, which only needs a weighted average
+            start = np.where(in_range[first], depths[first], 1.0)
+            x = np.where(in_range[first], start ** 1.5 / noise[first], 0.0)
+            y = forces[first] / (c[first, None] * start ** b[first, None]) / noise[first]
+            A[first] = np.maximum(np.sum(x * y, axis=1) / np.sum(x * x, axis=1), 1e-9)
+        columns = np.argsort(~in_range[solving], axis=1, kind='stable')[:, :np.max(np.sum(in_range[solving], axis=1))]
+        #only the measurements in the depth range, moved to the start of every row, are padded and solved
+        new_A, new_offset, count = solve_plate(A[solving], offset[solving],
+                                               np.take_along_axis(depths[solving], columns, axis=1),
+                                               np.take_along_axis(forces[solving], columns, axis=1),
+                                               np.take_along_axis(noise[solving], columns, axis=1),
+                                               np.take_along_axis(in_range[solving], columns, axis=1),
+                                               b[solving], c[solving])
+        evaluations[solving] += count
+        for i, w in enumerate(np.flatnonzero(solving)):
+            solved[w].append((keys[w], offset[w], float(new_A[i]), float(new_offset[i])))
+        A[solving] = new_A
+        offset[solving] = new_offset
+    fitted = np.flatnonzero(finished)
+    fits = [None] * wells
+    if len(fitted) > 0: #covariances of the solves used, scaled the same way fit_hertz does
+        used = np.zeros((len(fitted), size), dtype=bool)
+        for i, w in enumerate(fitted):
+            key, start, A[w], offset[w] = solved[w][-1]
+            used[i] = np.frombuffer(key[0], dtype=bool)
+            b[w], c[w] = key[1], key[2]
+        residuals, shifted = plate_model(A[fitted], offset[fitted], depths[fitted], forces[fitted], noise[fitted],
+                                         used, b[fitted], c[fitted])
+        (aa, ao, oo), d_A, d_offset = plate_normal(A[fitted], shifted, forces[fitted], noise[fitted], used, b[fitted],
+                                                   c[fitted])
+        scale = np.sum(residuals ** 2, axis=1) / np.maximum(np.sum(used, axis=1) - 2, 1)
+        det = aa * oo - ao ** 2
+        for i, w in enumerate(fitted):
+            if det[i] > 0:
+                covariance = np.array([[oo[i], -ao[i]], [-ao[i], aa[i]]]) / det[i] * scale[i]
+            else:
+                covariance = np.full((2, 2), np.inf)
+            fits[w] = HertzFit(float(A[w]), float(offset[w]), covariance, shifted[i, used[i]],
+                               forces[w, used[i]] / (c[w] * shifted[i, used[i]] ** b[w]), noise[w, used[i]],
+                               len(seen[w]), int(evaluations[w]))
+    E = np.full(wells, np.nan)
+    if len(fitted) > 0:
+        E[fitted] = modulus(A[fitted], p_ratios[fitted])
+    return PlateFit(fits, E)
@@ -30,13 +30,13 @@ THE SOFTWARE.
 """
 
 
-import serial
+import grbl
+import cnc_position
 import time
-from threading import Event
-import csv
+import os
 
 BAUD_RATE = 115200
-GRBL_port_path = "COM3" #Change this to the desired serial port!
+GRBL_port_path = os.environ.get("ASMI_GRBL_PORT", "COM3") #Change this to the desired serial port!
 
 
 def remove_comment(string):
@@ -51,53 +51,19 @@ def remove_eol_chars(string):
     return string.strip()
 
 
-def send_wake_up(ser):
-    # Wake up
-    # Hit enter a few times to wake the cnc
-    ser.write(str.encode("\r\n\r\n"))
-    time.sleep(2)  # Wait for cnc to initialize
-    ser.flushInput()  # Flush startup text in serial input
-
-
 def wait_for_movement_completion(ser, cleaned_line): #wait for cnc to reach destination before sending new movement
-    Event().wait(1)
-
-    if cleaned_line != '$X' or '$$':
-
-        idle_counter = 0
-
-        while True:
-
-            # Event().wait(0.01)
-            ser.reset_input_buffer()
-            command = str.encode('?' + '\n')
-            ser.write(command)
-            grbl_out = ser.readline()
-            grbl_response = grbl_out.strip().decode('utf-8')
-
-            if grbl_response != 'ok':
-
-                if grbl_response.find('Idle') > 0:
-                    idle_counter += 1
-
-            if idle_counter > 10:
-                break
-    return
+    return grbl.wait_for_idle(ser, grbl.parse_target(cleaned_line)) #returns as soon as the cnc is idle at its target
 
 
 def home_z(GRBL_port_path, gcode, home, x, y, z):
-    with serial.Serial(GRBL_port_path, BAUD_RATE) as ser:
-        send_wake_up(ser)
+    with grbl.connection(GRBL_port_path, BAUD_RATE) as ser:
         cleaned_line = remove_eol_chars(remove_comment(gcode))
         if home: #reset z coordinate system of device
             ##print(f'G92 Z{z}\n')
             command = str.encode(f'G92 Z{z}\n')
             ser.write(command)  # Send g-code
 
-            wait_for_movement_completion(ser, cleaned_line)
-
-            grbl_out = ser.readline()  # Wait for response with carriage return
-            ##print(" : ", grbl_out.strip().decode('utf-8'))
+            wait_for_movement_completion(ser, command.decode())
             z = 0
         if cleaned_line:  # checks if string is empty, moves cnc to home z height
             ##print("Sending gcode:" + str(cleaned_line))
@@ -106,29 +72,21 @@ def home_z(GRBL_port_path, gcode, home, x, y, z):
             ser.write(command)  # Send g-code
 
             wait_for_movement_completion(ser, cleaned_line)
-
-            grbl_out = ser.readline()  # Wait for response with carriage return
-            ##print(" : ", grbl_out.strip().decode('utf-8'))
             position = [x, y, z]
 
         ##print('End of gcode')
-        with open("position.csv", 'w') as csvfile: #update postion of cnc
-            csvwriter = csv.writer(csvfile)
-            csvwriter.writerow(position)
+        cnc_position.tracker.set(*position) #update postion of cnc
+        cnc_position.tracker.save()
 
 def home_xy(GRBL_port_path, gcode, home, x, y, z):
-    with serial.Serial(GRBL_port_path, BAUD_RATE) as ser:
-        send_wake_up(ser)
+    with grbl.connection(GRBL_port_path, BAUD_RATE) as ser:
         cleaned_line = remove_eol_chars(remove_comment(gcode))
         if home: #reset x and y coordinate system of device
             ##print(f'G92 X{x} Y{y}\n')
             command = str.encode(f'G92 X{x} Y{y}\n')
             ser.write(command)  # Send g-code
 
-            wait_for_movement_completion(ser, cleaned_line)
-
-            grbl_out = ser.readline()  # Wait for response with carriage return
-            ##print(" : ", grbl_out.strip().decode('utf-8'))
+            wait_for_movement_completion(ser, command.decode())
             x = 0
             y = 0
             z = 0
@@ -139,30 +97,15 @@ def home_xy(GRBL_port_path, gcode, home, x, y, z):
             ser.write(command)  # Send g-code
 
             wait_for_movement_completion(ser, cleaned_line)
-
-            grbl_out = ser.readline()  # Wait for response with carriage return
-            ##print(" : ", grbl_out.strip().decode('utf-8'))
             position = [x, y, z]
 
         ##print('End of gcode')
-        with open("position.csv", 'w') as csvfile: #updates position of cnc
-            csvwriter = csv.writer(csvfile)
-            csvwriter.writerow(position)
+        cnc_position.tracker.set(*position) #updates position of cnc
+        cnc_position.tracker.save()
 
 
 if __name__ == "__main__":
-    n = 1
-    with open('position.csv', mode='r') as file: #finds position of cnc
-        csvFile = csv.reader(file)
-        for lines in csvFile:
-            if n == 1:
-                position = lines
-                #print(position)
-            n = n + 1
-    ##print(position)
-    x = position[0]
-    y = position[1]
-    z = position[2]
+    x, y, z = cnc_position.tracker.sync(GRBL_port_path, BAUD_RATE) #finds position of cnc, checked against grbl's own
     ##print(x)
     ##print(y)
     ##print(z)
@@ -182,4 +125,5 @@ if __name__ == "__main__":
 
 
     ##print('EOF')
+    grbl.close_sessions()
     print("Successfully moved home")
@@ -0,0 +1,270 @@
+"""
+This is a module with the different ways a well can be indented. It is shared by the measure, custom_measure and
+measure_over_time programs, which pass in their own force sensor, force measurement function and file names.
+
+Every mode saves rows of [well, z, force, median, spread, count] to the data file in the same format, one for every
+0.02 mm step, so collect_run_data works the same no matter which mode was used to test a well. The modes that measure
+force while the cnc moves put every measurement in the step it was made closest to, and save the mean, median, spread
+and number of the measurements of each step, like the step mode does with the measurements it makes at a step.
+"""
+
+import math
+import time
+from threading import Event, Thread
+
+import numpy as np
+
+import cnc_position
+import contact_detector
+import force_sensor
+import grbl
+from safety import ForceWatchdog, SAMPLE_PERIOD
+
+RETRACT = 0.2  # distance in mm to move back up after the fast approach touches the sample
+APPROACH_SIGMA = 4  # standard deviations from the no contact force that count as touching during the fast approach
+STEP = 0.02  # distance in mm between lines of the indentation gcode
+SURFACE_MARGIN = 0.5  # distance in mm above the expected sample surface the fast approach skips to
+
+phase_times = {}  # time in seconds spent on each phase of the last well
+
+
+def write_position(x, y, z): #update position of cnc, which is saved once the cnc has moved back up
+    cnc_position.tracker.set(x, y, z)
+
+
+class ContactState: #the contact and exit rules stream_gcode uses, applied one force measurement at a time
+    def __init__(self, avg, stdev, lowest, max_force=45, stiff_force=45, detector=contact_detector.DETECTOR):
+        self.detector = contact_detector.make_detector(detector, avg, stdev)
+        self.lowest = lowest
+        self.max_force = max_force
+        self.stiff_force = stiff_force
+        self.z_max = lowest - 2  # maximum depth indenter will indent to before automatically moving up
+        self.contact = False
+        self.measurements = []
+        self.stiff = False
+        self.done = False
+
+    def update(self, value, z): #returns False once an exit condition is reached and the measurement should not be saved
+        if self.detector.update(value): #force sensor indicates contact
+            self.measurements.append(value * -1)
+            if z <= self.z_max or value <= -self.max_force: #exit conditions for testing well
+                if value <= -self.stiff_force and len(self.measurements) <= 30:
+                    print("Sample too stiff to analyze")
+                    self.stiff = True
+                self.done = True
+                return False
+            if len(self.measurements) == 1: #set maximum indentation depth if contact detected for first time
+                self.z_max = round(z - 1, 2)
+            self.contact = True
+        elif self.contact: #reset if contact is no longer detected
+            self.z_max = self.lowest - 2
+            self.contact = False
+            self.measurements = []
+        return True
+
+
+def write_rows(raw, well, watchdog, position_times, positions, z0, z_start, extra=()):
+    #save the force measurements made before the cnc was stopped, one row for every step of STEP mm, from the
+    #measurements made closest to the depth of the step
+    if not watchdog.times or not position_times:
+        return
+    depths = np.interp(watchdog.times, position_times, positions) - z0 + z_start
+    steps = {}  # {z of the step: measurements}, in the order the steps were reached
+    for i in range(0, len(watchdog.times)):
+        if watchdog.saved[i]:
+            z = round(z_start + round((depths[i] - z_start) / STEP) * STEP, 2)
+            steps.setdefault(z, []).append(watchdog.values[i])
+    rows = []
+    for z, values in steps.items():
+        value, median, spread, count = force_sensor.step_statistics(values)
+        rows.append([str(well), str(z), str(value * -1)] + list(extra) + [str(median * -1), str(spread), str(count)])
+    raw.write_rows(rows)
+
+
+def stream_indentation(ser, device, gcode, x, y, well, raw, avg, stdev, z_start, lowest,
+                       max_force=45, stiff_force=45, extra=(), detector=contact_detector.DETECTOR):
+    #indent a well by streaming every line of gcode to grbl at once, measuring force against the position grbl reports
+    #while the cnc moves. The force sensor is watched in the background, so the cnc is stopped with a feed hold as soon
+    #as an exit condition is reached
+    status = grbl.query_status(ser)
+    z0 = grbl.report_position(status)[2]
+    contact = ContactState(avg, stdev, lowest, max_force, stiff_force, detector)
+    position_times = [time.monotonic()]
+    positions = [z0]
+
+    def on_status(status):
+        position_times.append(time.monotonic())
+        positions.append(grbl.report_position(status)[2])
+
+    watchdog = ForceWatchdog(ser, device, max_force, check=lambda value: contact.update(value, z_start + positions[-1] - z0))
+    watchdog.start()
+    watchdog.started.wait()
+    try:
+        grbl.stream_program(ser, gcode, on_status=on_status, should_stop=watchdog.tripped.is_set)
+    finally:
+        watchdog.stop()
+    if watchdog.tripped.is_set(): #throw away the rest of the gcode, which is still in grbl's buffer. This resets grbl,
+        # cancel_motion puts the work position back afterwards so ser can keep being used in the same coordinates
+        grbl.cancel_motion(ser)
+        print(f"Stopped the cnc {round(watchdog.reaction_time() * 1000)} ms after the {watchdog.reason}")
+    if watchdog.error is not None:
+        raise watchdog.error
+    status = grbl.query_status(ser)
+    z = round(z_start + grbl.report_position(status)[2] - z0, 3)
+    write_rows(raw, well, watchdog, position_times, positions, z0, z_start, extra)
+    write_position(x, y, z)
+    return contact.measurements, z, contact.stiff
+
+
+class PositionPoller(Thread): #asks grbl for its position in the background so the force sensor can be read meanwhile
+    def __init__(self, ser, poll_interval=grbl.POLL_INTERVAL):
+        super().__init__(daemon=True)
+        self.ser = ser
+        self.poll_interval = poll_interval
+        self.times = []  # time each position was reported at
+        self.z = []
+        self.state = None
+        self.error = None
+        self.stopped = Event()
+
+    def run(self):
+        received = b''
+        try:
+            with grbl.read_timeout(self.ser, self.poll_interval):
+                while not self.stopped.is_set():
+                    sent = time.monotonic()
+                    self.ser.write(b'?')
+                    status = None
+                    while status is None and time.monotonic() - sent < grbl.RESPONSE_TIMEOUT:
+                        responses, received = grbl.read_responses(self.ser, received)
+                        for response in responses:
+                            if response.startswith('ALARM'):
+                                raise grbl.GRBLAlarmError(f"grbl reported {response} while indenting")
+                            if response.startswith('<'):
+                                status = grbl.parse_status(response)
+                    if status is None:
+                        raise grbl.GRBLConnectionError("grbl stopped answering status requests while indenting")
+                    self.times.append((sent + time.monotonic()) / 2)  # report was made between asking and receiving
+                    self.z.append(grbl.report_position(status)[2])
+                    self.state = status['state']
+                    self.stopped.wait(max(0, self.poll_interval - (time.monotonic() - sent)))
+        except grbl.GRBLError as e:
+            self.error = e
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def continuous_indentation(ser, device, gcode, x, y, well, raw, avg, stdev, z_start, lowest,
+                           max_force=45, stiff_force=45, extra=(), sample_period=SAMPLE_PERIOD,
+                           detector=contact_detector.DETECTOR):
+    #indent a well with a single slow jog to the bottom of the gcode program, reading the force sensor as fast as it can
+    #go and matching the time of every measurement to the positions grbl reports to build the force curve. The jog is
+    #stopped from the sensor thread as soon as an exit condition is reached
+    status = grbl.query_status(ser)
+    z0 = grbl.report_position(status)[2]
+    contact = ContactState(avg, stdev, lowest, max_force, stiff_force, detector)
+    line = grbl.jog_line(gcode[-1])  # last line of the program is the deepest point
+    z_target = z0 + grbl.parse_target(gcode[-1])[2]  # the connection starts every well at z = 0
+    poller = PositionPoller(ser)
+    watchdog = ForceWatchdog(ser, device, max_force, sample_period,
+                             check=lambda value: contact.update(value, z_start + (poller.z[-1] if poller.z else z0) - z0))
+    watchdog.start()
+    watchdog.started.wait()
+    ser.write(str.encode(line + '\n'))
+    poller.start()
+    try:
+        while not watchdog.tripped.wait(poller.poll_interval):
+            if poller.error is not None:
+                break
+            if poller.state == 'Idle' and abs(poller.z[-1] - z_target) <= grbl.POSITION_TOLERANCE: #reached the bottom
+                break
+    finally:
+        watchdog.stop()
+        poller.stop()
+    if watchdog.tripped.is_set(): #make sure the cnc has come to a stop before going on
+        grbl.cancel_jog(ser)
+        print(f"Stopped the cnc {round(watchdog.reaction_time() * 1000)} ms after the {watchdog.reason}")
+    for error in (poller.error, watchdog.error):
+        if error is not None:
+            raise error
+    status = grbl.query_status(ser)
+    z = round(z_start + grbl.report_position(status)[2] - z0, 3)
+    write_rows(raw, well, watchdog, poller.times, poller.z, z0, z_start, extra)
+    write_position(x, y, z)
+    return contact.measurements, z, contact.stiff
+
+
+def jog_until_contact(ser, device, z0, target, speed, threshold):
+    #jog to target while watching the force sensor. Returns how far below the start of the well the sensor touched the
+    #sample, or None if the jog reached target without touching anything
+    watchdog = ForceWatchdog(ser, device, check=lambda value: value >= threshold)
+    watchdog.start()
+    watchdog.started.wait()
+    ser.write(str.encode(f"$J=G90 Z{target} F{speed}\n"))
+    try:
+        while not watchdog.tripped.wait(grbl.POLL_INTERVAL):
+            status = grbl.query_status(ser)
+            if status['state'] == 'Idle' and abs(grbl.report_position(status)[2] - z0 - target) <= grbl.POSITION_TOLERANCE:
+                break
+    finally:
+        watchdog.stop()
+    if watchdog.error is not None:
+        grbl.cancel_jog(ser)
+        raise watchdog.error
+    if not watchdog.tripped.is_set():
+        return None
+    status = grbl.cancel_jog(ser)
+    return grbl.report_position(status)[2] - z0
+
+
+def two_phase_approach(ser, device, gcode, avg, stdev, z_start, approach_speed, retract=RETRACT,
+                       contact_sigma=APPROACH_SIGMA, expected=None, skip_speed=None, margin=SURFACE_MARGIN):
+    #move down quickly until the sensor first touches the sample, then back up by retract so the slow indentation only
+    #has to cover the last bit of the way. If the surface of the sample is expected to be a certain distance below the
+    #starting height, skip straight to margin above it first. Returns the lines of gcode that are left and the height
+    #they start from
+    start = time.monotonic()
+    status = grbl.query_status(ser)
+    z0 = grbl.report_position(status)[2]  # the connection starts every well at z = 0
+    bottom = grbl.parse_target(gcode[-1])[2]
+    threshold = avg - contact_sigma * stdev
+    moves = []
+    if expected is not None:
+        above = round(min(0, math.ceil((expected + margin) / STEP) * STEP), 2)  # skip to a line of the gcode program
+        if bottom < above < 0:
+            moves.append((above, skip_speed or approach_speed))
+    if approach_speed is not None:
+        moves.append((bottom, approach_speed))
+    if not moves:
+        return gcode, z_start
+    touched = None
+    for target, speed in moves:
+        touched = jog_until_contact(ser, device, z0, target, speed, threshold)
+        if touched is not None:
+            break
+    if touched is None and target == bottom: #reached the bottom without touching anything, so there is nothing left to indent
+        phase_times['approach'] = time.monotonic() - start
+        print(f"Fast approach took {round(phase_times['approach'], 1)} s and did not find the sample")
+        return [], round(z_start + bottom, 2)
+    if touched is None: #stopped above where the sample is expected
+        resume = target
+    else:
+        resume = round(min(0, math.ceil((touched + retract) / STEP) * STEP), 2)  # back up to a line of the gcode program
+        ser.write(str.encode(f"G01 Z{resume} F{speed}\n"))
+        grbl.wait_for_idle(ser, {2: resume})
+    remaining = [line for line in gcode if grbl.parse_target(line)[2] < resume - STEP / 2]
+    phase_times['approach'] = time.monotonic() - start
+    if touched is None:
+        print(f"Fast approach took {round(phase_times['approach'], 1)} s and stopped {round(-resume, 2)} mm below the "
+              f"starting height, {margin} mm above where the sample is expected")
+    else:
+        print(f"Fast approach took {round(phase_times['approach'], 1)} s and touched the sample {round(-touched, 2)} mm "
+              f"below the starting height")
+    return remaining, round(z_start + resume, 2)
+
+
+def report_phases(total): #print how long the fast approach and the slow indentation of the last well took
+    approach = phase_times.pop('approach', 0)
+    print(f"Well took {round(total, 1)} s: {round(approach, 1)} s fast approach, {round(total - approach, 1)} s indenting")
@@ -61,10 +61,20 @@ THE SOFTWARE.
 
 """
 
-import serial
+import grbl
+import cnc_position
+import indentation
+import height_map
+import raw_data
+import force_sensor
+import simulated_sensor
+import contact_detector
+import survey
+import well_order
+import timing
+import hertz_fit
+import force_correction
 import time
-from threading import Event
-from godirect import GoDirect
 import statistics
 import csv
 import logging
@@ -77,21 +87,42 @@ from datetime import datetime
 import matplotlib.pyplot as pyplot
 
 warnings.filterwarnings("ignore", category=RuntimeWarning)
-from scipy.optimize import curve_fit
 logging.basicConfig()
 
 BAUD_RATE = 115200
-GRBL_port_path = "COM3" #"/dev/ttyUSB0"
+GRBL_port_path = os.environ.get("ASMI_GRBL_PORT", "COM3") #"/dev/ttyUSB0"
 x_init = 0  # set position of well A1
 y_init = 0  # set position of well A1
 offset = 0  # set distance between wells
-files = os.listdir(r"C:\Users\jjtsu\OneDrive\Desktop\Indenter\ASMI-main") #change to correct directory for your device!!!
-
-
-godirect = GoDirect(use_ble=True, use_usb=True)
-device = godirect.get_device(threshold=-100)
+files = os.listdir(os.environ.get("ASMI_DIR", r"C:\Users\jjtsu\OneDrive\Desktop\Indenter\ASMI-main")) #change to correct directory for your device!!!
+well_plate = "standard"  # table of correction factors for the well plate, see force_correction
+interpolate_correction = False  # interpolate the correction factors between heights and poisson's ratios
+use_every_sample = True  # average every measurement made since the last step instead of using only one
+contact_method = "cusum"  # "cusum" waits until enough force adds up to count as contact so noise does not set it
+# off, "slope" waits until the force is falling faster than noise explains and "threshold" counts any measurement
+# more than 2 standard deviations below the baseline as contact
+online_baseline = True  # estimate the force with no contact while indenting instead of pausing above every well
+baseline_window = None  # measurements after which older ones count less, so the baseline follows slow drift of the
+# sensor, None to count all of them equally
+
+
+if os.environ.get("ASMI_SIMULATE"): #run without the force sensor, see simulated_sensor
+    if "ASMI_GRBL_PORT" in os.environ:
+        device = simulated_sensor.from_environment()
+    else: #run without the cnc as well, see grbl_simulator
+        import grbl_simulator
+        cnc = grbl_simulator.start_from_environment(cnc_position.tracker.get())
+        GRBL_port_path = cnc.port
+        device = simulated_sensor.from_environment(cnc.position)
+else:
+    from godirect import GoDirect
+    godirect = GoDirect(use_ble=True, use_usb=True)
+    device = godirect.get_device(threshold=-100)
 lowest = -11
 height_offset = 17.7
+h_speed = "500"  # speed sensor moves between wells
+stopped_time = None  # time.monotonic() the cnc last stopped at its target, force measured before it was measured moving
+sensor = None  # streams the force sensor for the whole run, see force_sensor, started once the wells to test are known
 
 def remove_comment(string):
     if (string.find(';') == -1):
@@ -105,55 +136,23 @@ def remove_eol_chars(string):
     return string.strip()
 
 
-def send_wake_up(ser):
-    # Wake up
-    # Hit enter a few times to wake the Printrbot
-    ser.write(str.encode("\r\n\r\n"))
-    time.sleep(2)  # Wait for Printrbot to initialize
-    ser.flushInput()  # Flush startup text in serial input
-
-
-def wait_for_movement_completion(ser, cleaned_line):
-    Event().wait(1)
-
-    if cleaned_line != '$X' or '$$':
-
-        idle_counter = 0
-
-        while True:
-
-            # Event().wait(0.01)
-            ser.reset_input_buffer()
-            command = str.encode('?' + '\n')
-            ser.write(command)
-            grbl_out = ser.readline()
-            grbl_response = grbl_out.strip().decode('utf-8')
-            #print(grbl_response)
-
-            if grbl_response != 'ok':
-
-                if grbl_response.find('Idle') > 0:
-                    idle_counter += 1
-
-            if idle_counter > 0:
-                break
-    return
+def wait_for_movement_completion(ser, cleaned_line): #wait for cnc to reach destination before sending new movement
+    global stopped_time
+    status = grbl.wait_for_idle(ser, grbl.parse_target(cleaned_line)) #returns as soon as the cnc is idle at its target
+    stopped_time = time.monotonic()
+    return status
 
 
 def move_gcode(GRBL_port_path, gcode, home, x, y, z): #used to move CNC to one particular (x, y, z) location
-    # with contect opens file/connection and closes it if function(with) scope is left
-    with serial.Serial(GRBL_port_path, BAUD_RATE) as ser:
-        send_wake_up(ser)
+    # with connection reuses the open port to the cnc, which stays open after function(with) scope is left
+    with grbl.connection(GRBL_port_path, BAUD_RATE) as ser:
         cleaned_line = remove_eol_chars(remove_comment(gcode))
         if home:
             ##print(f'G92 X{x} Y{y} Z{z}\n')
             command = str.encode(f'G92 X{x} Y{y} Z{z}\n')
             ser.write(command)  # Send g-code
 
-            wait_for_movement_completion(ser, cleaned_line)
-
-            grbl_out = ser.readline()  # Wait for response with carriage return
-            ##print(" : ", grbl_out.strip().decode('utf-8'))
+            wait_for_movement_completion(ser, command.decode())
             x = 0
             y = 0
             z = 0
@@ -164,72 +163,97 @@ def move_gcode(GRBL_port_path, gcode, home, x, y, z): #used to move CNC to one p
             ser.write(command)  # Send g-code
 
             wait_for_movement_completion(ser, cleaned_line)
-
-            grbl_out = ser.readline()  # Wait for response with carriage return
-            ##print(" : ", grbl_out.strip().decode('utf-8'))
             position = [x, y, z]
 
         ##print('End of gcode')
-        with open("position.csv", 'w') as csvfile: #update position of CNC
-            csvwriter = csv.writer(csvfile)
-            csvwriter.writerow(position)
-
-def get_start_stats(well, filename, trial): #used to take baseline force measurements before testing each well
-    measurements = []
-    device.start()
-    sensors = device.get_enabled_sensors()
-    ##print("reading force")
-    for i in range(0, 10):
-        if device.read():
-            for sensor in sensors:
-                measurements.append(sensor.values[0])
-                #print(measurements)
-                ##print(sensor.values)
-                sensor.clear()
-        time.sleep(0.05)
-    device.stop()
+        cnc_position.tracker.set(*position) #update position of CNC
+        cnc_position.tracker.save()
+
+def get_start_stats(well, raw, trial): #used to take baseline force measurements before testing each well
+    measurements = sensor.next_values(10).tolist() #measurements made after the cnc stopped moving
     average = statistics.mean(measurements)
     standard_dev = statistics.stdev(measurements)
     ##print(f"avg = {average}")
     ##print(f"stdev = {standard_dev}")
-    with open(filename, 'a') as csvfile:
-        csvwriter = csv.writer(csvfile)
-        row = [well, str(average), str(standard_dev), trial]
-        csvwriter.writerow(row)
+    write_start_stats(well, raw, average, standard_dev, trial)
     return average, standard_dev
 
-def get_measurement(): #takes a singular measurement with force sensor
-    device.start()
-    val = 0
-    sensors = device.get_enabled_sensors()
-    if device.read():
-        for sensor in sensors:
-            val = sensor.values
-            val = val[0]
-            ##print(val)
-            sensor.clear()
-    device.stop()
-    #val = val[0]
-    val = val
-    return val
-
-
-def stream_gcode(GRBL_port_path, gcode, x, y, well, filename, trial): #used to indent a well with multiple lines of gcode
-    # with contect opens file/connection and closes it if function(with) scope is left
+def write_start_stats(well, raw, average, standard_dev, trial): #first row of each well is the baseline, the average non-contact force
+    row = [well, str(average), str(standard_dev), trial, contact_method] #saved so analysis.py finds contact the same way
+    raw.write(row)
+
+def get_measurement(index): #takes force measurements with force sensor, returns their mean, median, spread and count
+    # and the index the measurements of the next step start at
+    if use_every_sample: #use every measurement made since the last step instead of throwing all but one away
+        values, index = sensor.wait(index)[1:3]
+        if len(values) == 0: #nothing was measured in READ_TIMEOUT seconds, try the step once more before giving up
+            values, index = sensor.wait(index)[1:3]
+    else: #the sensor is already streaming, so only wait for its next measurement
+        values = sensor.next_values(1)
+        index = sensor.count
+    return force_sensor.step_statistics(values), index  # raises ForceSensorError if there are still none
+
+
+def stream_gcode(GRBL_port_path, gcode, x, y, well, raw, trial, mode="step", approach_speed=None, expected=None): #used to indent a well with multiple lines of gcode
+    # with connection reuses the open port to the cnc, which stays open after function(with) scope is left
     stiff = False
-    with serial.Serial(GRBL_port_path, BAUD_RATE) as ser:
-        send_wake_up(ser)
-        avg, stdev = get_start_stats(well, filename, trial)
+    with grbl.connection(GRBL_port_path, BAUD_RATE) as ser:
+        if online_baseline: #estimate the baseline from the measurements made since the cnc stopped above the well
+            # instead of pausing to measure it, then refine it with the free air measurements made while indenting
+            refine = mode == "step" and approach_speed is None and expected is None #only the steps refine it
+            baseline = force_sensor.Baseline(baseline_window)
+            since = stopped_time if stopped_time is not None else time.monotonic()
+            baseline.add(sensor.settled(since, force_sensor.SETTLED_SAMPLES if refine else force_sensor.BASELINE_SAMPLES))
+            avg, stdev = baseline.mean, baseline.stdev()
+            if not refine:
+                write_start_stats(well, raw, avg, stdev, trial)
+                baseline = None
+        else:
+            baseline = None
+            avg, stdev = get_start_stats(well, raw, trial)
+        z_start = -1*height_offset+1 #sets starting height
+        if approach_speed is not None or expected is not None: #move down quickly until contact first or until just
+            # above where the sample is expected, then only indent slowly from there
+            if expected is not None:
+                expected = expected - z_start
+            gcode, z_start = indentation.two_phase_approach(ser, sensor, gcode, avg, stdev, z_start, approach_speed,
+                                                            expected=expected, skip_speed=h_speed)
+            if not gcode: #no sample was found before reaching the bottom
+                return [], z_start, stiff
+        if mode == "stream": #send all of the gcode at once so the cnc moves smoothly, measuring force as it moves
+            return indentation.stream_indentation(ser, sensor, gcode, x, y, well, raw, avg, stdev, z_start,
+                                                  lowest, max_force=45, stiff_force=45, extra=[trial],
+                                                  detector=contact_method)
+        if mode == "continuous": #move to the bottom in one slow movement, matching force measurements to position
+            return indentation.continuous_indentation(ser, sensor, gcode, x, y, well, raw, avg, stdev,
+                                                      z_start, lowest, max_force=45, stiff_force=45, extra=[trial],
+                                                      detector=contact_method)
         down = True
         up = False
-        z = -1*height_offset+1 #sets starting height
+        z = z_start
         z_max = lowest - 2 #sets maximum depth indenter will indent to before automatically moving up
         contact = False
         measurements = []
+        index = sensor.count #measurements made before the first step are not used
+        held = [] if baseline is not None else None  # rows kept back until the baseline is final, it goes first
+        detector = contact_detector.make_detector(contact_method, avg, stdev) if held is None else None
         for line in gcode:
             ##print(z)
-            value = get_measurement() #take force measurement
-            if value < avg - 2 * stdev: #force sensor indicates contact
+            (value, median, spread, count), index = get_measurement(index) #take force measurement
+            if held is not None:
+                threshold = avg - 2 * stdev / math.sqrt(count) #the mean of count measurements is sqrt(count) times less noisy
+                if value >= threshold: #still in free air, so the measurements refine the baseline
+                    baseline.add_statistics(count, value, spread)
+                    avg, stdev = baseline.mean, baseline.stdev()
+                    threshold = avg - 2 * stdev / math.sqrt(count)
+                if value < threshold: #the baseline is final once contact might have been made
+                    write_start_stats(well, raw, avg, stdev, trial)
+                    raw.write_rows(held)
+                    detector = contact_detector.make_detector(contact_method, avg, stdev)
+                    for row in held: #go through the held rows the way collect_run_data will
+                        detector.update(-1 * float(row[2]), float(row[-1]))
+                    held = None
+            if held is None and detector.update(value, count): #force sensor indicates contact
                 ##print("contact")
                 ##print(z_max)
                 measurements.append(value * -1)
@@ -243,7 +267,7 @@ def stream_gcode(GRBL_port_path, gcode, x, y, well, filename, trial): #used to i
                     z_max = round(z - 1, 2)
                 contact = True
                 z = round(z-0.02, 2)
-            elif contact == True and value >= avg - 2 * stdev: #reset if contact is no longer detected
+            elif contact == True: #reset if contact is no longer detected
                 ##print("False alarm")
                 z_max = lowest - 2 #reset maximum indentation depth
                 contact = False
@@ -252,10 +276,11 @@ def stream_gcode(GRBL_port_path, gcode, x, y, well, filename, trial): #used to i
                 #Start here!
             else:
                 z = round(z-0.02, 2)
-            with open(filename, 'a') as csvfile: #save measurement to file
-                csvwriter = csv.writer(csvfile)
-                row = [str(well), str(z), str(value * -1), trial]
-                csvwriter.writerow(row)
+            row = [str(well), str(z), str(value * -1), trial, str(median * -1), str(spread), str(count)]
+            if held is None:
+                raw.write(row) #save measurement to file
+            else:
+                held.append(row)
             cleaned_line = remove_eol_chars(remove_comment(line))
             if cleaned_line:  # checks if string is empty
                 ##print("Sending gcode:" + str(cleaned_line))
@@ -264,16 +289,15 @@ def stream_gcode(GRBL_port_path, gcode, x, y, well, filename, trial): #used to i
                 ser.write(command)  # Send g-code
 
                 wait_for_movement_completion(ser, cleaned_line)
-
-                grbl_out = ser.readline()  # Wait for response with carriage return
-                ##print(" : ", grbl_out.strip().decode('utf-8'))
             position = [x, y, z]
-            with open("position.csv", 'w') as csvfile: #update position of CNC
-                csvwriter = csv.writer(csvfile)
-                csvwriter.writerow(position)
+            cnc_position.tracker.set(*position) #update position of CNC
+        if held is not None: #contact was never made
+            write_start_stats(well, raw, avg, stdev, trial)
+            raw.write_rows(held)
 
         return measurements, z, stiff
 
+@timing.timer.timed("load_csv")
 def load_csv(filename): #collect data for specific run from csv file
    with open(filename, 'r') as file:
        reader = csv.reader(file)
@@ -285,35 +309,35 @@ def load_csv(filename): #collect data for specific run from csv file
    return cleaned_data
 
 
+@timing.timer.timed("collect_run_data")
 def collect_run_data(data, well, stiff, trial): #collect data for specific run from csv file
     well_data = []
-    no_contact = []
     run_array = []
     forces = []
     if stiff:
         return run_array
     for i in range(0, len(data)):
         if data[i][0] == well and int(data[i][3]) == trial: #collect data from most recent well
-            values = [data[i][1], data[i][2]]
+            count = data[i][-1] if len(data[i]) > 4 else 1 #number of measurements averaged into the row
+            values = [data[i][1], data[i][2], count]
             well_data.append(values)
     #print(well_data)
     #print("\n")
+    if len(well_data) == 0:
+        return run_array
+    detector = contact_detector.make_detector(contact_method, float(well_data[0][0]), float(well_data[0][1]))
     for l in range(1, len(well_data)):
-        if float(well_data[l][1]) <= -1*float(well_data[0][0]) + 2*float(well_data[0][1]): #determine which measurements correspond to contact
-            no_contact.append(l)
-        run_array.append([well_data[l][0], well_data[l][1]])
+        noise = float(well_data[0][1]) / math.sqrt(float(well_data[l][2])) #noise of the averaged measurement
+        detector.update(-1*float(well_data[l][1]), float(well_data[l][2])) #determine which measurements correspond to contact the same way as while indenting
+        run_array.append([well_data[l][0], well_data[l][1], noise])
     #print(run_array)
     #print("\n")
-    #print(no_contact)
-    #print("\n")
-    if len(run_array) - int(no_contact[len(no_contact) - 1]) <= 10: #check if no or not enough data was collected for well
+    if len(run_array) == 0 or detector.index is None or round(float(run_array[detector.index][0]) - float(run_array[-1][0]), 2) < contact_detector.MIN_CONTACT_DEPTH: #check if no or not enough data was collected for well
         print("Either well was not tested or no data was collected, either because sample was too short or too soft")
         run_array = []
         return run_array
-    if len(no_contact) > 0: #find index of first continuous contact measurement
-        start_val = int(no_contact[len(no_contact)-1]+1)
-    else:
-        start_val = 0
+    print(f"Contact found with {round(detector.confidence * 100, 1)}% confidence")
+    start_val = detector.index + 1 #index of first continuous contact measurement, the first row is the baseline
     #print(start_val)
     #print(len(well_data))
     #print(run_array[start_val][0])
@@ -350,152 +374,22 @@ def approximate_height(run_array): #find height of sample to determine correctio
     depths = []
     for i in range(0, len(run_array)):
         depths.append(run_array[i][0])
+    distances = []
     for j in range(0, len(depths)):
-        depths[j] = abs(depths[j])
-    zero = min(depths)
-    num = depths.index(zero)
-    z_pos = (num * 0.02) + 3
+        distances.append(abs(depths[j]))
+    zero = min(distances)
+    num = distances.index(zero)
+    z_pos = (depths[num] - depths[0]) + 3 #from how far below the first measurement contact was, not how many rows
     approx_height = 15 - z_pos
     #print(approx_height)
     return approx_height
 
-def correct_force(depths, forces, p_ratio, approx_height): #add correction factor based on simulation data since samples are not ideal shapes
-    new_array = []
-    for i in range(0, len(depths)):
-        if p_ratio < 0.325:
-            if approx_height >= 9.5:
-                b = 0.13
-                c = 1.24
-            elif approx_height >= 8.5 and approx_height < 9.5:
-                b = 0.131
-                c = 1.24
-            elif approx_height >= 7.5 and approx_height < 8.5:
-                b = 0.133
-                c = 1.25
-            elif approx_height >= 6.5 and approx_height < 7.5:
-                b = 0.132
-                c = 1.24
-            elif approx_height >= 5.5 and approx_height < 6.5:
-                b = 0.132
-                c = 1.24
-            elif approx_height >= 4.5 and approx_height < 5.5:
-                b = 0.139
-                c = 1.27
-            elif approx_height >= 3.5 and approx_height < 4.5:
-                b = 0.149
-                c = 1.3
-            else:
-                b = 0.162
-                c = 1.38
-        elif p_ratio >= 0.325 and p_ratio < 0.375:
-            if approx_height >= 9.5:
-                b = 0.132
-                c = 1.25
-            elif approx_height >= 8.5 and approx_height < 9.5:
-                b = 0.132
-                c = 1.25
-            elif approx_height >= 7.5 and approx_height < 8.5:
-                b = 0.134
-                c = 1.25
-            elif approx_height >= 6.5 and approx_height < 7.5:
-                b = 0.136
-                c = 1.26
-            elif approx_height >= 5.5 and approx_height < 6.5:
-                b = 0.126
-                c = 1.25
-            elif approx_height >= 4.5 and approx_height < 5.5:
-                b = 0.133
-                c = 1.27
-            elif approx_height >= 3.5 and approx_height < 4.5:
-                b = 0.144
-                c = 1.32
-            else:
-                b = 0.169
-                c = 1.42
-        elif p_ratio >= 0.375 and p_ratio < 0.425:
-            if approx_height >= 9.5:
-                b = 0.181
-                c = 1.33
-            elif approx_height >= 8.5 and approx_height < 9.5:
-                b = 0.182
-                c = 1.34
-            elif approx_height >= 7.5 and approx_height < 8.5:
-                b = 0.183
-                c = 1.34
-            elif approx_height >= 6.5 and approx_height < 7.5:
-                b = 0.183
-                c = 1.34
-            elif approx_height >= 5.5 and approx_height < 6.5:
-                b = 0.194
-                c = 1.38
-            elif approx_height >= 4.5 and approx_height < 5.5:
-                b = 0.198
-                c = 1.4
-            elif approx_height >= 3.5 and approx_height < 4.5:
-                b = 0.203
-                c = 1.44
-            else:
-                b = 0.176
-                c = 1.46
-        elif p_ratio >= 0.425 and p_ratio < 0.475:
-            if approx_height >= 9.5:
-                b = 0.156
-                c = 1.35
-            elif approx_height >= 8.5 and approx_height < 9.5:
-                b = 0.152
-                c = 1.34
-            elif approx_height >= 7.5 and approx_height < 8.5:
-                b = 0.156
-                c = 1.35
-            elif approx_height >= 6.5 and approx_height < 7.5:
-                b = 0.161
-                c = 1.37
-            elif approx_height >= 5.5 and approx_height < 6.5:
-                b = 0.153
-                c = 1.37
-            elif approx_height >= 4.5 and approx_height < 5.5:
-                b = 0.166
-                c = 1.42
-            elif approx_height >= 3.5 and approx_height < 4.5:
-                b = 0.179
-                c = 1.47
-            else:
-                b = 0.205
-                c = 1.59
-        else:
-            if approx_height >= 9.5:
-                b = 0.203
-                c = 1.58
-            elif approx_height >= 8.5 and approx_height < 9.5:
-                b = 0.207
-                c = 1.6
-            elif approx_height >= 7.5 and approx_height < 8.5:
-                b = 0.212
-                c = 1.62
-            elif approx_height >= 6.5 and approx_height < 7.5:
-                b = 0.217
-                c = 1.65
-            elif approx_height >= 5.5 and approx_height < 6.5:
-                b = 0.21
-                c = 1.64
-            elif approx_height >= 4.5 and approx_height < 5.5:
-                b = 0.22
-                c = 1.68
-            elif approx_height >= 3.5 and approx_height < 4.5:
-                b = 0.17
-                c = 1.58
-            else:
-                b = 0.182
-                c = 1.64
-        val = (forces[i])/(c*pow(depths[i], b))
-        new_array.append(val)
-    return new_array
+def correction_factors(p_ratio, approx_height): #b and c of the correction for the poisson's ratio and height of a sample
+    return force_correction.factors(p_ratio, approx_height, well_plate, interpolate_correction)
 
 
-def adjust_depth(run_array, d0): #using curve fit, adjust depth so that at zero force, depth is 0
-    for i in range(0, len(run_array)):
-        run_array[i][0] = run_array[i][0]-d0
-    return run_array
+def correct_force(depths, forces, p_ratio, approx_height): #add correction factor based on simulation data since samples are not ideal shapes
+    return force_correction.correct(depths, forces, p_ratio, approx_height, well_plate, interpolate_correction)
 
 
 def find_E(A, p_ratio): #determine elastic modulus from curve fit
@@ -517,18 +411,7 @@ def adjust_E(E): #an empirical correction factor for softer samples which causes
 
 
 def go_home(GRBL_port_path): #move CNC back to its home position
-    n = 1
-    with open('position.csv', mode='r') as file:
-        csvFile = csv.reader(file)
-        for lines in csvFile:
-            if n == 1:
-                position = lines
-                #print(position)
-            n = n + 1
-    #print(position)
-    x = position[0]
-    y = position[1]
-    z = position[2]
+    x, y, z = cnc_position.tracker.sync(GRBL_port_path, BAUD_RATE) #finds position of cnc, checked against grbl's own
     if x !=0 or y != 0 or z !=0:
         #print(x)
         #print(y)
@@ -542,19 +425,15 @@ def go_home(GRBL_port_path): #move CNC back to its home position
         home_xy(GRBL_port_path, gcode, home, x, y, z)
 
 def home_z(GRBL_port_path, gcode, home, x, y, z): #move CNC to home height position
-    # with contect opens file/connection and closes it if function(with) scope is left
-    with serial.Serial(GRBL_port_path, BAUD_RATE) as ser:
-        send_wake_up(ser)
+    # with connection reuses the open port to the cnc, which stays open after function(with) scope is left
+    with grbl.connection(GRBL_port_path, BAUD_RATE) as ser:
         cleaned_line = remove_eol_chars(remove_comment(gcode))
         if home:
             #print(f'G92 Z{z}\n')
             command = str.encode(f'G92 Z{z}\n')
             ser.write(command)  # Send g-code
 
-            wait_for_movement_completion(ser, cleaned_line)
-
-            grbl_out = ser.readline()  # Wait for response with carriage return
-            #print(" : ", grbl_out.strip().decode('utf-8'))
+            wait_for_movement_completion(ser, command.decode())
             z = 0
         if cleaned_line:  # checks if string is empty
             #print("Sending gcode:" + str(cleaned_line))
@@ -563,30 +442,22 @@ def home_z(GRBL_port_path, gcode, home, x, y, z): #move CNC to home height posit
             ser.write(command)  # Send g-code
 
             wait_for_movement_completion(ser, cleaned_line)
-
-            grbl_out = ser.readline()  # Wait for response with carriage return
-            #print(" : ", grbl_out.strip().decode('utf-8'))
             position = [x, y, z]
 
         #print('End of gcode')
-        with open("position.csv", 'w') as csvfile:
-            csvwriter = csv.writer(csvfile)
-            csvwriter.writerow(position)
+        cnc_position.tracker.set(*position)
+        cnc_position.tracker.save()
 
 def home_xy(GRBL_port_path, gcode, home, x, y, z): #move CNC to home x and y position
-    # with contect opens file/connection and closes it if function(with) scope is left
-    with serial.Serial(GRBL_port_path, BAUD_RATE) as ser:
-        send_wake_up(ser)
+    # with connection reuses the open port to the cnc, which stays open after function(with) scope is left
+    with grbl.connection(GRBL_port_path, BAUD_RATE) as ser:
         cleaned_line = remove_eol_chars(remove_comment(gcode))
         if home:
             #print(f'G92 X{x} Y{y}\n')
             command = str.encode(f'G92 X{x} Y{y}\n')
             ser.write(command)  # Send g-code
 
-            wait_for_movement_completion(ser, cleaned_line)
-
-            grbl_out = ser.readline()  # Wait for response with carriage return
-            #print(" : ", grbl_out.strip().decode('utf-8'))
+            wait_for_movement_completion(ser, command.decode())
             x = 0
             y = 0
             z = 0
@@ -597,15 +468,11 @@ def home_xy(GRBL_port_path, gcode, home, x, y, z): #move CNC to home x and y pos
             ser.write(command)  # Send g-code
 
             wait_for_movement_completion(ser, cleaned_line)
-
-            grbl_out = ser.readline()  # Wait for response with carriage return
-            #print(" : ", grbl_out.strip().decode('utf-8'))
             position = [x, y, z]
 
         #print('End of gcode')
-        with open("position.csv", 'w') as csvfile:
-            csvwriter = csv.writer(csvfile)
-            csvwriter.writerow(position)
+        cnc_position.tracker.set(*position)
+        cnc_position.tracker.save()
 
 if __name__ == "__main__":
     # GRBL_port_path = '/dev/tty.usbserial-A906L14X'
@@ -630,8 +497,16 @@ if __name__ == "__main__":
     z_up = "-2.50"
     height_offset = 17.7  # set starting distance between indenter and wells
     # y_disp = 0.1 #well plate is not precisely aligned, should get fixed in future iterations
-    h_speed = "500"  # speed sensor moves between wells
     v_speed = "100"  # speed sensor moves while testing sample
+    indent_mode = "step"  # "step" stops at every step, "stream" streams the steps as one smooth movement and "continuous"
+    # indents with a single slow movement while reading the sensor as fast as it can go
+    approach_speed = None  # speed in mm/min to quickly move down until the sensor touches the sample before indenting,
+    # None to indent slowly all the way from the starting height
+    use_height_map = False  # skip the air above where the sample is expected from the wells tested so far, only for
+    # plates filled to about the same height, since the indenter moves at h_speed to just above the expected surface
+    run_survey = False  # quickly find the sample surface in every well before testing any of them, skipping empty wells
+    reorder_wells = False  # visit the wells in the order with the least travel between them instead of the order entered
+    sample_period = 10  # time in ms between force measurements, the sensor streams for the whole run
     results = []
 
     for i in range(0, 8):  # load x values into x dictionairy
@@ -680,6 +555,9 @@ if __name__ == "__main__":
                         bad_answer = False
                         bad_name = False
                         print("Okay, overwriting file")
+                        for old_file in [filename[:-4] + "_heights.csv", filename[:-4] + "_survey.csv"]: #heights from another plate would be wrong
+                            if os.path.exists(old_file):
+                                os.remove(old_file)
                     elif overwrite.strip() == "n" or overwrite.strip() == "N":
                         bad_answer = False
                         print("Okay, restarting file naming process")
@@ -811,9 +689,34 @@ if __name__ == "__main__":
         else:
             print("Invalid response, please try again")
 
+    if reorder_wells: #results are still saved with the well they belong to
+        order = well_order.shortest_order(wells, x, y, h_speed)
+        p_ratios = [p_ratios[wells.index(well)] for well in order]
+        wells = order
     print(f"Okay, testing wells: {wells}")
+    raw = raw_data.RawData(filename) #keeps the rows of the well being tested for the analysis
+    sensor = force_sensor.SensorService(device, sample_period) #start streaming the force sensor
+    sensor.connect()
+    heights = height_map.HeightMap(filename[:-4] + "_heights.csv") #heights contact was made at in every tested well
+    surface = {}
+    if run_survey: #find the sample surface in every well, then only test the wells with a sample in them
+        z_int = round(-1*height_offset+1, 2)
+        surface = survey.survey_plate(GRBL_port_path, BAUD_RATE, sensor, wells, x, y, z_int, round(z_int + lowest + 1, 2),
+                                      h_speed, filename[:-4] + "_survey.csv")
+        empty = survey.empty_wells(surface, wells)
+        if len(empty) > 0:
+            print(f"Skipping empty wells: {empty}")
+            p_ratios = [p_ratios[i] for i in range(0, len(wells)) if wells[i] not in empty]
+            wells = [well for well in wells if well not in empty]
+        for well in empty:
+            now = datetime.now()
+            row = [well, "no data", "no data", now]
+            results.append(row)
+            with open(results_filename, 'a') as csvfile:
+                csvwriter = csv.writer(csvfile)
+                csvwriter.writerow(row)
 
-    max_time = (len(wells) * 9.2 * 60) * num_tests + ((num_tests - 1) * time_between) #estimate time to test every well the specified number of times
+    max_time = timing.timer.remaining(len(wells) * num_tests) + ((num_tests - 1) * time_between) #estimate time to test every well the specified number of times
     hrs = math.floor(max_time / 3600)
     mins = round(max_time / 60) - hrs * 60
     print(f"Estimated time to run tests is {hrs} hours and {mins} minutes, though times may vary")
@@ -823,7 +726,8 @@ if __name__ == "__main__":
         curr_y = 0
         home = False
         for n in range(0, len(wells)):
-            max_time = (len(wells)-n) * 9.2 * 60
+            timing.timer.start_well(wells[n])
+            max_time = timing.timer.remaining(len(wells)-n)
             hrs = math.floor(max_time / 3600)
             mins = round(max_time / 60) - hrs * 60
             print(f"Testing well {wells[n]}")
@@ -857,7 +761,17 @@ if __name__ == "__main__":
             while z >= lowest+1: #generate gcode to move well down
                 gcode.append(f"G01 Z{z} F{v_speed}")
                 z = round(z-0.02, 2)
-            measurements, z, stiff = stream_gcode(GRBL_port_path, gcode, X, Y, well, filename, trial) #test well
+            well_start = time.time()
+            expected = None
+            if use_height_map:
+                expected = heights.predict(well) #height contact is expected at from the wells tested so far
+            if well in surface and well not in heights.heights: #the survey is better than a guess from other wells
+                expected = surface[well]
+            raw.start_well()
+            measurements, z, stiff = stream_gcode(GRBL_port_path, gcode, X, Y, well, raw, trial, indent_mode, approach_speed,
+                                                  expected) #test well
+            indentation.report_phases(time.time() - well_start)
+            raw.end_well() #make sure every row of the well is saved
             gcode = f"G01 Z{-z+Z} F{v_speed}"
             move_gcode(GRBL_port_path, gcode, home, X, Y, Z) #move sensor back up
             curr_x = X #set new x position
@@ -865,13 +779,14 @@ if __name__ == "__main__":
             curr_y = Y #set new y position
             #print(f"curr_Y: {curr_y}")
             #Analysis
-            data = load_csv(filename)
+            data = raw.rows
             # print(data)
             cols = ["A", "B", "C", "D", "E", "F", "G", "H"]
             rows = ["1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "12"]
             well = wells[n]
             run_array = collect_run_data(data, well, stiff, trial)
             if run_array != []:
+                heights.record(well, height_map.contact_height(data, well, run_array, [trial])) #save before depths are adjusted
                 well_data = run_array
                 # print(run_array)
                 height = approximate_height(run_array)
@@ -882,99 +797,28 @@ if __name__ == "__main__":
                 # print(forces)
                 well_depths = depths
                 well_forces = forces
-                depth_in_range, force_in_range = find_d_and_f_in_range(run_array)
-                # print(depth_in_range)
-                # print(force_in_range)
                 p_ratio = p_ratios[n]
-                adjusted_forces = correct_force(depth_in_range, force_in_range, p_ratio, height)
-                # print(adjusted_forces)
-                depth_in_range = np.asarray(depth_in_range)
-                adjusted_forces = np.asarray(adjusted_forces)
-
-
-                def Hertz_func(depth, A, d0):
-                    F = A * pow(depth - d0, 1.5)
-                    return F
-
-                try: #fit data to Hertzian contact mechanics
-                    parameters, covariance = curve_fit(Hertz_func, depth_in_range, adjusted_forces, p0=[2, 0.03])
-                except:
+                with timing.timer.part("hertz_fit"): #fit data to Hertzian contact mechanics, moving the depths to where contact started
+                    fit = hertz_fit.fit_hertz(run_array, p_ratio, correction_factors, approximate_height)
+                error = fit is None
+                if error:
                     print("Data could not be analyzed")
-                    error = True
                 else:
-
-                    # print(depth_in_range)
-                    # print(force_in_range)
-
-                    fit_A = float(parameters[0])
-                    fit_d0 = float(parameters[1])
-                    # print(fit_A)
-                    # print(fit_d0)
-                    # pyplot.scatter(depth_in_range, adjusted_forces)
+                    fit_A = fit.A
+                    depth_in_range = fit.depths
+                    covariance = fit.covariance
+                    print(f"A = {fit_A}, contact was {round(fit.offset, 3)} mm below where it was detected, fit in {fit.solves} "
+                          f"solves and {fit.evaluations} evaluations")
+                    # pyplot.scatter(depth_in_range, fit.forces)
                     # y_var = []
                     # for i in range(0, len(depth_in_range)):
-                    # y_var.append(fit_A * pow(depth_in_range[i], 1.5))
+                    #     y_var.append(fit_A * pow(depth_in_range[i], 1.5))
                     # pyplot.plot(depth_in_range, y_var)
                     # pyplot.xlabel("Depth (mm)")
                     # pyplot.ylabel("Force (N)")
                     # pyplot.title("Force vs. Indentation Depth")
                     # pyplot.show()
 
-                    count = 0 #adjust if approximate initial depth was incorrect
-                    continue_to_adjust = True
-                    if abs(fit_d0) < 0.01:
-                        continue_to_adjust = False
-                    min_d0 = 100
-                    error = False
-                    while continue_to_adjust:
-                        count = count + 1
-                        old_d0 = fit_d0
-                        run_array = adjust_depth(run_array, fit_d0)
-                        depth_in_range, force_in_range = find_d_and_f_in_range(run_array)
-                        # print(depth_in_range)
-                        height = approximate_height(run_array)
-                        adjusted_forces = correct_force(depth_in_range, force_in_range, p_ratio, height)
-                        # print(adjusted_forces)
-                        depth_in_range = np.asarray(depth_in_range)
-                        adjusted_forces = np.asarray(adjusted_forces)
-                        try:
-                            parameters, covariance = curve_fit(Hertz_func, depth_in_range, adjusted_forces, p0=[2, 0.03])
-                        except:
-                            print("Data could not be analyzed")
-                            error = True
-                        else:
-                            fit_A = float(parameters[0])
-                            fit_d0 = float(parameters[1])
-                            # print(fit_A)
-                            # print(fit_d0)
-                            if abs(fit_d0) < min_d0:
-                                min_d0 = abs(fit_d0)
-                            # print(f"min {min_d0}")
-                            # pyplot.scatter(depth_in_range, adjusted_forces)
-                            # y_var = []
-                            # for i in range(0, len(depth_in_range)):
-                            # y_var.append(fit_A * pow(depth_in_range[i], 1.5))
-                            # pyplot.plot(depth_in_range, y_var)
-                            # pyplot.xlabel("Depth (mm)")
-                            # pyplot.ylabel("Force (N)")
-                            # pyplot.title("Force vs. Indentation Depth")
-                            # pyplot.show()
-                            if abs(round(old_d0, 5)) == abs(round(fit_d0, 5)): #if fit continues to converge to improper value
-                                fit_d0 = -0.75 * fit_d0
-                            elif abs(fit_d0) < 0.01:
-                                continue_to_adjust = False
-                                break
-                            elif count > 100 and count < 200:
-                                if abs(round(fit_d0, 2)) == round(min_d0, 2):
-                                    break
-                            elif count >= 200 and count < 300:
-                                if abs(round(fit_d0, 1)) == round(min_d0, 1):
-                                    break
-                            elif count == 300:
-                                print("Error in data analysis")
-                                error = True
-                                break
-
                 if not error:
                     E = find_E(fit_A, p_ratio)
                     #print(E)
@@ -1009,6 +853,8 @@ if __name__ == "__main__":
                 with open(results_filename, 'a') as csvfile:
                     csvwriter = csv.writer(csvfile)
                     csvwriter.writerow(row)
+            timing.timer.end_well()
+            timing.timer.save(filename[:-4] + "_timing.csv") #save how long every part of the well took
 
 
         home = True
@@ -1022,3 +868,10 @@ if __name__ == "__main__":
         time.sleep(time_between)
 
     print("Testing is complete! Please us the analysis_over_time program to view the results for each well.")
+    grbl.report_sessions(len(wells) * num_tests) #show how much time keeping the port open saved
+    grbl.wait_stats.report() #show how long the cnc took to finish each movement
+    grbl.close_sessions()
+    raw.close()
+    sensor.close()
+    timing.timer.report() #show where the time of the run went
+    timing.timer.save(filename[:-4] + "_timing.csv")
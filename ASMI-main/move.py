@@ -30,13 +30,13 @@ THE SOFTWARE.
 """
 
 
-import serial
+import grbl
+import cnc_position
 import time
-from threading import Event
-import csv
+import os
 
 BAUD_RATE = 115200
-GRBL_port_path = "COM3" #Change this to the desired serial port!
+GRBL_port_path = os.environ.get("ASMI_GRBL_PORT", "COM3") #Change this to the desired serial port!
 x_init = 85.7  # set x position of well A1, change to fit to your device!
 y_init = 56.9  # set y position of well A1, change to fit to your device!
 offset = 8.95  # set distance between wells, change to fit to your device!
@@ -54,53 +54,19 @@ def remove_eol_chars(string):
     return string.strip()
 
 
-def send_wake_up(ser):
-    # Wake up
-    # Hit enter a few times to wake the cnc
-    ser.write(str.encode("\r\n\r\n"))
-    time.sleep(2)  # Wait for cnc to initialize
-    ser.flushInput()  # Flush startup text in serial input
-
-
 def wait_for_movement_completion(ser, cleaned_line): #wait for cnc to reach destination before sending new movement
-    Event().wait(1)
-
-    if cleaned_line != '$X' or '$$':
-
-        idle_counter = 0
-
-        while True:
-
-            # Event().wait(0.01)
-            ser.reset_input_buffer()
-            command = str.encode('?' + '\n')
-            ser.write(command)
-            grbl_out = ser.readline()
-            grbl_response = grbl_out.strip().decode('utf-8')
-
-            if grbl_response != 'ok':
-
-                if grbl_response.find('Idle') > 0:
-                    idle_counter += 1
-
-            if idle_counter > 10:
-                break
-    return
+    return grbl.wait_for_idle(ser, grbl.parse_target(cleaned_line)) #returns as soon as the cnc is idle at its target
 
 
 def stream_gcode(GRBL_port_path, gcode, home, x, y):
-    with serial.Serial(GRBL_port_path, BAUD_RATE) as ser:
-        send_wake_up(ser)
+    with grbl.connection(GRBL_port_path, BAUD_RATE) as ser:
         cleaned_line = remove_eol_chars(remove_comment(gcode))
         if home: #if device is being moved home, run this to reset coordinate system
             ##print(f'G92 X{x} Y{y} Z{z}\n')
             command = str.encode(f'G92 X{x} Y{y} \n')
             ser.write(command)  # Send g-code
 
-            wait_for_movement_completion(ser, cleaned_line)
-
-            grbl_out = ser.readline()  # Wait for response with carriage return
-            ##print(" : ", grbl_out.strip().decode('utf-8'))
+            wait_for_movement_completion(ser, command.decode())
             x = 0
             y = 0
             z = 0
@@ -111,16 +77,12 @@ def stream_gcode(GRBL_port_path, gcode, home, x, y):
             ser.write(command)  # Send g-code
 
             wait_for_movement_completion(ser, cleaned_line)
-
-            grbl_out = ser.readline()  # Wait for response with carriage return
-            ##print(" : ", grbl_out.strip().decode('utf-8'))
             z = 0
             position = [x, y, z]
 
         ##print('End of gcode')
-        with open("position.csv", 'w') as csvfile: #update position of cnc
-            csvwriter = csv.writer(csvfile)
-            csvwriter.writerow(position)
+        cnc_position.tracker.set(*position) #update position of cnc
+        cnc_position.tracker.save()
 
 
 if __name__ == "__main__":
@@ -194,6 +156,7 @@ if __name__ == "__main__":
     gcode = f"G01 X0 Y0 F500"
     #print(f"G01 X0 Y0 F500")
     stream_gcode(GRBL_port_path, gcode, home, curr_x, curr_y)
+    grbl.close_sessions()
 
     #with open("gcode.gcode", "w") as f:
      #   f.truncate()
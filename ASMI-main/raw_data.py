@@ -0,0 +1,75 @@
+"""
+This is a module which saves the raw measurements of a run to its data file. The rows of the well being tested are also
+kept in memory, in the same form load_csv reads them back in, so the well can be analysed right after it is tested
+without reading the whole data file back in and searching it for the well. The data file only has to be read back when
+a run is analysed again later on.
+
+The data file is kept open for the whole run and rows are written to it in batches instead of opening and closing it
+for every row. Batches are written once enough rows have been saved or enough time has passed, at the end of every well,
+and when the program exits, even if it is stopped part way through a well, and every batch is synced to the disk so it
+is not lost if the computer goes down.
+"""
+
+import atexit
+import csv
+import os
+import time
+
+import timing
+
+FLUSH_ROWS = 500  # rows kept in memory before they are written to the data file
+FLUSH_INTERVAL = 1  # longest time in seconds rows are kept in memory before they are written to the data file
+
+
+class RawData: #the data file of a run, which keeps the rows saved for the well being tested
+    def __init__(self, filename, flush_rows=FLUSH_ROWS, flush_interval=FLUSH_INTERVAL):
+        self.filename = filename
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.rows = []  # rows saved since start_well was last called
+        self.buffer = []  # rows not written to the data file yet
+        self.last_flush = time.monotonic()
+        self.file = open(filename, 'a')
+        self.csvwriter = csv.writer(self.file)
+        atexit.register(self.close)  # save the rows still in memory if the program is stopped
+
+    def start_well(self): #forget the rows of the last well
+        self.flush()
+        self.rows = []
+
+    def end_well(self): #make sure every row of the well is in the data file
+        self.flush()
+
+    def write(self, row): #save a row to the data file
+        row = [str(value) for value in row]
+        self.buffer.append(row)
+        self.rows.append(row)
+        self.flush_if_due()
+
+    def write_rows(self, rows): #save several rows to the data file at once
+        rows = [[str(value) for value in row] for row in rows]
+        self.buffer.extend(rows)
+        self.rows.extend(rows)
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        if len(self.buffer) >= self.flush_rows or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self): #write the rows kept in memory to the data file and sync it to the disk
+        if self.file is None:
+            return
+        if self.buffer:
+            with timing.timer.part("csv write"):
+                self.csvwriter.writerows(self.buffer)
+                self.buffer = []
+                self.file.flush()
+                os.fsync(self.file.fileno())
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        if self.file is None:
+            return
+        self.flush()
+        self.file.close()
+        self.file = None
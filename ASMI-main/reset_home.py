@@ -4,17 +4,15 @@ device has externally been moved back to its home position
 """
 
 import sys
-import csv
+
+import cnc_position
 
 invalid = True
 reset = input("Are you sure you would like to reset the home position? This should only be done if the device was moved"
               " externally. (Y or N): ")
 while invalid: #ensures user really wants to reset the coordinate
     if reset == 'Y' or reset == 'y':
-        position = [0, 0, 0]
-        with open("position.csv", 'w') as csvfile:
-            csvwriter = csv.writer(csvfile)
-            csvwriter.writerow(position)
+        cnc_position.tracker.reset()
         print("Okay, resetting position of CNC to 0, 0, 0")
         invalid = False
     elif reset == 'N' or reset == 'n':
@@ -0,0 +1,82 @@
+"""
+This is a module which watches the force sensor in a background thread while the cnc is moving and stops the cnc with
+grbl's real-time feed hold the moment a force limit is reached. Real-time commands are acted on by grbl as soon as they
+arrive instead of waiting behind the gcode in its buffer, so the cnc starts slowing down within one sensor sample
+period of the limit being reached, no matter how fast it was moving or how much gcode was still queued.
+"""
+
+import time
+from threading import Event, Thread
+
+import grbl
+
+SAMPLE_PERIOD = 10  # time in ms between force measurements while the sensor is being watched
+
+
+class ForceWatchdog(Thread): #reads every force measurement while the cnc moves and stops it if a limit is reached
+    def __init__(self, ser, device, max_force=45, sample_period=SAMPLE_PERIOD, check=None):
+        super().__init__(daemon=True)
+        self.ser = ser
+        self.device = device
+        self.max_force = max_force
+        self.sample_period = sample_period
+        self.check = check  # optional function(value) which returns False when the cnc should be stopped
+        self.times = []  # time each force measurement was made at
+        self.values = []
+        self.saved = []  # whether each measurement was made before the cnc was told to stop
+        self.tripped = Event()
+        self.trip_time = None
+        self.reason = None
+        self.error = None
+        self.stopped = Event()
+        self.started = Event()
+
+    def latest(self):
+        if not self.values:
+            return 0
+        return self.values[-1]
+
+    def trip(self, reason): #tell grbl to stop right away
+        grbl.feed_hold(self.ser)
+        self.trip_time = time.monotonic()
+        self.reason = reason
+        self.tripped.set()
+
+    def run(self):
+        try:
+            self.device.start(period=self.sample_period)
+            sensors = self.device.get_enabled_sensors()
+            self.started.set()
+            while not self.stopped.is_set() and not self.tripped.is_set():
+                if not self.device.read():
+                    continue
+                read_time = time.monotonic()
+                for sensor in sensors:
+                    batch = list(sensor.values)
+                    sensor.clear()
+                    for i in range(0, len(batch)): #the newest value in a batch was measured when it was read
+                        self.times.append(read_time - (len(batch) - 1 - i) * self.sample_period / 1000)
+                        self.values.append(batch[i])
+                        keep = self.check is None or self.check(batch[i])
+                        self.saved.append(keep)
+                        if batch[i] <= -self.max_force:
+                            self.trip("force limit reached")
+                        elif not keep:
+                            self.trip("exit condition reached")
+                        if self.tripped.is_set():
+                            break
+        except Exception as e:  # stop the cnc if the sensor fails, since force is no longer being watched
+            self.error = e
+            self.trip(f"force sensor failed: {e}")
+        finally:
+            self.started.set()
+            self.device.stop()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def reaction_time(self): #time between the measurement that reached the limit and the feed hold being sent
+        if self.trip_time is None or not self.times:
+            return None
+        return self.trip_time - self.times[-1]
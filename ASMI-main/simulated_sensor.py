@@ -0,0 +1,136 @@
+"""
+This is a module with a simulated GoDirect force sensor, so the measure programs can be run and benchmarked without the
+force sensor plugged in. Set the ASMI_SIMULATE environment variable to use it in place of the real sensor.
+
+The simulated sensor works out the force from how far the indenter is pressed into the sample below it, using Hertzian
+contact mechanics for the 5 mm steel sphere of the indenter, the same way find_E works out the elastic modulus from a
+curve fit. Samples are not the ideal shape Hertzian contact assumes, so the force is multiplied by c * depth^b, with the
+b and c force_correction has for the height and poisson's ratio of the sample, which the analysis divides back out. The
+elastic modulus the analysis finds is then the one of the sample. Noise and a slow drift are added to every measurement.
+The position of the indenter is asked for every time the sensor is read, from cnc_position by default, which the
+measure programs keep up to date after every step. A simulated cnc can pass in its own position instead so the force
+follows the indenter while it moves.
+
+The sample is set up with these environment variables, which all have defaults:
+ASMI_SIM_E: elastic modulus of the sample in Pa
+ASMI_SIM_POISSON: poisson's ratio of the sample
+ASMI_SIM_HEIGHT: height of the sample in the well in mm
+ASMI_SIM_BOTTOM: z of the bottom of the wells in mm
+ASMI_SIM_PLATE: well plate whose correction factors the sample follows, see force_correction
+ASMI_SIM_NOISE: standard deviation of the noise in N
+ASMI_SIM_DRIFT: drift of the sensor in N/s
+"""
+
+import math
+import os
+import random
+import time
+
+import cnc_position
+import force_correction
+
+SAMPLE_PERIOD = 10  # time in ms between measurements when start is not given a period
+WELL_BOTTOM = -13  # z of the bottom of the wells in mm, where approximate_height puts it
+R_SPHERE = 0.0025  # radius of the indenter in m
+SPHERE_E = 1.8e11  # elastic modulus of the indenter in Pa
+SPHERE_P_RATIO = 0.28  # poisson's ratio of the indenter
+E = 1e6  # elastic modulus of the sample in Pa
+P_RATIO = 0.45  # poisson's ratio of the sample
+HEIGHT = 8  # height of the sample in mm
+NOISE = 0.005  # standard deviation of the noise in N
+DRIFT = 0.0  # drift of the sensor in N/s
+
+
+class SimulatedSample: #a sample in a well, which pushes back on the indenter following Hertzian contact mechanics
+    def __init__(self, E=E, p_ratio=P_RATIO, height=HEIGHT, bottom=WELL_BOTTOM, plate="standard"):
+        self.E = E
+        self.p_ratio = p_ratio
+        self.height = height
+        self.surface = bottom + height  # z the indenter touches the sample at
+        E_star = 1 / ((1 - p_ratio ** 2) / E + (1 - SPHERE_P_RATIO ** 2) / SPHERE_E)
+        self.A = 4 / 3 * E_star * math.sqrt(R_SPHERE) / pow(1000, 1.5)  # N/mm^1.5, the A the curve fit finds
+        self.b, self.c = force_correction.factors(p_ratio, height, plate)  # how far the sample is from the ideal shape
+
+    def force(self, z): #force in N pushing back on the indenter at height z
+        depth = self.surface - z
+        if depth <= 0:
+            return 0.0
+        return self.c * pow(depth, self.b) * self.A * pow(depth, 1.5)
+
+
+class SimulatedChannel: #a sensor of the simulated device, holding the measurements made since it was last cleared
+    def __init__(self):
+        self.values = []
+        self.value = 0.0  # most recent measurement
+        self.sensor_description = "Force"
+        self.sensor_units = "N"
+
+    def clear(self):
+        self.values = []
+
+
+class SimulatedDevice: #stands in for the GoDirect device returned by get_device
+    def __init__(self, samples=None, position=None, noise=NOISE, drift=DRIFT, seed=None):
+        # samples is a SimulatedSample used in every well, or a function of the x and y position of the indenter that
+        # returns the sample there, or None for an empty well
+        self.samples = samples if samples is not None else SimulatedSample()
+        self.position = position if position is not None else cnc_position.tracker.get
+        self.noise = noise
+        self.drift = drift
+        self.random = random.Random(seed)
+        self.channel = SimulatedChannel()
+        self.name = "Simulated force sensor"
+        self.period = SAMPLE_PERIOD / 1000
+        self.opened = time.monotonic()
+        self.next_time = None  # time the next measurement is made at, None while the sensor is stopped
+
+    def open(self, auto_start=False):
+        self.opened = time.monotonic()
+        if auto_start:
+            self.start()
+
+    def close(self):
+        self.stop()
+
+    def start(self, period=None):
+        self.period = (period or SAMPLE_PERIOD) / 1000
+        self.next_time = time.monotonic() + self.period
+
+    def stop(self):
+        self.next_time = None
+
+    def get_enabled_sensors(self):
+        return [self.channel]
+
+    def sample_at(self, x, y): #sample under the indenter, or None if the well is empty
+        if isinstance(self.samples, SimulatedSample):
+            return self.samples
+        return self.samples(x, y)
+
+    def measure(self, measured): #force measurement the sensor makes at time measured
+        x, y, z = self.position()
+        sample = self.sample_at(x, y)
+        force = sample.force(z) if sample is not None else 0.0
+        return -force + self.drift * (measured - self.opened) + self.random.gauss(0, self.noise)
+
+    def read(self): #wait for the next measurement, handing out every measurement made since the last read
+        if self.next_time is None:
+            return False
+        now = time.monotonic()
+        if now < self.next_time:
+            time.sleep(self.next_time - now)
+            now = self.next_time
+        while self.next_time <= now:
+            self.channel.value = self.measure(self.next_time)
+            self.channel.values.append(self.channel.value)
+            self.next_time = self.next_time + self.period
+        return True
+
+
+def from_environment(position=None): #simulated device set up from the ASMI_SIM environment variables
+    sample = SimulatedSample(float(os.environ.get("ASMI_SIM_E", E)), float(os.environ.get("ASMI_SIM_POISSON", P_RATIO)),
+                             float(os.environ.get("ASMI_SIM_HEIGHT", HEIGHT)),
+                             float(os.environ.get("ASMI_SIM_BOTTOM", WELL_BOTTOM)),
+                             os.environ.get("ASMI_SIM_PLATE", "standard"))
+    return SimulatedDevice(sample, position, float(os.environ.get("ASMI_SIM_NOISE", NOISE)),
+                           float(os.environ.get("ASMI_SIM_DRIFT", DRIFT)))
@@ -0,0 +1,100 @@
+"""
+This is a module which quickly surveys a plate before it is tested. The sensor is moved over every selected well and
+jogged down quickly until it first touches the sample, which gives the height of the sample surface in every well to
+within a few hundredths of a mm in a few seconds per well. Wells where the sensor reaches the bottom without touching
+anything are empty.
+
+The surface heights are saved next to the data file as rows of [well, height], with "empty" as the height of empty
+wells, so the measure programs can start the slow indentation of every well just above its surface and skip the empty
+wells entirely.
+"""
+
+import csv
+import os
+import statistics
+import time
+
+import cnc_position
+import force_sensor
+import grbl
+import indentation
+from safety import SAMPLE_PERIOD
+
+SURVEY_SPEED = 300  # speed in mm/min the sensor is moved down at while looking for the sample surface
+
+
+def read_baseline(device, count=10, timeout=force_sensor.READ_TIMEOUT):
+    #average and standard deviation of the force while the sensor touches nothing, from at least 2 measurements. Raises
+    #ForceSensorError if the sensor does not make them within timeout seconds
+    values = []
+    count = max(count, 2)  # a standard deviation needs 2
+    device.start(period=SAMPLE_PERIOD)
+    sensors = device.get_enabled_sensors()
+    deadline = time.monotonic() + timeout
+    try:
+        while len(values) < count:
+            if time.monotonic() > deadline:
+                raise force_sensor.ForceSensorError(f"force sensor made {len(values)} of {count} measurements in "
+                                                    f"{timeout} seconds")
+            if device.read():
+                for sensor in sensors:
+                    values.extend(sensor.values)
+                    sensor.clear()
+    finally:
+        device.stop()
+    return statistics.mean(values), statistics.stdev(values)
+
+
+def move(ser, gcode): #send one movement and wait for the cnc to finish it, the survey starts from the home position
+    target = grbl.parse_target(gcode)
+    ser.write(str.encode(gcode + '\n'))
+    grbl.wait_for_idle(ser, target)
+    position = cnc_position.tracker.get()
+    for axis in target:
+        position[axis] = target[axis]
+    cnc_position.tracker.set(*position)
+
+
+def load_survey(filename): #surface height of every surveyed well, None for empty wells
+    surface = {}
+    with open(filename, 'r') as csvfile:
+        for row in csv.reader(csvfile):
+            if row != []:
+                surface[row[0]] = None if row[1] == "empty" else float(row[1])
+    return surface
+
+
+def survey_plate(port_path, baud_rate, device, wells, x, y, z_start, bottom, travel_speed, filename,
+                 survey_speed=SURVEY_SPEED):
+    #find the surface height of every well, starting from and returning to the home position. z_start is the height to
+    #start looking from and bottom the lowest height to look down to, both measured from the home position like the
+    #heights in the data file
+    if os.path.exists(filename): #the plate was already surveyed
+        print(f"Using the surface survey saved in {filename}")
+        return load_survey(filename)
+    surface = {}
+    with grbl.connection(port_path, baud_rate) as ser:
+        status = grbl.query_status(ser)
+        z0 = grbl.report_position(status)[2]  # the connection starts at the home position
+        for well in wells:
+            move(ser, f"G01 X{x[well[0]]} Y{y[well.lstrip('ABCDEFGH')]} Z{z_start} F{travel_speed}")
+            avg, stdev = read_baseline(device)
+            threshold = avg - indentation.APPROACH_SIGMA * stdev
+            touched = indentation.jog_until_contact(ser, device, z0, bottom, survey_speed, threshold)
+            if touched is None:
+                surface[well] = None
+                print(f"Survey: well {well} is empty")
+            else:
+                surface[well] = round(touched, 2)
+                print(f"Survey: well {well} surface is {round(z_start - touched, 2)} mm below the starting height")
+            move(ser, f"G01 Z{z_start} F{travel_speed}")
+        move(ser, f"G01 X0 Y0 Z0 F{travel_speed}")
+    with open(filename, 'w') as csvfile:
+        csvwriter = csv.writer(csvfile)
+        for well in wells:
+            csvwriter.writerow([well, "empty" if surface[well] is None else surface[well]])
+    return surface
+
+
+def empty_wells(surface, wells): #wells the survey found nothing to indent in
+    return [well for well in wells if well in surface and surface[well] is None]
@@ -0,0 +1,73 @@
+"""
+These are tests which check that analysis.py reads a well analyzed before back from analysis_cache instead of fitting it
+again, whether it was analyzed on its own or with the rest of the plate.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analysis
+import analysis_cache
+import contact_detector
+import hertz_fit
+
+P_RATIO = 0.45
+AVG = 0.05  # force in N measured with nothing touching the indenter
+STDEV = 0.005
+CONTACT = -3.5  # height the indenter touches the sample at
+
+
+def well_rows(well): #rows measure saves for a well indented one step at a time
+    rng = np.random.default_rng(3)
+    rows = [[well, str(AVG), str(STDEV), "cusum"]]
+    z = -1
+    while z > -4.5:
+        z = round(z - 0.02, 2)
+        value = AVG - 20 * max(CONTACT - z, 0) ** 1.5 + rng.normal(0, STDEV)
+        rows.append([well, str(z), str(value * -1), str(value * -1), "0.0", "1"])
+    return rows
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = analysis_cache.AnalysisCache(str(tmp_path))
+    monkeypatch.setattr(analysis_cache, "cache", cache)
+    monkeypatch.setattr(analysis, "use_cache", True)
+    return cache
+
+
+def no_fit(*args, **kwargs):
+    raise AssertionError("the well was fit again instead of read back")
+
+
+def test_single_well_is_read_back(cache, monkeypatch):
+    data = well_rows("A1") + well_rows("A2")
+    first = analysis.well_result(data, "A1", P_RATIO)
+    assert first["row"][1] != "no data"
+    assert (cache.hits, cache.misses) == (0, 1)
+    monkeypatch.setattr(hertz_fit, "fit_hertz", no_fit)
+    assert analysis.well_result(data, "A1", P_RATIO) == first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_single_well_reads_back_plate_analysis(cache, monkeypatch):
+    data = well_rows("A1") + well_rows("A2")
+    results = analysis.plate_results(data, P_RATIO)
+    monkeypatch.setattr(hertz_fit, "fit_hertz", no_fit)
+    entry = analysis.well_result(data, "A2", P_RATIO)
+    assert entry["row"] == results[1]
+    assert len(entry["depths"]) == len(entry["forces"]) > 0
+
+
+@pytest.mark.parametrize("setting", ["THRESHOLD_SIGMA", "CUSUM_DRIFT", "CUSUM_LIMIT", "SLOPE_WINDOW", "SLOPE_SIGMA",
+                                     "MIN_CONTACT_DEPTH", "MIN_STDEV"])
+def test_contact_detection_settings_change_the_key(setting, monkeypatch):
+    rows = well_rows("A1")
+    key = analysis.analysis_key(rows, P_RATIO)
+    monkeypatch.setattr(contact_detector, setting, getattr(contact_detector, setting) * 2)
+    assert analysis.analysis_key(rows, P_RATIO) != key
@@ -0,0 +1,119 @@
+"""
+These are tests which check that the position of the cnc is saved to position.csv in one step, so a save that is cut
+short never replaces the last position saved, and that sync takes the position from grbl when grbl still knows where
+home is, running against grbl_simulator.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cnc_position
+import grbl
+import grbl_simulator
+
+SPEED = 20  # times faster than the real cnc the simulated cnc moves
+
+
+@pytest.fixture(autouse=True)
+def quick_wake_up(monkeypatch): #the simulator is awake as soon as the port is opened
+    monkeypatch.setattr(grbl, "WAKE_UP_TIME", 0.2)
+    monkeypatch.setattr(grbl, "work_offset", None)
+    yield
+    grbl.close_sessions()
+
+
+def saved_rows(path):
+    with open(path, 'r') as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "position.csv")
+    tracker = cnc_position.PositionTracker(path)
+    assert tracker.get() == [0, 0, 0] and not os.path.exists(path)
+    tracker.set(10, 20.5, -3)
+    tracker.home = [-1.0, -2.0, 0.5]
+    tracker.save()
+    assert saved_rows(path) == ["10.0,20.5,-3.0", "-1.0,-2.0,0.5"]
+    assert not os.path.exists(path + ".tmp")
+    loaded = cnc_position.PositionTracker(path)
+    assert (loaded.get(), loaded.home) == ([10, 20.5, -3], [-1, -2, 0.5])
+
+
+def test_unchanged_position_is_not_saved_again(tmp_path, monkeypatch):
+    path = str(tmp_path / "position.csv")
+    tracker = cnc_position.PositionTracker(path)
+    tracker.set(1, 2, 3)
+    tracker.save()
+    replaced = []
+    monkeypatch.setattr(cnc_position.os, "replace", lambda *args: replaced.append(args))
+    tracker.save()
+    tracker.set(1, 2, 3)
+    tracker.save()
+    assert replaced == []
+
+
+@pytest.mark.parametrize("failing", ["fsync", "replace"])
+def test_save_cut_short_keeps_the_last_position(tmp_path, monkeypatch, failing):
+    path = str(tmp_path / "position.csv")
+    tracker = cnc_position.PositionTracker(path)
+    tracker.set(1, 2, 3)
+    tracker.save()
+
+    def power_cut(*args):
+        raise OSError("power cut")
+
+    monkeypatch.setattr(cnc_position.os, failing, power_cut)
+    tracker.set(4, 5, 6)
+    with pytest.raises(OSError):
+        tracker.save()
+    assert saved_rows(path) == ["1.0,2.0,3.0"]
+    assert cnc_position.PositionTracker(path).get() == [1, 2, 3]
+    monkeypatch.undo()
+    tracker.save() #saved once the disk is back, since it was not saved before
+    assert saved_rows(path) == ["4.0,5.0,6.0"]
+
+
+def test_torn_temporary_file_is_never_read(tmp_path):
+    path = str(tmp_path / "position.csv")
+    tracker = cnc_position.PositionTracker(path)
+    tracker.set(1, 2, 3)
+    tracker.save()
+    with open(path + ".tmp", 'w') as file: #what a save stopped part way through leaves behind
+        file.write("7.0,8")
+    assert cnc_position.PositionTracker(path).get() == [1, 2, 3]
+    tracker.set(4, 5, 6)
+    tracker.save() #written over
+    assert saved_rows(path) == ["4.0,5.0,6.0"]
+    assert not os.path.exists(path + ".tmp")
+
+
+def test_sync_finds_home_and_corrects_an_out_of_date_position(tmp_path):
+    path = str(tmp_path / "position.csv")
+    with grbl_simulator.GRBLSimulator(SPEED) as simulator:
+        tracker = cnc_position.PositionTracker(path)
+        tracker.set(5, 0, -1)
+        assert tracker.sync(simulator.port) == [5, 0, -1] #grbl reset, so the saved position is where it is
+        assert tracker.home == [-5, 0, 1]
+        assert saved_rows(path) == ["5.0,0.0,-1.0", "-5.0,0.0,1.0"]
+        with grbl.connection(simulator.port) as ser: #moved without the tracker being told
+            ser.write(b"G0 X1\n")
+            grbl.wait_for_idle(ser, {0: 1})
+        assert tracker.sync(simulator.port) == [6, 0, -1]
+        assert saved_rows(path)[0] == "6.0,0.0,-1.0"
+
+
+@pytest.mark.parametrize("reset,position,home", [(True, [2, 0, 0], [-2, 0, 0]), (False, [3, 0, 0], [-3, 0, 0])])
+def test_sync_after_reconnecting(tmp_path, reset, position, home): #the position of an earlier run, with home 3 mm from where
+    #grbl is now. grbl only still knows where home is if it did not reset when the port was opened
+    path = str(tmp_path / "position.csv")
+    with open(path, 'w') as file:
+        file.write("2.0,0.0,0.0\n-3.0,0.0,0.0\n")
+    with grbl_simulator.GRBLSimulator(SPEED, reset_on_open=reset) as simulator:
+        tracker = cnc_position.PositionTracker(path)
+        assert tracker.sync(simulator.port) == position
+        assert tracker.home == home
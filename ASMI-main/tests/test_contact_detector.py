@@ -0,0 +1,95 @@
+"""
+These are tests which check that each contact detector ignores noise with the indenter in free air, and finds where
+contact started when the force steps or ramps down, going through the measurements the way it does while a well is
+indented.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import contact_detector
+
+AVG = 0.05  # force in N measured with nothing touching the indenter
+STDEV = 0.005
+START = 100  # measurement contact starts at
+DETECTORS = ["threshold", "cusum", "slope"]
+
+
+def noise(number, seed=0):
+    return AVG + np.random.default_rng(seed).normal(0, STDEV, number)
+
+
+def step(depth=5, number=50): #the force falls by depth standard deviations at START
+    return np.concatenate([np.full(START, AVG), np.full(number, AVG - depth * STDEV)])
+
+
+def ramp(rate=0.6, number=50): #the force falls by rate standard deviations every measurement from START on
+    return np.concatenate([np.full(START, AVG), AVG - rate * STDEV * np.arange(1, number + 1)])
+
+
+def first_contact(method, values, counts=None): #measurement the detector first reports contact at, and where it says
+    #contact started then
+    detector = contact_detector.make_detector(method, AVG, STDEV)
+    for i in range(0, len(values)):
+        if detector.update(values[i], 1 if counts is None else counts[i]):
+            return i, detector.index
+    return None, None
+
+
+@pytest.mark.parametrize("method", ["cusum", "slope"])
+@pytest.mark.parametrize("seed", range(0, 5))
+def test_noise_is_not_contact(method, seed):
+    assert first_contact(method, noise(1000, seed)) == (None, None)
+    assert contact_detector.find_contact(method, AVG, STDEV, noise(1000, seed)) == (None, pytest.approx(0, abs=1))
+
+
+def test_threshold_forgets_a_single_spike():
+    values = np.full(20, AVG)
+    values[5] = AVG - 3 * STDEV
+    detector = contact_detector.make_detector("threshold", AVG, STDEV)
+    contact = [detector.update(value) for value in values]
+    assert contact.index(True) == 5 and contact.count(True) == 1
+    assert detector.index is None
+
+
+@pytest.mark.parametrize("method,found,index", [("threshold", 100, 100), ("cusum", 102, 100), ("slope", 101, 100)])
+def test_step(method, found, index):
+    assert first_contact(method, step()) == (found, index)
+    assert contact_detector.find_contact(method, AVG, STDEV, step())[0] == index
+
+
+@pytest.mark.parametrize("method,found,index", [("threshold", 103, 103), ("cusum", 106, 100), ("slope", 105, 100)])
+def test_ramp(method, found, index): #threshold only sees contact once the force is 2 standard deviations below
+    assert first_contact(method, ramp()) == (found, index)
+
+
+@pytest.mark.parametrize("method", ["cusum", "slope"])
+@pytest.mark.parametrize("seed", range(0, 5))
+def test_noisy_ramp(method, seed):
+    values = ramp() + np.random.default_rng(seed).normal(0, STDEV, START + 50)
+    found, index = first_contact(method, values)
+    assert START <= found <= START + 15
+    assert abs(index - START) <= 6 #noise can start the sum of cusum a few measurements early
+    assert contact_detector.find_contact(method, AVG, STDEV, values)[0] is not None
+
+
+@pytest.mark.parametrize("method", ["threshold", "slope"])
+def test_averaged_measurements_are_less_noisy(method): #a force 1.5 standard deviations below the baseline is noise
+    #for a single measurement, but not for the mean of 9
+    values = step(depth=1.5)
+    assert first_contact(method, values)[0] is None
+    assert first_contact(method, values, [9] * len(values))[1] == START
+
+
+def test_cusum_adds_up_small_forces(): #which threshold and slope miss
+    assert first_contact("cusum", step(depth=1.5)) == (START + 10, START)
+
+
+def test_unknown_detector():
+    with pytest.raises(ValueError):
+        contact_detector.make_detector("guess", AVG, STDEV)
@@ -0,0 +1,88 @@
+"""
+These are tests which check that a well indented in continuous mode, where the force sensor is read many times for every
+0.02 mm the cnc moves, is analyzed the same as the same well indented one step at a time.
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("ASMI_SIMULATE", "1")
+os.environ.setdefault("ASMI_GRBL_PORT", "loop://")  # measure does not start a grbl simulator when a port is given
+os.environ.setdefault("ASMI_DIR", os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import indentation
+import measure
+
+AVG = 0.05  # force in N measured with nothing touching the indenter
+STDEV = 0.005
+Z_START = -1  # starting height of measure
+CONTACT = -3.5  # height the indenter touches the sample at
+BOTTOM = -4.5
+SPEED = 0.1  # mm per second the cnc moves down in continuous mode
+SAMPLE_PERIOD = 0.01  # seconds between force measurements
+POLL_INTERVAL = 0.05  # seconds between positions reported by grbl
+
+
+def sensor_value(z, noise): #force the sensor measures at height z, lower when the indenter pushes on the sample
+    return AVG - 20 * max(CONTACT - z, 0) ** 1.5 + noise
+
+
+class Raw: #stands in for the data file
+    def __init__(self):
+        self.rows = [["A1", str(AVG), str(STDEV)]]
+
+    def write_rows(self, rows):
+        self.rows.extend(rows)
+
+
+def step_rows(): #rows measure saves in step mode, one measurement for every 0.02 mm
+    rng = np.random.default_rng(1)
+    raw = Raw()
+    z = Z_START
+    while z > BOTTOM:
+        z = round(z - 0.02, 2)
+        value = sensor_value(z, rng.normal(0, STDEV))
+        raw.write_rows([["A1", str(z), str(value * -1), str(value * -1), "0.0", "1"]])
+    return raw.rows
+
+
+def continuous_rows(): #rows continuous_indentation saves for the same well
+    rng = np.random.default_rng(2)
+    duration = (Z_START - BOTTOM) / SPEED
+    times = list(np.arange(0, duration, SAMPLE_PERIOD))
+    position_times = list(np.arange(0, duration + POLL_INTERVAL, POLL_INTERVAL))
+    positions = [-SPEED * t for t in position_times]  # grbl reports z from 0 at the start of the well
+    values = [sensor_value(Z_START - SPEED * t, rng.normal(0, STDEV)) for t in times]
+    watchdog = SimpleNamespace(times=times, values=values, saved=[True] * len(times))
+    raw = Raw()
+    indentation.write_rows(raw, "A1", watchdog, position_times, positions, 0, Z_START)
+    return raw.rows, len(times)
+
+
+def test_continuous_rows_are_one_per_step():
+    rows, measurements = continuous_rows()
+    depths = [float(row[1]) for row in rows[1:]]
+    assert len(depths) == len(set(depths))
+    assert np.allclose(np.diff(depths), -0.02)
+    assert sum(int(row[5]) for row in rows[1:]) == measurements
+    assert all(len(row) == 6 for row in rows[1:])
+
+
+def test_continuous_mode_matches_step_mode():
+    step = measure.collect_run_data(step_rows(), "A1", False)
+    continuous = measure.collect_run_data(continuous_rows()[0], "A1", False)
+    assert step != [] and continuous != []
+    assert abs(len(continuous) - len(step)) <= 2
+    assert abs(measure.approximate_height(continuous) - measure.approximate_height(step)) <= 0.04
+    assert abs(max(row[0] for row in continuous) - max(row[0] for row in step)) <= 0.04
+    assert all(row[2] < STDEV for row in continuous) #averaged measurements are less noisy
+
+
+def test_approximate_height_does_not_depend_on_row_spacing():
+    coarse = [[round(0.02 * (k - 50), 2), 0.0] for k in range(0, 100)]
+    fine = [[round(0.005 * (k - 200), 3), 0.0] for k in range(0, 400)]
+    assert abs(measure.approximate_height(coarse) - measure.approximate_height(fine)) < 1e-9
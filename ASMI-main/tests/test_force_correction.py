@@ -0,0 +1,191 @@
+"""
+These are tests which check that the correction tables in force_correction give the same b and c as the ladder of ifs
+the measure programs and analysis used to have, on both sides of every band edge, and that interpolating them only
+changes b and c away from the middles of the bands.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import force_correction
+
+P_RATIOS = [0.3, 0.325, 0.35, 0.375, 0.4, 0.425, 0.45, 0.475, 0.5]  # every band edge and a value inside every band
+HEIGHTS = [1, 3, 3.5, 4, 4.5, 5, 5.5, 6, 6.5, 7, 7.5, 8, 8.5, 9, 9.5, 10, 15]
+EPSILON = 1e-9  # just below an edge
+
+
+def ladder(p_ratio, approx_height): #correct_force of measure.py, measure_over_time.py, custom_measure.py and
+    #analysis.py before the tables, which all had the same ladder
+    if p_ratio < 0.325:
+        if approx_height >= 9.5:
+            b = 0.13
+            c = 1.24
+        elif approx_height >= 8.5 and approx_height < 9.5:
+            b = 0.131
+            c = 1.24
+        elif approx_height >= 7.5 and approx_height < 8.5:
+            b = 0.133
+            c = 1.25
+        elif approx_height >= 6.5 and approx_height < 7.5:
+            b = 0.132
+            c = 1.24
+        elif approx_height >= 5.5 and approx_height < 6.5:
+            b = 0.132
+            c = 1.24
+        elif approx_height >= 4.5 and approx_height < 5.5:
+            b = 0.139
+            c = 1.27
+        elif approx_height >= 3.5 and approx_height < 4.5:
+            b = 0.149
+            c = 1.3
+        else:
+            b = 0.162
+            c = 1.38
+    elif p_ratio >= 0.325 and p_ratio < 0.375:
+        if approx_height >= 9.5:
+            b = 0.132
+            c = 1.25
+        elif approx_height >= 8.5 and approx_height < 9.5:
+            b = 0.132
+            c = 1.25
+        elif approx_height >= 7.5 and approx_height < 8.5:
+            b = 0.134
+            c = 1.25
+        elif approx_height >= 6.5 and approx_height < 7.5:
+            b = 0.136
+            c = 1.26
+        elif approx_height >= 5.5 and approx_height < 6.5:
+            b = 0.126
+            c = 1.25
+        elif approx_height >= 4.5 and approx_height < 5.5:
+            b = 0.133
+            c = 1.27
+        elif approx_height >= 3.5 and approx_height < 4.5:
+            b = 0.144
+            c = 1.32
+        else:
+            b = 0.169
+            c = 1.42
+    elif p_ratio >= 0.375 and p_ratio < 0.425:
+        if approx_height >= 9.5:
+            b = 0.181
+            c = 1.33
+        elif approx_height >= 8.5 and approx_height < 9.5:
+            b = 0.182
+            c = 1.34
+        elif approx_height >= 7.5 and approx_height < 8.5:
+            b = 0.183
+            c = 1.34
+        elif approx_height >= 6.5 and approx_height < 7.5:
+            b = 0.183
+            c = 1.34
+        elif approx_height >= 5.5 and approx_height < 6.5:
+            b = 0.194
+            c = 1.38
+        elif approx_height >= 4.5 and approx_height < 5.5:
+            b = 0.198
+            c = 1.4
+        elif approx_height >= 3.5 and approx_height < 4.5:
+            b = 0.203
+            c = 1.44
+        else:
+            b = 0.176
+            c = 1.46
+    elif p_ratio >= 0.425 and p_ratio < 0.475:
+        if approx_height >= 9.5:
+            b = 0.156
+            c = 1.35
+        elif approx_height >= 8.5 and approx_height < 9.5:
+            b = 0.152
+            c = 1.34
+        elif approx_height >= 7.5 and approx_height < 8.5:
+            b = 0.156
+            c = 1.35
+        elif approx_height >= 6.5 and approx_height < 7.5:
+            b = 0.161
+            c = 1.37
+        elif approx_height >= 5.5 and approx_height < 6.5:
+            b = 0.153
+            c = 1.37
+        elif approx_height >= 4.5 and approx_height < 5.5:
+            b = 0.166
+            c = 1.42
+        elif approx_height >= 3.5 and approx_height < 4.5:
+            b = 0.179
+            c = 1.47
+        else:
+            b = 0.205
+            c = 1.59
+    else:
+        if approx_height >= 9.5:
+            b = 0.203
+            c = 1.58
+        elif approx_height >= 8.5 and approx_height < 9.5:
+            b = 0.207
+            c = 1.6
+        elif approx_height >= 7.5 and approx_height < 8.5:
+            b = 0.212
+            c = 1.62
+        elif approx_height >= 6.5 and approx_height < 7.5:
+            b = 0.217
+            c = 1.65
+        elif approx_height >= 5.5 and approx_height < 6.5:
+            b = 0.21
+            c = 1.64
+        elif approx_height >= 4.5 and approx_height < 5.5:
+            b = 0.22
+            c = 1.68
+        elif approx_height >= 3.5 and approx_height < 4.5:
+            b = 0.17
+            c = 1.58
+        else:
+            b = 0.182
+            c = 1.64
+    return b, c
+
+
+@pytest.mark.parametrize("p_ratio", P_RATIOS)
+@pytest.mark.parametrize("height", HEIGHTS)
+def test_tables_match_the_ladder(p_ratio, height):
+    for p, h in [(p_ratio, height), (p_ratio - EPSILON, height), (p_ratio, height - EPSILON),
+                 (p_ratio - EPSILON, height - EPSILON)]:
+        assert force_correction.factors(p, h) == ladder(p, h)
+
+
+def test_every_table_entry_is_used():
+    found = {ladder(p, h) for p in P_RATIOS for h in HEIGHTS}
+    b_table, c_table = force_correction.TABLES["standard"]
+    assert found == {(float(b), float(c)) for b, c in zip(b_table.ravel(), c_table.ravel())}
+
+
+def test_custom_plate(): #custom_measure divided by 1.5364 * depth^0.1113 whatever the sample was
+    for p in P_RATIOS:
+        for h in HEIGHTS:
+            assert force_correction.factors(p, h, "custom") == (0.1113, 1.5364)
+            assert force_correction.factors(p, h, "custom", interpolate=True) == pytest.approx((0.1113, 1.5364))
+
+
+def test_correct():
+    depths = np.array([0.25, 0.3, 0.5])
+    forces = np.array([0.5, 0.7, 1.5])
+    b, c = ladder(0.45, 5)
+    assert force_correction.correct(depths, forces, 0.45, 5) == pytest.approx(forces / (c * depths ** b), rel=1e-12)
+
+
+@pytest.mark.parametrize("p_ratio", force_correction.P_RATIO_MIDDLES)
+@pytest.mark.parametrize("height", force_correction.HEIGHT_MIDDLES)
+def test_interpolation_matches_the_middles_of_the_bands(p_ratio, height):
+    assert force_correction.factors(p_ratio, height, interpolate=True) == pytest.approx(ladder(p_ratio, height))
+
+
+def test_interpolation_is_continuous_across_edges():
+    for p in P_RATIOS:
+        for h in force_correction.HEIGHT_EDGES:
+            below = force_correction.factors(p, h - EPSILON, interpolate=True)
+            above = force_correction.factors(p, h + EPSILON, interpolate=True)
+            assert below == pytest.approx(above, abs=1e-6)
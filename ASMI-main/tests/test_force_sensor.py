@@ -0,0 +1,165 @@
+"""
+These are tests which check the ring buffer force_sensor keeps the measurements of the force sensor in, filling it
+directly instead of streaming a sensor, how the measurements made at each step are summarized and the baseline worked
+out from them.
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import force_sensor
+
+CAPACITY = 8
+
+
+def filled(number, capacity=CAPACITY): #service holding number measurements, the k-th made at time k with value k
+    service = force_sensor.SensorService(None, capacity=capacity)
+    for k in range(0, number):
+        service.add(float(k), float(k))
+    return service
+
+
+def test_since_before_the_buffer_is_full():
+    service = filled(5)
+    times, values, count = service.since(2)
+    assert count == 5
+    assert list(values) == [2, 3, 4]
+    assert list(times) == [2, 3, 4]
+    assert len(service.since(5)[1]) == 0
+
+
+@pytest.mark.parametrize("number", [CAPACITY, CAPACITY + 1, 2 * CAPACITY - 1, 3 * CAPACITY + 3])
+def test_since_wraps_around(number):
+    service = filled(number)
+    values = service.since(number - 4)[1]
+    assert list(values) == list(range(number - 4, number)) #in order, even where the buffer wrapped around
+    assert np.shares_memory(values, service.values) #a view, not a copy
+    assert service.latest() == number - 1
+
+
+def test_since_after_overflow_starts_at_the_oldest_kept():
+    service = filled(3 * CAPACITY + 3)
+    times, values, count = service.since(0) #the first ones have been overwritten
+    assert count == 3 * CAPACITY + 3
+    assert list(values) == list(range(2 * CAPACITY + 3, 3 * CAPACITY + 3))
+    assert list(service.since(count - CAPACITY - 5)[1]) == list(values)
+
+
+def test_recent_is_a_copy_of_the_last_measurements():
+    service = filled(2 * CAPACITY + 3)
+    recent = service.recent(5)
+    assert list(recent) == list(range(2 * CAPACITY - 2, 2 * CAPACITY + 3))
+    assert not np.shares_memory(recent, service.values)
+    service.add(100.0, 100.0)
+    assert recent[-1] == 2 * CAPACITY + 2 #not overwritten by newer measurements
+
+
+def test_window_is_between_two_times():
+    service = filled(CAPACITY + 4)
+    times, values = service.window(6, 9.5)
+    assert list(values) == [6, 7, 8, 9]
+    assert list(service.window(0, 3)[1]) == [] #overwritten
+
+
+def test_average_of_the_last_seconds():
+    service = force_sensor.SensorService(None, capacity=CAPACITY)
+    assert service.average(1) is None
+    now = time.monotonic()
+    for k in range(0, 4):
+        service.add(now - 10 + k, 100.0) #too long ago
+    for k in range(0, 4):
+        service.add(now - 0.4 + 0.1 * k, float(k))
+    assert service.average(1) == pytest.approx(1.5)
+
+
+def test_wait_returns_right_away_when_there_are_measurements():
+    service = filled(3)
+    assert list(service.wait(1, timeout=0)[1]) == [1, 2]
+
+
+def test_wait_raises_when_the_sensor_stopped():
+    service = filled(3)
+    service.error = OSError("unplugged")
+    with pytest.raises(force_sensor.ForceSensorError):
+        service.wait(3, timeout=0)
+
+
+def test_next_values_times_out():
+    service = filled(3)
+    with pytest.raises(force_sensor.ForceSensorError):
+        service.next_values(1, timeout=0.05)
+
+
+def test_read_hands_out_every_measurement_once(): #the service used in place of a GoDirect device
+    service = filled(3)
+    service.start()
+    service.add(3.0, 3.0)
+    service.add(4.0, 4.0)
+    assert service.read()
+    channel = service.get_enabled_sensors()[0]
+    assert channel.values == [3, 4]
+
+
+def test_step_statistics():
+    values = [0.1, 0.4, 0.2, 0.3, 1.0]
+    mean, median, spread, count = force_sensor.step_statistics(values)
+    assert (mean, median, spread, count) == pytest.approx((np.mean(values), 0.3, np.std(values), 5))
+    assert force_sensor.step_statistics(np.array([2.0])) == (2.0, 2.0, 0.0, 1)
+
+
+def test_step_without_measurements_is_an_error():
+    with pytest.raises(force_sensor.ForceSensorError):
+        force_sensor.step_statistics([])
+
+
+def test_baseline_matches_numpy():
+    rng = np.random.default_rng(4)
+    values = rng.normal(0.05, 0.005, 103)
+    baseline = force_sensor.Baseline()
+    assert baseline.stdev() == 0.0
+    for k in range(0, len(values), 10): #in groups, like the measurements of every step
+        baseline.add(values[k:k + 10])
+    baseline.add([])
+    assert baseline.count == 103
+    assert baseline.mean == pytest.approx(np.mean(values), rel=1e-12)
+    assert baseline.stdev() == pytest.approx(np.std(values, ddof=1), rel=1e-12)
+
+
+def test_baseline_from_statistics_matches_numpy():
+    rng = np.random.default_rng(5)
+    groups = [rng.normal(0.05, 0.005, n) for n in (1, 3, 2, 7)]
+    baseline = force_sensor.Baseline()
+    for group in groups: #the way the free air steps of a well refine it
+        mean, median, spread, count = force_sensor.step_statistics(group)
+        baseline.add_statistics(count, mean, spread)
+    values = np.concatenate(groups)
+    assert baseline.mean == pytest.approx(np.mean(values), rel=1e-12)
+    assert baseline.stdev() == pytest.approx(np.std(values, ddof=1), rel=1e-12)
+
+
+def test_windowed_baseline():
+    rng = np.random.default_rng(6)
+    values = rng.normal(0.05, 0.005, 200)
+    baseline = force_sensor.Baseline(window=100)
+    for k in range(0, 100, 10): #the same as without a window until it holds more than window measurements
+        baseline.add(values[k:k + 10])
+    assert baseline.mean == pytest.approx(np.mean(values[0:100]), rel=1e-12)
+    assert baseline.stdev() == pytest.approx(np.std(values[0:100], ddof=1), rel=1e-12)
+    for k in range(0, 2000, 10): #then follows a drift that a baseline without a window averages away
+        baseline.add(values[k % 200:k % 200 + 10] + 0.01)
+    assert baseline.count <= 110
+    assert baseline.mean == pytest.approx(0.06, abs=0.002)
+    assert baseline.stdev() == pytest.approx(0.005, rel=0.2)
+
+
+def test_settled_only_uses_measurements_after_start():
+    service = filled(CAPACITY + 4)
+    assert list(service.settled(8, 3)) == [8, 9, 10, 11]
+    with pytest.raises(force_sensor.ForceSensorError):
+        service.settled(8, 5, timeout=0.05)
@@ -0,0 +1,254 @@
+"""
+These are tests which run the connection to grbl against grbl_simulator, so they need no cnc plugged in.
+"""
+
+import os
+import sys
+import time
+
+import pytest
+import serial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import grbl
+import grbl_simulator
+
+SPEED = 20  # times faster than the real cnc the simulated cnc moves
+
+
+@pytest.fixture(autouse=True)
+def quick_wake_up(monkeypatch): #the simulator is awake as soon as the port is opened
+    monkeypatch.setattr(grbl, "WAKE_UP_TIME", 0.2)
+    monkeypatch.setattr(grbl, "work_offset", None)
+
+
+def test_open_zeroes_when_grbl_did_not_reset():
+    with grbl_simulator.GRBLSimulator(SPEED, reset_on_open=False) as simulator:
+        session = grbl.GRBLSession(simulator.port)
+        ser = session.open()
+        ser.write(b"G0 X2\n")
+        grbl.wait_for_idle(ser, {0: 2})
+        session.close()
+        ser = session.open() #grbl did not reset, so it is still at X2 unless the session zeroes it
+        assert not session.was_reset
+        assert grbl.work_position(grbl.query_status(ser)) == pytest.approx([0, 0, 0], abs=grbl.POSITION_TOLERANCE)
+        assert simulator.machine_position()[0] == pytest.approx(2, abs=grbl.POSITION_TOLERANCE)
+        session.close()
+
+
+def wait_for_state(ser, state, substate=0): #ask for the status until grbl is in state
+    status = grbl.query_status(ser)
+    while status['state'] != state or status['substate'] != substate:
+        status = grbl.query_status(ser)
+    return status
+
+
+def test_feed_hold_and_soft_reset_clear_g92(): #what cancel_motion has to make up for
+    with grbl_simulator.GRBLSimulator(SPEED) as simulator:
+        session = grbl.GRBLSession(simulator.port)
+        ser = session.open()
+        ser.write(b"G0 X1\n")
+        grbl.wait_for_idle(ser, {0: 1})
+        ser = session.open() #reused, so zeroed with G92 at X1
+        assert grbl.work_position(grbl.query_status(ser)) == pytest.approx([0, 0, 0], abs=grbl.POSITION_TOLERANCE)
+        ser.write(b"G91 G1 X5 F60\n")
+        wait_for_state(ser, 'Run')
+        time.sleep(0.05)
+        grbl.feed_hold(ser)
+        wait_for_state(ser, 'Hold') #Hold:0, stopped
+        ser.write(grbl.SOFT_RESET)
+        time.sleep(0.1)
+        status = grbl.query_status(ser)
+        assert status['state'] == 'Idle' #held to a stop before the reset, so no steps were lost
+        assert 1 < grbl.machine_position(status)[0] < 6
+        assert grbl.work_position(status) == pytest.approx(grbl.machine_position(status)) #G92 is gone
+        assert simulator.absolute #and so is G91
+        ser = session.open() #the next movement zeroes again
+        assert grbl.work_position(grbl.query_status(ser)) == pytest.approx([0, 0, 0], abs=grbl.POSITION_TOLERANCE)
+        session.close()
+
+
+def test_cancel_motion_keeps_the_work_position():
+    with grbl_simulator.GRBLSimulator(SPEED) as simulator:
+        session = grbl.GRBLSession(simulator.port)
+        ser = session.open()
+        ser.write(b"G0 X1\n")
+        grbl.wait_for_idle(ser, {0: 1})
+        ser = session.open() #zeroed with G92 at X1
+        ser.write(b"G1 X5 F60\n")
+        wait_for_state(ser, 'Run')
+        time.sleep(0.05)
+        grbl.cancel_motion(ser)
+        status = grbl.query_status(ser)
+        assert status['state'] == 'Idle'
+        assert grbl.work_position(status)[0] == pytest.approx(grbl.machine_position(status)[0] - 1)
+        ser.write(b"G1 X0 F300\n") #the same coordinates as before the reset
+        status = grbl.wait_for_idle(ser, {0: 0})
+        assert grbl.machine_position(status) == pytest.approx([1, 0, 0], abs=grbl.POSITION_TOLERANCE)
+        session.close()
+
+
+def steps(count, feed=30): #a program moving down 0.02 mm at a time, the way the measure programs indent a well
+    return [f"G1 Z{round(-0.02 * k, 2)} F{feed}" for k in range(1, count + 1)]
+
+
+def test_stream_program_never_overfills_the_receive_buffer():
+    with grbl_simulator.GRBLSimulator(SPEED) as simulator:
+        session = grbl.GRBLSession(simulator.port)
+        ser = session.open()
+        gcode = ["; comment lines are not sent"] + steps(100)
+        lines = simulator.lines  # the wake up sends empty lines too
+        acked, errors = grbl.stream_program(ser, gcode)
+        assert (acked, errors) == (100, [])
+        assert simulator.overflows == 0
+        assert grbl.RX_BUFFER_SIZE - 20 < simulator.most_buffered <= grbl.RX_BUFFER_SIZE #the buffer was kept full
+        assert simulator.lines - lines == 100
+        time.sleep(0.1)
+        assert b'ok' not in ser.read(ser.in_waiting) #every ok was read by stream_program
+        assert grbl.work_position(grbl.query_status(ser))[2] == pytest.approx(-2)
+        session.close()
+
+
+def test_stream_program_reports_errors_and_status():
+    with grbl_simulator.GRBLSimulator(SPEED) as simulator:
+        session = grbl.GRBLSession(simulator.port)
+        ser = session.open()
+        statuses = []
+        acked, errors = grbl.stream_program(ser, steps(5) + ["G1 Z-1 Q2"] + steps(10)[5:], on_status=statuses.append)
+        assert acked == 11
+        assert errors == [("G1 Z-1 Q2", "error:20")]
+        assert statuses[-1]['state'] == 'Idle'
+        assert grbl.work_position(statuses[-1])[2] == pytest.approx(-0.2)
+        session.close()
+
+
+def test_stream_program_stops_when_asked():
+    with grbl_simulator.GRBLSimulator(SPEED) as simulator:
+        session = grbl.GRBLSession(simulator.port)
+        ser = session.open()
+        statuses = []
+        acked, errors = grbl.stream_program(ser, steps(100), on_status=statuses.append,
+                                            should_stop=lambda: len(statuses) >= 3)
+        assert acked < 100
+        grbl.cancel_motion(ser) #throw away the rest of the program
+        status = grbl.query_status(ser)
+        assert status['state'] == 'Idle'
+        time.sleep(0.1)
+        assert grbl.work_position(grbl.query_status(ser)) == pytest.approx(grbl.work_position(status)) #nothing left to run
+        assert grbl.work_position(status)[2] > -2
+        session.close()
+
+
+def test_stream_program_raises_on_alarm():
+    with grbl_simulator.GRBLSimulator(SPEED) as simulator:
+        session = grbl.GRBLSession(simulator.port)
+        ser = session.open()
+
+        def reset_while_moving(status): #a reset while moving loses steps, so grbl goes into alarm
+            if status['state'] == 'Run':
+                ser.write(grbl.SOFT_RESET)
+
+        with pytest.raises(grbl.GRBLAlarmError):
+            grbl.stream_program(ser, steps(100), on_status=reset_while_moving)
+        session.close()
+
+
+def test_wait_for_idle_waits_for_the_target():
+    with grbl_simulator.GRBLSimulator(SPEED) as simulator:
+        session = grbl.GRBLSession(simulator.port)
+        ser = session.open()
+        ser.write(b"G1 Z-1 F300\n")
+        status = grbl.wait_for_idle(ser, {2: -1})
+        assert status['state'] == 'Idle'
+        assert simulator.machine_position()[2] == pytest.approx(-1, abs=grbl.POSITION_TOLERANCE)
+        ser.write(b"G1 Z0 F300\n")
+        status = grbl.wait_for_idle(ser) #without a target it waits for two idle reports in a row
+        assert grbl.work_position(status)[2] == pytest.approx(0, abs=grbl.POSITION_TOLERANCE)
+        session.close()
+
+
+def test_wait_for_idle_times_out():
+    with grbl_simulator.GRBLSimulator(SPEED) as simulator:
+        session = grbl.GRBLSession(simulator.port)
+        ser = session.open()
+        ser.write(b"G1 Z-10 F6\n") #takes 100 s, 5 s at the speed of the simulator
+        with pytest.raises(grbl.GRBLTimeoutError):
+            grbl.wait_for_idle(ser, {2: -10}, timeout=0.3)
+        grbl.cancel_motion(ser)
+        session.close()
+
+
+def test_wait_for_idle_raises_on_errors_and_alarms():
+    with grbl_simulator.GRBLSimulator(SPEED) as simulator:
+        session = grbl.GRBLSession(simulator.port)
+        ser = session.open()
+        ser.write(b"G1 Z-1 Q2\n")
+        with pytest.raises(grbl.GRBLError):
+            grbl.wait_for_idle(ser, {2: -1})
+        ser.write(b"G1 Z-10 F60\n")
+        wait_for_state(ser, 'Run')
+        ser.write(grbl.SOFT_RESET) #without a feed hold first
+        with pytest.raises(grbl.GRBLAlarmError):
+            grbl.wait_for_idle(ser, {2: -10}, ack=False)
+        session.close()
+
+
+def test_silent_port_raises_connection_errors(monkeypatch): #loop:// sends back what is written, which is never an answer
+    monkeypatch.setattr(grbl, "RESPONSE_TIMEOUT", 0.2)
+    ser = serial.serial_for_url("loop://", timeout=0.1)
+    with pytest.raises(grbl.GRBLConnectionError):
+        grbl.wait_for_idle(ser, {2: -1})
+    with pytest.raises(grbl.GRBLConnectionError):
+        grbl.query_status(ser, timeout=0.2)
+    with pytest.raises(grbl.GRBLConnectionError):
+        grbl.set_work_position(ser, [0, 0, 0])
+    ser.close()
+
+
+def test_cancel_jog_keeps_the_work_position():
+    with grbl_simulator.GRBLSimulator(SPEED) as simulator:
+        session = grbl.GRBLSession(simulator.port)
+        ser = session.open()
+        ser.write(b"G0 Z-1\n")
+        grbl.wait_for_idle(ser, {2: -1})
+        ser = session.open() #zeroed with G92 at Z-1
+        ser.write(str.encode(grbl.jog_line("G1 Z-10 F60") + "\n"))
+        wait_for_state(ser, 'Jog')
+        time.sleep(0.05)
+        status = grbl.cancel_jog(ser)
+        assert status['state'] == 'Idle'
+        assert -9 < grbl.machine_position(status)[2] < -1
+        assert grbl.work_position(status)[2] == pytest.approx(grbl.machine_position(status)[2] + 1) #G92 is kept
+        time.sleep(0.1)
+        assert grbl.query_status(ser)['state'] == 'Idle' #the rest of the jog was thrown away
+        session.close()
+
+
+def test_wait_stats_summary(capsys):
+    stats = grbl.WaitStats()
+    assert stats.summary() == {'count': 0}
+    stats.report()
+    assert capsys.readouterr().out == "" #nothing to report
+    stats.record(0.5, 10)
+    stats.record(1.5, 30)
+    assert stats.summary() == {'count': 2, 'total': 2.0, 'mean': 1.0, 'min': 0.5, 'max': 1.5, 'polls': 40}
+    stats.report()
+    assert "2 movements for a total of 2.0 seconds, 1000 ms on average and 1500 ms at most" in capsys.readouterr().out
+
+
+def test_wait_for_idle_polls_at_most_once_every_poll_interval(monkeypatch):
+    stats = grbl.WaitStats()
+    monkeypatch.setattr(grbl, "wait_stats", stats)
+    with grbl_simulator.GRBLSimulator(SPEED) as simulator:
+        session = grbl.GRBLSession(simulator.port)
+        ser = session.open()
+        ser.write(b"G1 Z-2 F60\n") #2 s, 0.1 s at the speed of the simulator
+        grbl.wait_for_idle(ser, {2: -2}, poll_interval=0.02)
+        ser.write(b"G1 Z0 F60\n")
+        grbl.wait_for_idle(ser, {2: 0}, poll_interval=0.05)
+        session.close()
+    assert len(stats.calls) == 2
+    for (seconds, polls), interval in zip(stats.calls, [0.02, 0.05]):
+        assert seconds >= 0.1
+        assert 1 <= polls <= seconds / interval + 1
@@ -0,0 +1,110 @@
+"""
+These are tests which check that hertz_fit finds A and the offset of the depths that made a Hertzian force curve, and
+that fitting the depths it shifted again does not move them, which the refit loop the measure programs used to have did
+not always get to. fit_plate has to find the same fit for every well as fit_hertz.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analysis
+import hertz_fit
+
+P_RATIO = 0.45
+STDEV = 0.005  # noise of the force sensor in N
+RESULTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Results")
+
+
+def constant_correction(p_ratio, approx_height):
+    return 0.2, 1.1
+
+
+def constant_height(run_array):
+    return 5.0
+
+
+def hertz_rows(A, offset, correction=constant_correction, height=constant_height, noise=0.0, seed=0, number=40):
+    #run_array of a well contact started offset mm below where it was detected at, with the forces corrected the way
+    #correct_force undoes
+    depths = np.round(np.arange(0, number) * 0.02, 2)
+    shifted = depths - offset
+    b, c = correction(P_RATIO, height(shifted[:, None]))
+    touching = np.clip(shifted, 0, None)
+    forces = c * touching ** b * A * touching ** 1.5 + np.random.default_rng(seed).normal(0, noise, number)
+    return [[depths[i], forces[i], STDEV] for i in range(0, number)]
+
+
+@pytest.mark.parametrize("A,offset", [(20.0, 0.0), (20.0, 0.037), (5.0, -0.05), (60.0, 0.13)])
+def test_recovers_A_and_offset(A, offset):
+    fit = hertz_fit.fit_hertz(hertz_rows(A, offset), P_RATIO, constant_correction, constant_height)
+    assert fit.A == pytest.approx(A, rel=1e-6)
+    assert fit.offset == pytest.approx(offset, abs=1e-6)
+    assert np.all((fit.depths >= hertz_fit.WINDOW[0]) & (fit.depths <= hertz_fit.WINDOW[1]))
+    assert fit.forces == pytest.approx(A * fit.depths ** 1.5, rel=1e-6)
+
+
+@pytest.mark.parametrize("offset", [0.0, 0.03, 0.09])
+def test_recovers_A_and_offset_with_the_correction_tables(offset): #the height, and so the correction, moves with the
+    #offset
+    rows = hertz_rows(20.0, offset, analysis.correction_factors, analysis.approximate_height)
+    fit = hertz_fit.fit_hertz(rows, P_RATIO, analysis.correction_factors, analysis.approximate_height)
+    assert fit.A == pytest.approx(20.0, rel=1e-6)
+    assert fit.offset == pytest.approx(offset, abs=1e-6)
+
+
+def test_noisy_fit_is_close():
+    fit = hertz_fit.fit_hertz(hertz_rows(20.0, 0.03, noise=STDEV), P_RATIO, constant_correction, constant_height)
+    assert fit.A == pytest.approx(20.0, rel=0.02)
+    assert fit.offset == pytest.approx(0.03, abs=0.005)
+    assert np.sqrt(fit.covariance[0][0]) < 0.02 * fit.A
+
+
+def test_too_few_measurements_in_the_depth_range():
+    assert hertz_fit.fit_hertz(hertz_rows(20.0, 0.0, number=14), P_RATIO, constant_correction, constant_height) is None
+
+
+@pytest.mark.parametrize("name", ["20250504/20250504_TPU_Test3.csv", "20250504/20250504_Origami_Test1.csv"])
+def test_measured_well_is_a_fixed_point(name): #the old loop stopped after 101 fits on these wells with the depths still
+    #0.01 to 0.03 mm from where the next fit put them, which gave an elastic modulus about 5 % lower
+    path = os.path.join(RESULTS, name)
+    if not os.path.exists(path):
+        pytest.skip(f"{name} is not in Results")
+    data = analysis.read_csv(path)
+    run_array = analysis.well_run_array([row for row in data if row[0] == "A1"], "A1")
+    fit = hertz_fit.fit_hertz(run_array, P_RATIO, analysis.correction_factors, analysis.approximate_height)
+    shifted = [[row[0] - fit.offset] + list(row[1:]) for row in run_array]
+    again = hertz_fit.fit_hertz(shifted, P_RATIO, analysis.correction_factors, analysis.approximate_height)
+    assert again.offset == pytest.approx(0, abs=1e-6)
+    assert again.A == pytest.approx(fit.A, rel=1e-6)
+
+
+def test_fit_plate_matches_fit_hertz(): #every well, including ones that cannot be fit and one without measurements
+    run_arrays = [hertz_rows(20.0, 0.03, noise=STDEV, seed=1), hertz_rows(5.0, -0.02, noise=STDEV, seed=2), [],
+                  hertz_rows(60.0, 0.1, noise=STDEV, seed=3, number=55), hertz_rows(20.0, 0.0, number=14),
+                  hertz_rows(12.0, 0.05, analysis.correction_factors, analysis.approximate_height, STDEV, seed=4)]
+    for correction, height in [(constant_correction, constant_height),
+                               (analysis.correction_factors, analysis.approximate_height)]:
+        plate = hertz_fit.fit_plate(run_arrays, P_RATIO, correction, height, analysis.find_E)
+        for run_array, fit, E in zip(run_arrays, plate.fits, plate.E):
+            single = hertz_fit.fit_hertz(run_array, P_RATIO, correction, height) if run_array != [] else None
+            if single is None:
+                assert fit is None and np.isnan(E)
+                continue
+            assert fit.A == pytest.approx(single.A, rel=1e-5)
+            assert fit.offset == pytest.approx(single.offset, abs=1e-6)
+            assert fit.covariance == pytest.approx(single.covariance, rel=1e-3)
+            assert fit.depths == pytest.approx(single.depths, abs=1e-6)
+            assert E == pytest.approx(analysis.find_E(single.A, P_RATIO), rel=1e-5)
+        assert [fit is None for fit in plate.fits] == [False, False, True, False, True, False]
+
+
+def test_fit_plate_with_a_poisson_s_ratio_for_every_well():
+    run_arrays = [hertz_rows(20.0, 0.03), hertz_rows(20.0, 0.03)]
+    plate = hertz_fit.fit_plate(run_arrays, [0.3, 0.5], constant_correction, constant_height, analysis.find_E)
+    assert plate.A == pytest.approx([20.0, 20.0], rel=1e-6)
+    assert plate.E == pytest.approx([analysis.find_E(20.0, 0.3), analysis.find_E(20.0, 0.5)], rel=1e-6)
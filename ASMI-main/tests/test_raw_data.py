@@ -0,0 +1,82 @@
+"""
+These are tests which check that the rows RawData keeps in memory reach the data file, and the disk, at the end of every
+well, once enough of them are saved or enough time has passed, and when the program exits part way through a well.
+"""
+
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analysis
+import raw_data
+
+ROWS = [["A1", "0.05", "0.005", "cusum"], ["A1", "-1.02", "0.01", "0.01", "0.0", "1"],
+        ["A1", "-1.04", "0.02", "0.02", "0.001", "2"]]
+
+
+def file_rows(path): #rows of the data file the way analysis reads it
+    return analysis.read_csv(str(path)) if os.path.exists(path) else []
+
+
+def test_rows_are_readable_after_end_well(tmp_path, monkeypatch):
+    syncs = []
+    monkeypatch.setattr(raw_data.os, "fsync", syncs.append)
+    path = tmp_path / "run.csv"
+    raw = raw_data.RawData(str(path), flush_rows=100, flush_interval=1000)
+    raw.start_well()
+    raw.write(ROWS[0])
+    raw.write_rows(ROWS[1:])
+    assert file_rows(path) == [] #still in memory
+    assert raw.rows == ROWS
+    raw.end_well()
+    assert file_rows(path) == ROWS
+    assert len(syncs) == 1
+    raw.end_well() #nothing new to write or sync
+    assert len(syncs) == 1
+    raw.start_well()
+    raw.write(["A2", "0.04", "0.004", "cusum"])
+    assert raw.rows == [["A2", "0.04", "0.004", "cusum"]] #only the rows of the well being tested
+    raw.close()
+    assert file_rows(path) == ROWS + [["A2", "0.04", "0.004", "cusum"]]
+    raw.close()
+
+
+def test_values_are_saved_as_text(tmp_path):
+    path = tmp_path / "run.csv"
+    raw = raw_data.RawData(str(path))
+    raw.write(["A1", -1.02, 0.5, 3])
+    raw.close()
+    assert file_rows(path) == [["A1", "-1.02", "0.5", "3"]]
+    assert raw.rows == [["A1", "-1.02", "0.5", "3"]]
+
+
+def test_flushes_after_flush_rows(tmp_path):
+    path = tmp_path / "run.csv"
+    raw = raw_data.RawData(str(path), flush_rows=3, flush_interval=1000)
+    raw.write(ROWS[0])
+    raw.write(ROWS[1])
+    assert file_rows(path) == []
+    raw.write(ROWS[2])
+    assert file_rows(path) == ROWS
+    raw.close()
+
+
+def test_flushes_after_flush_interval(tmp_path):
+    path = tmp_path / "run.csv"
+    raw = raw_data.RawData(str(path), flush_rows=100, flush_interval=0)
+    raw.write(ROWS[0])
+    assert file_rows(path) == ROWS[0:1]
+    raw.close()
+
+
+def test_rows_are_saved_when_the_program_exits(tmp_path): #part way through a well, without end_well or close
+    path = tmp_path / "run.csv"
+    program = ("import sys; sys.path.insert(0, sys.argv[1]); import raw_data; "
+               "raw = raw_data.RawData(sys.argv[2], flush_rows=100, flush_interval=1000); raw.start_well(); "
+               f"raw.write_rows({ROWS!r}); sys.exit(1)")
+    directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, "-c", program, directory, str(path)])
+    assert result.returncode == 1
+    assert file_rows(path) == ROWS
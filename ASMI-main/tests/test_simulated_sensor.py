@@ -0,0 +1,30 @@
+"""
+These are tests which check that the simulated sample pushes back on the indenter the way the analysis expects, so the
+elastic modulus found for it is the one it was given.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import force_correction
+import simulated_sensor
+
+
+@pytest.mark.parametrize("p_ratio,height", [(0.3, 4), (0.45, 2.5), (0.5, 6)])
+def test_corrected_force_is_hertzian(p_ratio, height):
+    sample = simulated_sensor.SimulatedSample(1e6, p_ratio, height)
+    depths = np.arange(0.02, 1.01, 0.02)
+    forces = [sample.force(sample.surface - depth) for depth in depths]
+    corrected = force_correction.correct(depths, forces, p_ratio, height)
+    assert corrected == pytest.approx(sample.A * depths ** 1.5, rel=1e-9)
+
+
+def test_no_force_above_the_surface():
+    sample = simulated_sensor.SimulatedSample()
+    assert sample.force(sample.surface) == 0.0
+    assert sample.force(sample.surface + 1) == 0.0
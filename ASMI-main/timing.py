@@ -0,0 +1,116 @@
+"""
+This is a module which keeps track of how long the parts of a run take, such as waking up the cnc, sending it commands,
+waiting for it to finish moving, reading the force sensor, saving rows to the data file and the analysis of every well.
+It is always on, timing a part only costs two reads of the clock and adding to a running total.
+
+Times are added up for every well, and for the run as a whole, and saved next to the results as rows of
+[well, part, calls, seconds]. The rows with "run" as the well are the totals over the whole run, which include the parts
+timed between wells, such as going home. Parts can happen inside of each other, sending a command happens while
+indenting for example, so the parts of a well do not add up to the "total" row of the well.
+
+The time left in a run is estimated from how long the wells tested so far took.
+"""
+
+import csv
+import functools
+import statistics
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+ESTIMATE = 9.2 * 60  # time in seconds a well is expected to take before any well of the run is finished
+RUN = "run"  # well the totals over the whole run are saved under
+TOTAL = "total"  # part the time from the start to the end of a well or the run is saved under
+
+
+class Timer: #adds up the time spent on each part of the well being tested and of the whole run
+    def __init__(self):
+        self.lock = Lock()  # parts can be timed from the threads watching the force sensor as well
+        self.start = time.perf_counter()
+        self.well = None  # well being tested, None between wells
+        self.well_start = None
+        self.wells = {}  # {well: {part: [calls, seconds]}}, wells tested more than once add up
+        self.between = {}  # parts timed between wells
+        self.well_times = []  # time every finished well took
+
+    def start_well(self, well):
+        self.well = well
+        self.wells.setdefault(well, {})
+        self.well_start = time.perf_counter()
+
+    def end_well(self):
+        if self.well is None:
+            return
+        seconds = time.perf_counter() - self.well_start
+        self.add(TOTAL, seconds)
+        self.well_times.append(seconds)
+        self.well = None
+
+    def add(self, part, seconds, calls=1): #add time spent on a part to the well being tested
+        with self.lock:
+            parts = self.wells[self.well] if self.well is not None else self.between
+            if part not in parts:
+                parts[part] = [0, 0.0]
+            parts[part][0] += calls
+            parts[part][1] += seconds
+
+    @contextmanager
+    def part(self, part): #time the code run inside of the with statement
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(part, time.perf_counter() - start)
+
+    def timed(self, part): #decorator timing every call of a function
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.part(part):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def remaining(self, wells_left): #estimated time in seconds to test the wells left
+        if not self.well_times:
+            return wells_left * ESTIMATE
+        return wells_left * statistics.mean(self.well_times)
+
+    def totals(self): #every part added up over the whole run
+        totals = {}
+        for parts in list(self.wells.values()) + [self.between]:
+            for part, (calls, seconds) in parts.items():
+                if part == TOTAL:
+                    continue
+                if part not in totals:
+                    totals[part] = [0, 0.0]
+                totals[part][0] += calls
+                totals[part][1] += seconds
+        totals[TOTAL] = [1, time.perf_counter() - self.start]
+        return totals
+
+    def rows(self): #rows of [well, part, calls, seconds] for every well and the whole run
+        with self.lock:
+            rows = []
+            for well, parts in self.wells.items():
+                for part, (calls, seconds) in parts.items():
+                    rows.append([well, part, calls, round(seconds, 4)])
+            for part, (calls, seconds) in self.totals().items():
+                rows.append([RUN, part, calls, round(seconds, 4)])
+        return rows
+
+    def save(self, filename): #write the timing report, replacing the one of an earlier run with the same name
+        with open(filename, 'w', newline='') as csvfile:
+            csvwriter = csv.writer(csvfile)
+            csvwriter.writerow(["well", "part", "calls", "seconds"])
+            csvwriter.writerows(self.rows())
+
+    def report(self): #print where the time of the run went, longest part first
+        totals = self.totals()
+        run_time = totals.pop(TOTAL)[1]
+        print(f"Run took {round(run_time / 60, 1)} minutes, {len(self.well_times)} wells tested")
+        for part, (calls, seconds) in sorted(totals.items(), key=lambda item: -item[1][1]):
+            print(f"  {part}: {round(seconds, 1)} s over {calls} calls, {round(1000 * seconds / calls, 1)} ms per call")
+
+
+timer = Timer()  # shared by every module timing a part of the run
@@ -0,0 +1,76 @@
+"""
+This is a module which finds a short order to visit a set of wells in, starting from and returning to the home position.
+Full rows and columns are visited in a serpentine, going up one column or row and back down the next, and any other set
+of wells is visited in nearest neighbour order improved with 2-opt, which keeps reversing parts of the order while that
+makes it shorter. The order the wells were entered in is kept if neither is shorter.
+"""
+
+import math
+
+
+def position(well, x, y): #x and y position of a well from the dictionaries the measure programs fill in
+    return float(x[well[0]]), float(y[well.lstrip("ABCDEFGH")])
+
+
+def tour_length(wells, x, y): #distance travelled from the home position through every well and back
+    points = [(0, 0)] + [position(well, x, y) for well in wells] + [(0, 0)]
+    length = 0
+    for i in range(0, len(points) - 1):
+        length = length + math.dist(points[i], points[i + 1])
+    return length
+
+
+def serpentine(wells, x, y): #shortest serpentine through the wells, or None if they are not full rows or columns
+    cols = sorted(set(well[0] for well in wells), key=lambda col: float(x[col]))
+    rows = sorted(set(well.lstrip("ABCDEFGH") for well in wells), key=lambda row: float(y[row]))
+    if len(wells) != len(cols) * len(rows):
+        return None
+    by_column = []
+    by_row = []
+    for i in range(0, len(cols)):
+        by_column.extend([cols[i] + row for row in (rows if i % 2 == 0 else reversed(rows))])
+    for i in range(0, len(rows)):
+        by_row.extend([col + rows[i] for col in (cols if i % 2 == 0 else reversed(cols))])
+    return min(by_column, by_row, key=lambda order: tour_length(order, x, y))
+
+
+def nearest_neighbour(wells, x, y): #always go to the closest well that has not been visited yet
+    order = []
+    left = list(wells)
+    current = (0, 0)
+    while left:
+        closest = min(left, key=lambda well: math.dist(current, position(well, x, y)))
+        order.append(closest)
+        left.remove(closest)
+        current = position(closest, x, y)
+    return order
+
+
+def two_opt(wells, x, y): #reverse parts of the order for as long as that makes the tour shorter
+    order = list(wells)
+    points = [(0, 0)] + [position(well, x, y) for well in order] + [(0, 0)]
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(points) - 2):
+            for j in range(i + 1, len(points) - 1):
+                change = (math.dist(points[i - 1], points[j]) + math.dist(points[i], points[j + 1])
+                          - math.dist(points[i - 1], points[i]) - math.dist(points[j], points[j + 1]))
+                if change < -1e-9:
+                    points[i:j + 1] = reversed(points[i:j + 1])
+                    order[i - 1:j] = reversed(order[i - 1:j])
+                    improved = True
+    return order
+
+
+def shortest_order(wells, x, y, speed): #shortest order found for the wells, printing how much travel time it saves
+    orders = [list(wells), two_opt(nearest_neighbour(wells, x, y), x, y)]
+    grid = serpentine(wells, x, y)
+    if grid is not None:
+        orders.append(grid)
+    order = min(orders, key=lambda order: tour_length(order, x, y))  # the entered order wins a tie
+    entered_time = tour_length(wells, x, y) / float(speed)  # speed is in mm/min
+    order_time = tour_length(order, x, y) / float(speed)
+    print(f"Estimated time moving between wells is {round(order_time, 1)} minutes, "
+          f"{round(entered_time - order_time, 1)} minutes less than in the order they were entered")
+    return order